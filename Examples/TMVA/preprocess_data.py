@@ -61,10 +61,49 @@ def combine_files(filenames, tree):
     return chain
 
 
+chunk_size = 100000
+
+single_variables = ['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntracks', 'ntowers']
+track_variables = ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']
+tower_variables = ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']
+
+
+def zero_pad(jagged, num):
+    '''
+    Zero-pad or truncate a jagged column to a fixed number of entries
+
+    Args:
+        jagged: Array with one array of values per event
+        num: Number of values per event that should be kept or zero-padded
+
+    Returns:
+        padded: Array with shape (number of events, num)
+    '''
+
+    import numpy as np
+
+    padded = np.zeros((len(jagged), num), dtype=np.float32)
+    lengths = np.array([len(values) for values in jagged], dtype=np.int64)
+    if num == 0 or lengths.sum() == 0:
+        return padded
+
+    # Position of every value in its event, values beyond num are dropped
+    values = np.concatenate(list(jagged))
+    offsets = np.cumsum(lengths) - lengths
+    events = np.repeat(np.arange(len(jagged)), lengths)
+    positions = np.arange(len(values)) - np.repeat(offsets, lengths)
+    keep = positions < num
+    padded[events[keep], positions[keep]] = values[keep]
+    return padded
+
+
 def add_tree(output_file, tree_name, chain, num_towers, num_tracks):
     '''
     Add tree to output ROOT file with zero-padded events from chain
 
+    The events are read in chunks of whole columns, padded with array
+    operations and appended to the output tree chunk by chunk.
+
     Args:
         output_file: Output ROOT file
         tree_name: Name of created tree
@@ -73,58 +112,36 @@ def add_tree(output_file, tree_name, chain, num_towers, num_tracks):
         num_tracks: Number of tracks that should be kept or zero-padded
     '''
 
-    from array import array
-
-    tree = ROOT.TTree(tree_name, tree_name)
+    import numpy as np
+    import root_numpy
 
-    # Define variables
-    variables = {}
-    single_variables = ['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntracks', 'ntowers']
-    for name in single_variables:
-        variables[name] = array('f', [-999])
-        tree.Branch(name, variables[name], '{0}/F'.format(name))
-
-    track_variables = ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']
+    # Define variables, same branches (all float) and order as before
+    columns = list(single_variables)
     for name in track_variables:
-        for i in range(num_tracks):
-            name_ = '{0}_{1}'.format(name, i)
-            variables[name_] = array('f', [-999])
-            tree.Branch(name_, variables[name_], '{0}/F'.format(name_))
-
-    tower_variables = ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']
+        columns += ['{0}_{1}'.format(name, i) for i in range(num_tracks)]
     for name in tower_variables:
-        for i in range(num_towers):
-            name_ = '{0}_{1}'.format(name, i)
-            variables[name_] = array('f', [-999])
-            tree.Branch(name_, variables[name_], '{0}/F'.format(name_))
-
-    # Load events from chain and push to output file
-    for event in chain:
-        # Add single variables
+        columns += ['{0}_{1}'.format(name, i) for i in range(num_towers)]
+    dtype = [(name, np.float32) for name in columns]
+
+    # Load events from chain in chunks and push to output file
+    output_file.cd()
+    tree = None
+    num_events = chain.GetEntries()
+    for start in range(0, num_events, chunk_size):
+        events = root_numpy.tree2array(chain, branches=single_variables + track_variables + tower_variables,
+                start=start, stop=min(start + chunk_size, num_events))
+        chunk = np.zeros(len(events), dtype=dtype)
         for name in single_variables:
-            variables[name][0] = getattr(event, name)
-
-        # Add track variables
-        for name in track_variables:
-            values = getattr(event, name)
-            # Set all variables to zero
-            for i in range(num_tracks):
-                variables['{0}_{1}'.format(name, i)][0] = 0.0
-            # Set variables and potentially leave the zeros untouched
-            for i in range(min(num_tracks, len(values))):
-                variables['{0}_{1}'.format(name, i)][0] = values[i]
-
-        # Add tower variables
-        for name in tower_variables:
-            values = getattr(event, name)
-            # Set all variables to zero
-            for i in range(num_towers):
-                variables['{0}_{1}'.format(name, i)][0] = 0.0
-            # Set variables and potentially leave the zeros untouched
-            for i in range(min(num_towers, len(values))):
-                variables['{0}_{1}'.format(name, i)][0] = values[i]
-
-        tree.Fill()
+            chunk[name] = events[name]
+        for variables, num in [(track_variables, num_tracks), (tower_variables, num_towers)]:
+            for name in variables:
+                padded = zero_pad(events[name], num)
+                for i in range(num):
+                    chunk['{0}_{1}'.format(name, i)] = padded[:, i]
+        tree = root_numpy.array2tree(chunk, name=tree_name, tree=tree)
+
+    if tree is None:
+        tree = root_numpy.array2tree(np.zeros(0, dtype=dtype), name=tree_name)
 
     # Write tree to file
     tree.Write()
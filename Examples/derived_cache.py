@@ -0,0 +1,126 @@
+from __future__ import print_function
+import os, sys, glob, json, hashlib, pickle, tempfile
+
+
+# Cache for derived tables (e.g. the jet shapes of flat_helper.py).
+# An entry is identified by a key built from
+#  - the input files, with their sizes and modification times
+#  - the parameters of the computation (numSamples, offset, ...)
+#  - the code version (the content of the files which do the computation)
+# so a changed input file, other parameters or changed code never return a stale table.
+# Entries are pickled data frames, written atomically (temporary file + rename),
+# the least recently used entries are removed if the cache gets larger than maxBytes.
+###########################################################################################
+
+defaultDirectory = os.environ.get('DERIVED_CACHE_DIR', 'derived_cache')
+defaultMaxBytes = 2 * 1024 ** 3
+
+
+def FileState(fileNames):
+    """Returns the (name, size, modification time) of the given files, sorted by name"""
+    state = []
+    for fileName in sorted(set(fileNames)):
+        stat = os.stat(fileName)
+        state.append([os.path.abspath(fileName), stat.st_size, stat.st_mtime])
+    return state
+
+
+def CodeVersion(fileNames):
+    """Returns a hash of the content of the given source files"""
+    sha = hashlib.sha1()
+    for fileName in fileNames:
+        # Use the source and not the compiled file of a module
+        if fileName.endswith('.pyc'):
+            fileName = fileName[:-1]
+        with open(fileName, 'rb') as fileIn:
+            sha.update(fileIn.read())
+    return sha.hexdigest()
+
+
+def CacheKey(name, inputFiles, parameters, codeFiles):
+    """Returns the key of a derived table"""
+    description = {'name': name,
+                   'inputs': FileState(inputFiles),
+                   'parameters': parameters,
+                   'code': CodeVersion(codeFiles)}
+    return name + '-' + hashlib.sha1(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class DerivedCache(object):
+    """Size-bounded cache of derived tables on disk"""
+
+    def __init__(self, directory=defaultDirectory, maxBytes=defaultMaxBytes, verbose=True):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def Path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def Report(self, message):
+        if self.verbose:
+            print(message)
+            sys.stdout.flush()
+
+    def Load(self, key):
+        """Returns the cached table or None if there is no (readable) entry"""
+        path = self.Path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as fileIn:
+                data = pickle.load(fileIn)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError) as error:
+            self.Report('Cache entry {0} is not readable ({1}), recomputing'.format(path, error))
+            return None
+        # The modification time marks the last use for the eviction
+        os.utime(path, None)
+        return data
+
+    def Store(self, key, data):
+        """Writes the table atomically and evicts old entries if the cache is too large"""
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as fileOut:
+                pickle.dump(data, fileOut, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary, self.Path(key))
+        except (IOError, OSError, pickle.PicklingError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.Evict(keep=key)
+
+    def Evict(self, keep=None):
+        """Removes the least recently used entries until the cache is smaller than maxBytes"""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.pkl')):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if keep is not None and path == self.Path(keep):
+                continue
+            os.remove(path)
+            total -= size
+            self.Report('Evicted {0} from the cache'.format(path))
+
+    def Get(self, name, compute, inputFiles, parameters, codeFiles, recompute=False):
+        """Returns the table name for the given inputs and parameters,
+           it is calculated with compute() if it is not cached (or recompute is True)"""
+        key = CacheKey(name, inputFiles, parameters, codeFiles)
+        data = None if recompute else self.Load(key)
+        if data is not None:
+            self.hits += 1
+            self.Report('Cache hit for {0} ({1})'.format(name, self.Path(key)))
+            return data
+        self.misses += 1
+        self.Report('Cache miss for {0}, computing {1}'.format(name, self.Path(key)))
+        data = compute()
+        self.Store(key, data)
+        return data
@@ -7,6 +7,8 @@ import pandas as pd
 import numpy as np
 import root_numpy
 
+import derived_cache
+
 from ROOT import TTree, TFile
 
 
@@ -16,124 +18,66 @@ from ROOT import TTree, TFile
 class BreakLoop(Exception): pass
 
     
-def GetJetShapes(rootFile, numSamples=-1, offset = 0, recompute = False):
+def GetJetShapes(rootFile, numSamples=-1, offset = 0, recompute = False, cache = None):
     """Returns a data frame containing the Jet shapes
        rootFile can be a pattern (e.g. /mydir/*.root)
-       The data frame is saved to a pickled file and reloaded from it (unless recompute is True)"""
-
+       The data frame is cached (see derived_cache.py) and reloaded from the cache
+       as long as the input files, the parameters and the code are unchanged (unless recompute is True)"""
 
-    import pandas as pd
-    import numpy as np
+    import glob
+    import jet_shapes
+    listOfFiles = sorted(glob.glob(rootFile))
+    if len(listOfFiles) == 0:
+        raise IOError('No input files match {0}'.format(rootFile))
 
-    pickleFileName = rootFile[1:rootFile.rfind('.')]+'.pkl'
-    pickleFileName=pickleFileName.replace('/','_')
-    pickleFileName=pickleFileName.replace('*','ALL')
-    
-    try:
-        if(recompute):
-            raise ValueError('Recompute')
-        # if the file cannot be opened, this raises an exception which leads to the actual recomputation.
-        with open(pickleFileName, 'rb') as fileP:
-            df = pickle.load(fileP)
-            print ("Loading from pickle file {0}".format(pickleFileName))
-            return df
-    except:
-    
+    def Compute():
         # Get raw input data from delphes
-        import glob
-        chain = ROOT.TChain("treeJets")
-        listOfFiles = glob.glob(rootFile)
-        for fileIn in listOfFiles:
-            chain.Add(fileIn)
-
-        # The progress bar does not (yet) work on swan: commenting out.
-        # try:
-        #     # show progress
-        #     from ipywidgets import FloatProgress
-        #     from IPython.display import display
-        #     progressBar = FloatProgress(min=0, max=100)
-        #     display(progressBar)    
-        #     show_progress = True
-        # except:
-        #     show_progress = False
-
-      
-        if numSamples < 0:
-            numSamples = chain.GetEntries()
-        data = pd.DataFrame(np.zeros((numSamples,4)), columns=['mass','ntowers','radial','dispersion'])
-
-        
-        # Loop over all events
-        ijet = 0
-        skipped = 0
-        try:
-            for event in chain:
-                
-                print('\r'+' Processing {0} [{1}]'.format(rootFile, float(ijet)/numSamples*100 ), end='')
-                sys.stdout.flush()
-                    
-                # if show_progress:
-                #     # Update progress bar
-                #     progressBar.value = float(ijet)/numSamples*100    
-                        
-                # Do jet selection here
-                if skipped < offset:
-                    skipped += 1
-                    continue
-
-                # Fill data
-                data.iloc[ijet] = CalculateJetShapes(event)
-
-                ijet += 1
-                if ijet >= numSamples:
-                    raise BreakLoop
-        except BreakLoop:
-            pass
-
-
-        print('\n')
+        # The shapes of all jets are calculated at once (see jet_shapes.py), CalculateJetShapes is the per-jet version
+        print(' Processing {0}'.format(rootFile))
         sys.stdout.flush()
+        return jet_shapes.GetJetShapesFromROOT(listOfFiles, numSamples, offset)[jet_shapes.shape_columns]
 
-        
-        if ijet < numSamples:
-            print('Only {:d} samples loaded (requested = {:d}). Not enough samples?'.format(ijet, numSamples))
+    cache = derived_cache.DerivedCache() if cache is None else cache
+    data = cache.Get('jet_shapes', Compute, listOfFiles, {'numSamples': numSamples, 'offset': offset},
+                     [__file__, jet_shapes.__file__], recompute)
 
-        with open(pickleFileName, 'wb') as fileP:
-            pickle.dump(data, fileP)
-        
-        return data
+    if len(data) < numSamples:
+        print('Only {:d} samples loaded (requested = {:d}). Not enough samples?'.format(len(data), numSamples))
+
+    return data
 
 
 ###########################################################################################
     
-def GetJetShapesFast(rootFileDir, numSamples=-1, offset = 0, recompute = False):
+def GetJetShapesFast(rootFileDir, numSamples=-1, offset = 0, recompute = False, cache = None):
     """Returns a data frame containing the Jet shapes
        rootFileDir should be a folder containing root files
-       The jet shapes are saved to a root file and reloaded from it (unless recompute is True).
-       This fast version uses a root macro to compute the shapes (iteration happens in C)"""
+       The jet shapes are cached (see derived_cache.py) and reloaded from the cache
+       as long as the input files, numSamples and the macro are unchanged (unless recompute is True).
+       This fast version uses a root macro to compute the shapes (iteration happens in C),
+       the macro always starts with the first jet, so offset is not used."""
+
+    import glob
+    macro = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CreateJetShapes.C')
+    listOfFiles = sorted(glob.glob(os.path.join(rootFileDir, '*.root')))
+    if len(listOfFiles) == 0:
+        raise IOError('No root files in {0}'.format(rootFileDir))
+
+    def Compute():
+        # Compute shapes with external macro into a temporary root file
+        import tempfile
+        handle, rootFileNameShapes = tempfile.mkstemp(suffix='_shapes.root')
+        os.close(handle)
+        try:
+            ROOT.gROOT.LoadMacro(macro)
+            ROOT.CreateJetShapes(rootFileDir,rootFileNameShapes,numSamples)
+            return GetShapesFromROOTFile(rootFileNameShapes)
+        finally:
+            os.remove(rootFileNameShapes)
 
-    
-    #rootFileNameShapes = rootFileDir[1:rootFileDir.rfind('.')]+'_shapes.root'
-    rootFileNameShapes = rootFileDir+'_shapes.root'
-    rootFileNameShapes=rootFileNameShapes.replace('/','_')
-    rootFileNameShapes=rootFileNameShapes.replace('*','ALL')
+    cache = derived_cache.DerivedCache() if cache is None else cache
+    data = cache.Get('jet_shapes_fast', Compute, listOfFiles, {'numSamples': numSamples}, [macro], recompute)
 
-    #print(rootFileNameShapes)
-    
-    try:
-        if(recompute):
-            raise ValueError('Recompute')
-        # if the file cannot be opened, this raises an exception which leads to the actual recomputation.
-        data = GetShapesFromROOTFile(rootFileNameShapes)
-        print ("Loading from root file {0}".format(rootFileNameShapes))
-    except:
-
-        # Compute shapes with external macro
-        ROOT.gROOT.LoadMacro("CreateJetShapes.C")
-        ROOT.CreateJetShapes(rootFileDir,rootFileNameShapes,numSamples)
-        
-        data = GetShapesFromROOTFile(rootFileNameShapes)    
-        
     if len(data) < numSamples:
         print('Only {:d} samples loaded (requested = {:d}). Not enough samples?'.format(len(data), numSamples))
 
@@ -0,0 +1,141 @@
+from __future__ import print_function
+import math
+import numpy as np
+import pandas as pd
+
+
+# Jet shapes for many jets at once.
+# The tracks of all jets are stored in one flat array per variable,
+# the tracks of jet i are values[offsets[i]:offsets[i+1]].
+# All shapes are calculated with segment reductions over these arrays,
+# so there is no python loop over jets or tracks (see CalculateJetShapes in flat_helper.py for the per-jet version).
+###########################################################################################
+
+shape_columns = ['mass', 'ntowers', 'radial', 'dispersion']
+extra_columns = ['ntracks', 'leadingPt', 'leSub', 'radial2', 'axisMajor', 'axisMinor']
+
+
+def SegmentSum(values, jetIndex, numJets):
+    """Sum of the values of each jet, jets without entries get 0"""
+    return np.bincount(jetIndex, weights=values, minlength=numJets)
+
+
+def SegmentMax(values, offsets, fill):
+    """Maximum of the values of each jet, jets without entries get fill"""
+    counts = np.diff(offsets)
+    result = np.full(len(counts), fill, dtype=np.float64)
+    nonEmpty = counts > 0
+    # reduceat over the starts of the non-empty jets only, so every segment ends where the next one starts
+    if nonEmpty.any():
+        result[nonEmpty] = np.maximum.reduceat(values, offsets[:-1][nonEmpty])
+    return result
+
+
+def CalculateJetShapesVectorized(jetPt, jetEta, jetPhi, jetMass, ntowers, trackPt, trackEta, trackPhi, offsets):
+    """Returns a data frame with the jet shapes of all jets
+       (the same shapes as CalculateJetShapes and additional moments).
+       The jet variables have one entry per jet, the track variables are flat arrays split by offsets."""
+
+    jetPt = np.asarray(jetPt, dtype=np.float64)
+    jetEta = np.asarray(jetEta, dtype=np.float64)
+    jetPhi = np.asarray(jetPhi, dtype=np.float64)
+    trackPt = np.asarray(trackPt, dtype=np.float64)
+    trackEta = np.asarray(trackEta, dtype=np.float64)
+    trackPhi = np.asarray(trackPhi, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    numJets = len(jetPt)
+    jetIndex = np.repeat(np.arange(numJets), np.diff(offsets))
+
+    # Skip tracks with unphysical eta (like CalculateJetShapes) and rebuild the offsets
+    good = np.abs(trackEta) <= 20.
+    jetIndex = jetIndex[good]
+    trackPt, trackEta, trackPhi = trackPt[good], trackEta[good], trackPhi[good]
+    numConst = np.bincount(jetIndex, minlength=numJets)
+    offsets = np.concatenate([[0], np.cumsum(numConst)])
+
+    # Distance to the jet axis, phi wraps around at 2 pi.
+    # The signed difference in [-pi, pi) is needed for the eta-phi moments, deltaR2 only needs its absolute value
+    signedDeltaPhi = (jetPhi[jetIndex] - trackPhi + math.pi) % (2 * math.pi) - math.pi
+    deltaPhi = np.abs(signedDeltaPhi)
+    deltaEta = jetEta[jetIndex] - trackEta
+    deltaR2 = deltaPhi * deltaPhi + deltaEta * deltaEta
+    deltaR = np.sqrt(deltaR2)
+
+    # Leading and subleading hadron pt, only the first leading track is removed for the subleading one
+    leadingPt = SegmentMax(trackPt, offsets, -999.)
+    isLeading = np.flatnonzero(trackPt == leadingPt[jetIndex])
+    _, first = np.unique(jetIndex[isLeading], return_index=True)
+    withoutLeading = trackPt.copy()
+    withoutLeading[isLeading[first]] = -np.inf
+    subleadingPt = SegmentMax(withoutLeading, offsets, -999.)
+    leSub = np.where(numConst > 1, leadingPt - subleadingPt, 1.)
+
+    # Radial moments and dispersion
+    ptSum = SegmentSum(trackPt, jetIndex, numJets)
+    pt2Sum = SegmentSum(trackPt * trackPt, jetIndex, numJets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radial = SegmentSum(trackPt * deltaR, jetIndex, numJets) / jetPt
+        radial2 = SegmentSum(trackPt * deltaR2, jetIndex, numJets) / jetPt
+        dispersion = np.where(ptSum != 0, np.sqrt(pt2Sum) / ptSum, 0.)
+
+    # Major and minor axis of the pt^2 weighted eta-phi distribution of the tracks
+    weight = trackPt * trackPt
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = np.where(pt2Sum > 0, pt2Sum, 1.)
+        meanEta = SegmentSum(weight * deltaEta, jetIndex, numJets) / norm
+        meanPhi = SegmentSum(weight * signedDeltaPhi, jetIndex, numJets) / norm
+        m11 = SegmentSum(weight * deltaEta * deltaEta, jetIndex, numJets) / norm - meanEta ** 2
+        m22 = SegmentSum(weight * signedDeltaPhi * signedDeltaPhi, jetIndex, numJets) / norm - meanPhi ** 2
+        m12 = SegmentSum(weight * deltaEta * signedDeltaPhi, jetIndex, numJets) / norm - meanEta * meanPhi
+    root = np.sqrt(np.maximum((m11 - m22) ** 2 / 4 + m12 * m12, 0.))
+    axisMajor = np.sqrt(np.maximum((m11 + m22) / 2 + root, 0.))
+    axisMinor = np.sqrt(np.maximum((m11 + m22) / 2 - root, 0.))
+
+    return pd.DataFrame({'mass': np.asarray(jetMass, dtype=np.float64),
+                         'ntowers': np.asarray(ntowers, dtype=np.float64),
+                         'radial': radial,
+                         'dispersion': dispersion,
+                         'ntracks': numConst,
+                         'leadingPt': leadingPt,
+                         'leSub': leSub,
+                         'radial2': radial2,
+                         'axisMajor': axisMajor,
+                         'axisMinor': axisMinor}, columns=shape_columns + extra_columns)
+
+
+def Concatenate(arrays):
+    """Concatenates a sequence of per-jet arrays and returns the flat values and the offsets"""
+    counts = np.array([len(a) for a in arrays], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    if offsets[-1] == 0:
+        return np.zeros(0), offsets
+    return np.concatenate(list(arrays)), offsets
+
+
+def GetJetShapesFromROOT(listOfFiles, numSamples=-1, offset=0):
+    """Reads the jets of the given root files with root_numpy and calculates their shapes"""
+    import root_numpy
+    branches = ['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntowers', 'trackPt', 'trackEta', 'trackPhi']
+    stop = None if numSamples < 0 else offset + numSamples
+    jets = root_numpy.root2array(listOfFiles, 'treeJets', branches=branches, start=offset, stop=stop)
+    trackPt, offsets = Concatenate(jets['trackPt'])
+    trackEta, _ = Concatenate(jets['trackEta'])
+    trackPhi, _ = Concatenate(jets['trackPhi'])
+    return CalculateJetShapesVectorized(jets['jetPt'], jets['jetEta'], jets['jetPhi'], jets['jetMass'], jets['ntowers'],
+                                        trackPt, trackEta, trackPhi, offsets)
+
+
+def GetJetShapesFromStore(fileName, numSamples=-1, offset=0):
+    """Calculates the shapes of the jets in a store written by converter.py (without root)"""
+    import sys, os
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import feature_store
+    store = feature_store.open_store(fileName)
+    stop = len(store) if numSamples < 0 else min(len(store), offset + numSamples)
+    jets = store.to_frame(['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntowers'], [], offset, stop)
+    trackPt, offsets = store.ragged('trackPt', offset, stop)
+    trackEta, _ = store.ragged('trackEta', offset, stop)
+    trackPhi, _ = store.ragged('trackPhi', offset, stop)
+    return CalculateJetShapesVectorized(jets['jetPt'].values, jets['jetEta'].values, jets['jetPhi'].values,
+                                        jets['jetMass'].values, jets['ntowers'].values,
+                                        trackPt, trackEta, trackPhi, offsets)
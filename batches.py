@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Shuffled mini-batches for the training.
+# Instead of shuffling the whole DataFrame every epoch, we shuffle a permutation of the row indices
+# and gather each batch into preallocated float32 buffers.
+# Optionally the next batches are gathered on a background thread while the network is trained.
+
+import queue
+import threading
+
+import numpy as np
+
+import feature_store
+
+
+class BatchEngine(object):
+    """
+    Iterates endlessly over random batches (x, column_1, column_2, ...) of the given data.
+    features is a float32 matrix (e.g. a memory-mapped feature store) or a list of matrices
+    which are used as if they were concatenated (e.g. the blocks of a virtual store), a matrix can be a
+    feature_store.Block as well, its rows are converted to float32 when they are gathered. columns is a list of
+    arrays with one entry per row (target, weights, ...), which are returned with shape (batch_size, 1).
+    The returned arrays are reused, a batch is only valid until the next batch is requested.
+    With a seed the sequence of batches is reproducible, start skips the first start batches of this sequence
+    (e.g. to continue a training at the same position).
+    With shard = (rank, n_shards) only every n_shards-th batch of the sequence, starting with batch rank, is returned,
+    so engines with the same seed and different ranks return disjoint batches (see data_parallel.py).
+    start counts the batches of this shard then.
+    """
+    def __init__(self, features, columns, batch_size, prefetch=0, seed=None, start=0, shard=None):
+        blocks = features if isinstance(features, list) else [features]
+        self.blocks = [block if isinstance(block, feature_store.Block)
+                       else np.require(block, dtype=np.float32, requirements=['C']) for block in blocks]
+        self.offsets = np.cumsum([0] + [len(block) for block in self.blocks])
+        self.length = int(self.offsets[-1])
+        self.n_features = self.blocks[0].shape[1]
+        self.columns = [np.require(np.reshape(c, (len(c), 1)), dtype=np.float32, requirements=['C']) for c in columns]
+        if self.length < batch_size:
+            raise ValueError('Need at least {} rows for one batch, got {}'.format(batch_size, self.length))
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.random = np.random.RandomState(seed)
+        self.start = start
+        self.shard = (0, 1) if shard is None else shard
+
+    def indices(self):
+        """
+        Endless sequence of row indices for each batch, the rows are reshuffled every epoch.
+        Inside a batch the indices are sorted, so the gather reads the memory in order.
+        """
+        n_batches = self.length // self.batch_size
+        rank, n_shards = self.shard
+        # The permutations of the skipped epochs are drawn anyway, so the random state is the same
+        skip = self.start * n_shards
+        position = 0
+        while True:
+            permutation = self.random.permutation(self.length)
+            if skip >= n_batches:
+                skip -= n_batches
+                continue
+            first, skip = skip, 0
+            for i in range(first, n_batches):
+                if position % n_shards == rank:
+                    yield np.sort(permutation[i * self.batch_size:(i + 1) * self.batch_size])
+                position += 1
+
+    def allocate(self):
+        x = np.empty((self.batch_size, self.n_features), dtype=np.float32)
+        return [x] + [np.empty((self.batch_size, 1), dtype=np.float32) for _ in self.columns]
+
+    def gather(self, index, buffers):
+        # The indices are sorted, so the rows of each block are a contiguous part of the batch
+        bounds = np.searchsorted(index, self.offsets)
+        for block, offset, first, last in zip(self.blocks, self.offsets, bounds[:-1], bounds[1:]):
+            if first < last and isinstance(block, feature_store.Block):
+                block.take(index[first:last] - offset, out=buffers[0][first:last])
+            elif first < last:
+                np.take(block, index[first:last] - offset, axis=0, out=buffers[0][first:last])
+        for column, buffer in zip(self.columns, buffers[1:]):
+            np.take(column, index, axis=0, out=buffer)
+        return buffers
+
+    def __iter__(self):
+        if self.prefetch > 0:
+            return self.prefetched()
+        return self.sequential()
+
+    def sequential(self):
+        buffers = self.allocate()
+        for index in self.indices():
+            yield tuple(self.gather(index, buffers))
+
+    def prefetched(self):
+        """
+        The batches are gathered on a background thread into a ring of prefetch + 2 buffers,
+        one is used by the training, up to prefetch are waiting and one is being filled.
+        An exception of the background thread is raised again in the training
+        """
+        free = queue.Queue()
+        ready = queue.Queue()
+        for _ in range(self.prefetch + 2):
+            free.put(self.allocate())
+        stop = threading.Event()
+
+        def producer():
+            try:
+                for index in self.indices():
+                    buffers = free.get()
+                    if stop.is_set():
+                        return
+                    ready.put(self.gather(index, buffers))
+            except Exception as e:
+                ready.put(e)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        current = None
+        try:
+            while True:
+                if current is not None:
+                    free.put(current)
+                current = ready.get()
+                if isinstance(current, Exception):
+                    raise current
+                yield tuple(current)
+        finally:
+            stop.set()
+            free.put(None)
+            thread.join()
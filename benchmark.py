@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Benchmarks of the expensive steps of our pipeline on synthetic jets, so they can be run without the samples on eos.
+# The four samples are generated as converted stores (see converter.py) with ragged tracks and towers
+# and then go through the same steps as the real data:
+#  flatten.py -> create_training_samples.py -> batch generation, boost weights, feed_dict against tf.data,
+#  scoring, Fisher fit, AUC
+# The timings are written as json file, so the results of different commits can be compared.
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import batches
+import converter
+import create_training_samples
+import evaluation
+import feature_store
+import fisher
+import flatten
+import numpy_model
+
+# The flat variables in the order of tf_model.variables (tf_model cannot be imported without tensorflow)
+variables = converter.jet_branches + flatten.flat_names()
+
+# Mean number of tracks and towers of quark and gluon jets. Gluon jets have more constituents,
+# the multiplicities follow negative binomial distributions with this shape parameter, so there is a tail of jets
+# with more constituents than the 52 tracks and 67 towers kept by flatten.py
+multiplicities = {'quarks': (14.0, 22.0), 'gluons': (20.0, 30.0)}
+multiplicity_shape = 6.0
+
+# The modified samples differ slightly from the standard ones, so the boost network has something to learn
+modified_scale = 1.02
+
+
+def synthetic_chunk(n_jets, particle, modified, random):
+    """
+    Returns the jet variables (n_jets, len(converter.jet_branches)) and the ragged tracks and towers
+    of n_jets synthetic jets, in the format written by converter.py.
+    The constituents are spread around the jet axis (R = 0.4) and share the transverse momentum of the jet,
+    the detector covers |eta| < 6 (see README.md).
+    """
+    mean_tracks, mean_towers = multiplicities[particle]
+    scale = modified_scale if modified else 1.0
+    ntracks = random.negative_binomial(multiplicity_shape, multiplicity_shape / (multiplicity_shape + mean_tracks), n_jets)
+    ntowers = random.negative_binomial(multiplicity_shape, multiplicity_shape / (multiplicity_shape + mean_towers), n_jets)
+
+    jetPt = (50.0 + random.exponential(150.0, n_jets)) * scale
+    jetEta = random.uniform(-2.5, 2.5, n_jets)
+    jetPhi = random.uniform(-math.pi, math.pi, n_jets)
+    jetMass = jetPt * random.gamma(4.0, 0.025, n_jets) * scale
+    jets = np.stack([jetPt, jetEta, jetPhi, jetMass, ntracks, ntowers], axis=1).astype(np.float32)
+
+    def constituents(counts, fraction):
+        # Returns the offsets, eta, phi and pt of the constituents, each jet gets fraction of its pt
+        offsets = np.zeros(n_jets + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        jet = np.repeat(np.arange(n_jets), counts)
+        eta = np.clip(jetEta[jet] + random.normal(0.0, 0.1 * scale, len(jet)), -6.0, 6.0)
+        phi = np.mod(jetPhi[jet] + random.normal(0.0, 0.1 * scale, len(jet)) + math.pi, 2 * math.pi) - math.pi
+        share = random.exponential(1.0, len(jet))
+        total = np.bincount(jet, weights=share, minlength=n_jets)
+        pt = share / np.where(total > 0, total, 1.0)[jet] * jetPt[jet] * fraction
+        return offsets, eta, phi, pt
+
+    ragged = {}
+    offsets, eta, phi, pt = constituents(ntracks, 0.6)
+    charge = random.choice([-1.0, 1.0], len(pt))
+    for name, values in [('trackPt', pt), ('trackEta', eta), ('trackPhi', phi), ('trackCharge', charge)]:
+        ragged[name] = (values.astype(np.float32), offsets)
+    offsets, eta, phi, pt = constituents(ntowers, 0.4)
+    energy = pt * np.cosh(eta)
+    em = random.uniform(0.0, 1.0, len(energy)) * energy
+    for name, values in [('towerE', energy), ('towerEem', em), ('towerEhad', energy - em),
+                         ('towerEta', eta), ('towerPhi', phi)]:
+        ragged[name] = (values.astype(np.float32), offsets)
+    return jets, ragged
+
+
+def write_synthetic_store(filename, n_jets, particle, modified, seed=None, chunk_size=feature_store.default_chunk_size):
+    """
+    Writes a store of n_jets synthetic jets like converter.py would do for the root files of one sample
+    """
+    random = np.random.RandomState(seed)
+    with converter.create_writer(filename) as writer:
+        for start in range(0, n_jets, chunk_size):
+            jets, ragged = synthetic_chunk(min(chunk_size, n_jets - start), particle, modified, random)
+            writer.append(jets, ragged=ragged)
+
+
+def write_random_model(filename, n_variables, hidden=400, n_layers=5, seed=None):
+    """
+    Writes a network with random weights in the format of numpy_model.export_weights
+    """
+    random = np.random.RandomState(seed)
+    shapes = [n_variables] + [hidden] * (n_layers - 1) + [1]
+    arrays = {'variables': np.array(variables)}
+    for i in range(n_layers):
+        arrays['weights_' + str(i)] = (random.normal(size=shapes[i:i + 2]) / np.sqrt(shapes[i])).astype(np.float32)
+        arrays['biases_' + str(i)] = np.zeros(shapes[i + 1], dtype=np.float32)
+    np.savez(filename, **arrays)
+
+
+def measure(function, rows, repeat=1):
+    """
+    Calls function repeat times and returns the timings, the throughput is calculated from the fastest call
+    """
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    return {'rows': rows, 'seconds': seconds, 'best': min(seconds), 'rows_per_second': rows / max(min(seconds), 1e-9)}
+
+
+def has_tensorflow():
+    try:
+        import tensorflow
+    except ImportError:
+        return False
+    return True
+
+
+def benchmark_flatten(directory, names, repeat):
+    def run():
+        for name in names:
+            flatten.flatten_store(feature_store.FeatureStore(os.path.join(directory, name + '.store')),
+                                  os.path.join(directory, name + '_flat.store'))
+    rows = sum(len(feature_store.FeatureStore(os.path.join(directory, name + '.store'))) for name in names)
+    return measure(run, rows, repeat)
+
+
+def benchmark_batches(filename, batch_size, n_batches, prefetch, repeat):
+    store = feature_store.open_store(filename)
+    engine = batches.BatchEngine(store.blocks(variables), [store.column('is_quark')], batch_size, prefetch=prefetch)
+
+    def run():
+        generator = iter(engine)
+        for _ in range(n_batches):
+            next(generator)
+        generator.close()
+    result = measure(run, n_batches * batch_size, repeat)
+    result['batches_per_second'] = n_batches / max(result['best'], 1e-9)
+    return result
+
+
+def benchmark_boost_weights(filename, directory, repeat):
+    """
+    Applies a randomly initialised network like tf_model.py applies the boost network,
+    the first call computes the weights, the following calls read the cache
+    """
+    import tensorflow as tf
+    import tf_model
+    tf.reset_default_graph()
+    x = tf.placeholder(tf.float32, [None, len(tf_model.variables)], name='x')
+    keep_prob = tf.placeholder_with_default(0.75, [], name='keep_prob')
+    activation = tf_model.get_model(x, keep_prob)
+    with tf.Session() as session:
+        session.run(tf.global_variables_initializer())
+        checkpoint = tf.train.Saver().save(session, os.path.join(directory, 'boost_model'))
+        rows = len(feature_store.open_store(filename))
+        compute = measure(lambda: tf_model.boost_weights(filename, checkpoint, session, x, activation,
+                                                         feed_dict={keep_prob: 1.0}), rows)
+        cached = measure(lambda: tf_model.boost_weights(filename, checkpoint, session, x, activation,
+                                                        feed_dict={keep_prob: 1.0}), rows, repeat)
+    return {'compute': compute, 'cached': cached, 'checkpoint': checkpoint}
+
+
+def benchmark_input_pipeline(iterations, log_interval):
+    """
+    Trains with tf_model.py once with feed_dict and once with tf.data on the samples in the current directory
+    and returns the examples per second of the inference training from the log of the instrumentation.
+    The first interval of the log is left out, it contains the start of the pipeline
+    """
+    results = {}
+    for mode in ['feed_dict', 'dataset']:
+        log = 'input_pipeline_' + mode + '.json'
+        subprocess.check_call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tf_model.py'),
+                               '--iterations', str(iterations), '--input-pipeline', mode,
+                               '--log', log, '--log-interval', str(log_interval)])
+        with open(log) as f:
+            rows = [json.loads(line) for line in f]
+        examples_per_second = [row['examples_per_second'] for row in rows if row['network'] == 'inference'][1:]
+        results[mode] = {'examples_per_second': float(np.median(examples_per_second)),
+                         'intervals': len(examples_per_second)}
+    results['speedup'] = results['dataset']['examples_per_second'] / results['feed_dict']['examples_per_second']
+    return results
+
+
+def benchmark_scoring(filename, model_file, checkpoint, batch_size, repeat):
+    results = {}
+    rows = len(feature_store.open_store(filename))
+    with numpy_model.NumpyModel(model_file, batch_size) as model:
+        results['numpy'] = measure(lambda: model.score_store(filename), rows, repeat)
+    if checkpoint is not None:
+        import scoring
+        with scoring.Scorer(checkpoint, layers=scoring.model_layers, batch_size=batch_size) as scorer:
+            results['tensorflow'] = measure(lambda: scorer.score_store(filename, variables), rows, repeat)
+    return results
+
+
+def benchmark_fisher(filename, workers, repeat):
+    model = fisher.StreamingFisher(variables)
+
+    def run():
+        model.statistics = [fisher.ClassStatistics(len(variables)), fisher.ClassStatistics(len(variables))]
+        model.fit_store(filename, workers=workers)
+    return measure(run, len(feature_store.open_store(filename)), repeat)
+
+
+def benchmark_auc(n_points, bins, n_bootstrap, repeat, seed=None):
+    random = np.random.RandomState(seed)
+    y = random.uniform(size=n_points) < 0.5
+    p = 1.0 / (1.0 + np.exp(-random.normal(np.where(y, 0.5, -0.5), 1.0)))
+    w = random.exponential(1.0, n_points)
+    return {'exact': measure(lambda: evaluation.auc(y, p), n_points, repeat),
+            'exact_weighted': measure(lambda: evaluation.auc(y, p, w), n_points, repeat),
+            'histogram': measure(lambda: evaluation.histogram_auc(*evaluation.histograms(y, p, bins=bins)),
+                                 n_points, repeat),
+            'bootstrap': measure(lambda: evaluation.bootstrap_auc(y, p, n_bootstrap=n_bootstrap, bins=bins),
+                                 n_points, repeat)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, directory):
+    names = ['gluons_modified', 'gluons_standard', 'quarks_modified', 'quarks_standard']
+    results = {}
+
+    print("Generate", len(names), "samples with", args.jets, "jets each in", directory)
+    def generate():
+        for i, name in enumerate(names):
+            particle, sample = name.split('_')
+            write_synthetic_store(os.path.join(directory, name + '.store'), args.jets, particle,
+                                  sample == 'modified', seed=args.seed + i)
+    results['generate'] = measure(generate, len(names) * args.jets)
+
+    print("Benchmark flatten")
+    results['flatten'] = benchmark_flatten(directory, names, args.repeat)
+    os.chdir(directory)
+    create_training_samples.write_sample('boost_training_sample.store', [('quarks_standard_flat.store', False),
+        ('quarks_modified_flat.store', True), ('gluons_standard_flat.store', False), ('gluons_modified_flat.store', True)],
+        'is_data')
+    create_training_samples.write_sample('inference_training_sample.store', [('quarks_standard_flat.store', True),
+        ('gluons_standard_flat.store', False)], 'is_quark')
+    create_training_samples.write_sample('inference_test_sample.store', [('quarks_modified_flat.store', True),
+        ('gluons_modified_flat.store', False)], 'is_quark')
+
+    print("Benchmark batch generation")
+    results['batches'] = {'prefetch_' + str(prefetch): benchmark_batches('inference_training_sample.store',
+                                                                          args.batch_size, args.batches, prefetch, args.repeat)
+                          for prefetch in [0, 2]}
+
+    checkpoint = None
+    if has_tensorflow():
+        print("Benchmark boost weights")
+        results['boost_weights'] = benchmark_boost_weights('inference_training_sample.store', directory, args.repeat)
+        checkpoint = results['boost_weights'].pop('checkpoint')
+        print("Benchmark feed_dict against tf.data")
+        results['input_pipeline'] = benchmark_input_pipeline(args.train_steps, args.log_interval)
+        print("Examples per second with tf.data relative to feed_dict: {:.2f}".format(results['input_pipeline']['speedup']))
+    else:
+        results['boost_weights'] = {'skipped': 'tensorflow is not installed'}
+        results['input_pipeline'] = {'skipped': 'tensorflow is not installed'}
+
+    print("Benchmark scoring")
+    write_random_model('random_model.npz', len(variables), seed=args.seed)
+    results['scoring'] = benchmark_scoring('inference_test_sample.store', 'random_model.npz', checkpoint,
+                                           args.score_batch_size, args.repeat)
+
+    print("Benchmark Fisher fit")
+    results['fisher'] = benchmark_fisher('inference_training_sample.store', args.workers, args.repeat)
+
+    print("Benchmark AUC")
+    results['auc'] = benchmark_auc(args.auc_points, args.bins, args.bootstrap, args.repeat, seed=args.seed)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic jets')
+    parser.add_argument('--jets', type=int, default=100000, help='Number of jets in each of the four samples')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='Json file with the results')
+    parser.add_argument('--directory', type=str, default=None,
+                        help='Directory for the generated samples, by default a temporary directory which is removed')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions of each measurement')
+    parser.add_argument('--batch-size', type=int, default=200, help='Training batch size')
+    parser.add_argument('--batches', type=int, default=5000, help='Number of training batches')
+    parser.add_argument('--train-steps', type=int, default=5000,
+                        help='Training steps of the comparison of feed_dict and tf.data (see tf_model.py --iterations)')
+    parser.add_argument('--log-interval', type=int, default=500, help='Steps per measurement of this comparison')
+    parser.add_argument('--score-batch-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes of the Fisher fit')
+    parser.add_argument('--auc-points', type=int, default=1000000, help='Number of predictions for the AUC')
+    parser.add_argument('--bins', type=int, default=evaluation.default_bins)
+    parser.add_argument('--bootstrap', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='benchmark-') if args.directory is None else os.path.abspath(args.directory)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        results = run(args, directory)
+    finally:
+        os.chdir(cwd)
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    report = {'commit': git_commit(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                          'numpy': np.__version__, 'cpus': multiprocessing.cpu_count()},
+              'parameters': vars(args),
+              'results': results}
+    with open(output + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(output + '.tmp', output)
+    print("Results written to", output)
@@ -5,12 +5,104 @@
 
 # We convert all provided root files into pandas.DataFrames
 # and save them as pickle files
+#
+# Alternatively (the default) the files are converted into feature stores (see feature_store.py),
+# with the jet variables and the tracks and towers as ragged columns, in the dtypes of schema.py.
+# In this mode every file is read in chunks of a fixed number of jets by a separate worker process,
+# so the memory usage does not depend on the size of the sample. Every file is written as its own store inside
+# the output directory, which is a virtual store over them (see feature_store.py), so the data is written only once.
 
+import argparse
 import glob
-import root_pandas
+import multiprocessing
+import os
+import shutil
 
-for name in ['gluons_modified', 'gluons_standard', 'quarks_modified', 'quarks_standard']:
-    print("Convert to pandas", name)
-    files = glob.glob(name + "/*.root")
-    root_pandas.read_root(files, 'treeJets').to_pickle(name + '.pickle')
+import numpy as np
+import pandas
 
+import feature_store
+import flatten
+import schema
+
+jet_branches = ['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntracks', 'ntowers']
+constituent_branches = flatten.track_columns + flatten.tower_columns
+
+
+def read_chunks(filename, chunk_size):
+    """
+    Reads the jets of the given file in chunks of chunk_size jets,
+    only the branches we need are read.
+    Besides root files, we accept pickled DataFrames in the format of the root tree
+    as stand-in files, so the conversion can be tested without root.
+    """
+    branches = jet_branches + constituent_branches
+    if filename.endswith('.root'):
+        import root_pandas
+        for chunk in root_pandas.read_root(filename, 'treeJets', columns=branches, chunksize=chunk_size):
+            yield chunk.reset_index(drop=True)
+    else:
+        df = pandas.read_pickle(filename)[branches]
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+
+
+def create_writer(filename):
+    return feature_store.StoreWriter(filename, jet_branches, ragged=schema.dtypes(constituent_branches))
+
+
+def convert_file(task):
+    """
+    Converts a single file into a store, this is executed in the worker processes
+    """
+    filename, output, chunk_size = task
+    with create_writer(output) as writer:
+        for chunk in read_chunks(filename, chunk_size):
+            writer.append(chunk[jet_branches].to_numpy(dtype=np.float32),
+                          ragged={name: flatten.ragged_offsets(chunk[name]) for name in constituent_branches})
+    return output
+
+
+def convert(files, output, chunk_size=feature_store.default_chunk_size, workers=None):
+    """
+    Converts the given files into one store, the files are converted in parallel into stores inside the output
+    directory and the output lists them in the given order.
+    If a file cannot be converted, the output is removed
+    """
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    if len(files) == 0:
+        # An empty virtual store would not know the variables
+        create_writer(output).close()
+        return
+    os.makedirs(output)
+    tasks = [(filename, os.path.join(output, str(i) + '.store'), chunk_size) for i, filename in enumerate(files)]
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            parts = pool.map(convert_file, tasks)
+        feature_store.write_manifest(output, [{'store': part} for part in parts])
+    except BaseException:
+        shutil.rmtree(output, ignore_errors=True)
+        raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the root files of each sample')
+    parser.add_argument('--mode', choices=['store', 'pickle'], default='store',
+                        help='Write feature stores (streaming, parallel) or pickled DataFrames')
+    parser.add_argument('--chunk-size', type=int, default=feature_store.default_chunk_size,
+                        help='Number of jets which are read at once from a file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes, by default all cores are used')
+    parser.add_argument('--samples', type=str, nargs='+', default=flatten.samples, help='Names of the samples to convert')
+    args = parser.parse_args()
+
+    for name in args.samples:
+        files = sorted(glob.glob(name + "/*.root"))
+        if args.mode == 'store':
+            print("Convert to store", name)
+            convert(files, name + '.store', args.chunk_size, args.workers)
+        else:
+            print("Convert to pandas", name)
+            import root_pandas
+            root_pandas.read_root(files, 'treeJets').to_pickle(name + '.pickle')
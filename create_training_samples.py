@@ -7,44 +7,47 @@
 # - training the boost network
 # - training the inference network
 # - test the inference network
+# These files are virtual stores (see feature_store.py), which only reference the flattened data
 
-import pandas
-
-df_qm = pandas.read_pickle("quarks_modified_flat.pickle")
-df_qs = pandas.read_pickle("quarks_standard_flat.pickle")
-df_gm = pandas.read_pickle("gluons_modified_flat.pickle")
-df_gs = pandas.read_pickle("gluons_standard_flat.pickle")
-
-# Add truth column for the boost network
-# here we want to train standard against modified events,
-# to learn the difference between MC and "data"
-df_qs['is_data'] = False
-df_qm['is_data'] = True
-df_gs['is_data'] = False
-df_gm['is_data'] = True
-
-df_boost = pandas.concat([df_qs, df_qm, df_gs, df_gm])
-df_boost.to_pickle('boost_training_sample.pickle')
-del df_boost
-del df_qs['is_data']
-del df_gs['is_data']
-del df_qm['is_data']
-del df_gm['is_data']
-
-# Add truth column for the inference network
-# quarks are considered signal
-# gluons are considered background
-df_qs['is_quark'] = True
-df_gs['is_quark'] = False
-df_inference = pandas.concat([df_qs, df_gs])
-df_inference.to_pickle('inference_training_sample.pickle')
-del df_inference
-
-# Add truth column for the inference network
-# quarks are considered signal
-# gluons are considered background
-df_qm['is_quark'] = True
-df_gm['is_quark'] = False
-df_inference_test = pandas.concat([df_qm, df_gm])
-df_inference_test.to_pickle('inference_test_sample.pickle')
-del df_inference_test
+import argparse
+
+import numpy as np
+
+import feature_store
+
+
+def write_sample(filename, sources, label):
+    """
+    Writes the concatenation of the given flat stores with the truth column label as virtual store,
+    sources is a list of (store, truth value) pairs. Only the manifest is written, the jets are not copied.
+    """
+    feature_store.write_manifest(filename, [{'store': store, 'columns': {label: truth}} for store, truth in sources],
+                                 {label: np.bool_})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the training and test samples from the flat samples')
+    parser.add_argument('--jet-frame', action='store_true',
+                        help='Use the flat samples transformed into the jet frame (see flatten.py --jet-frame)')
+    args = parser.parse_args()
+    postfix = '_transformed' if args.jet_frame else ''
+
+    df_qm = "quarks_modified_flat" + postfix + ".store"
+    df_qs = "quarks_standard_flat" + postfix + ".store"
+    df_gm = "gluons_modified_flat" + postfix + ".store"
+    df_gs = "gluons_standard_flat" + postfix + ".store"
+
+    # Add truth column for the boost network
+    # here we want to train standard against modified events,
+    # to learn the difference between MC and "data"
+    write_sample('boost_training_sample' + postfix + '.store', [(df_qs, False), (df_qm, True), (df_gs, False), (df_gm, True)], 'is_data')
+
+    # Add truth column for the inference network
+    # quarks are considered signal
+    # gluons are considered background
+    write_sample('inference_training_sample' + postfix + '.store', [(df_qs, True), (df_gs, False)], 'is_quark')
+
+    # Add truth column for the inference network
+    # quarks are considered signal
+    # gluons are considered background
+    write_sample('inference_test_sample' + postfix + '.store', [(df_qm, True), (df_gm, False)], 'is_quark')
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Data-parallel training with several local worker processes on the CPU (see tf_model.py --workers).
+# - every worker trains the same network on its own batches: the batches are drawn from the same shuffled
+#   sequence and batch i goes to worker i % n_workers, so the effective batch size is n_workers * batch_size
+# - after every step the gradients of all workers are averaged and applied by every worker (--average gradients),
+#   or every worker does sync_every local steps and then the parameters are averaged (--average parameters)
+# - the values are exchanged through shared memory: every worker writes its values, averages a slice of them
+#   for all workers and reads the averaged values back, separated by barriers
+# - every worker gets its own intra-op and inter-op thread pool, by default the cores are split between the workers
+# Called as script, the throughput of the training steps is measured for different numbers of workers
+# and the scaling efficiency (throughput with n workers / (n * throughput with one worker)) is reported.
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from parallel_scoring import thread_variables
+
+
+class Exchange(object):
+    """
+    Averages arrays of float32 values between n_workers processes through shared memory.
+    The values are exchanged in pieces of at most size values, so arrays of any length can be averaged.
+    It is created once in the parent process and passed to the workers, which select their rank.
+    """
+    def __init__(self, n_workers, size=2 ** 20, context=None):
+        context = multiprocessing.get_context('spawn') if context is None else context
+        self.n_workers = n_workers
+        self.size = size
+        self.rank = None
+        # One row for the values of each worker and one for the averages
+        self.memory = shared_memory.SharedMemory(create=True, size=(n_workers + 1) * size * 4)
+        self._barrier = context.Barrier(n_workers)
+
+    def attach(self, rank):
+        self.rank = rank
+        self.buffer = np.ndarray((self.n_workers + 1, self.size), dtype=np.float32, buffer=self.memory.buf)
+
+    def barrier(self):
+        self._barrier.wait()
+
+    def average(self, values):
+        """
+        Returns the average of the given float32 vectors of all workers, has to be called by all workers
+        """
+        values = np.asarray(values, dtype=np.float32)
+        result = np.empty_like(values)
+        for start in range(0, len(values), self.size):
+            n = min(self.size, len(values) - start)
+            # Each worker averages its share of the piece
+            bounds = np.linspace(0, n, self.n_workers + 1).astype(np.int64)
+            first, last = bounds[self.rank], bounds[self.rank + 1]
+            self.buffer[self.rank, :n] = values[start:start + n]
+            self.barrier()
+            np.mean(self.buffer[:self.n_workers, first:last], axis=0, out=self.buffer[self.n_workers, first:last])
+            self.barrier()
+            result[start:start + n] = self.buffer[self.n_workers, :n]
+        return result
+
+    def broadcast(self, values, root=0):
+        """
+        Returns the values of the root worker, has to be called by all workers
+        """
+        values = np.asarray(values, dtype=np.float32)
+        result = np.empty_like(values)
+        for start in range(0, len(values), self.size):
+            n = min(self.size, len(values) - start)
+            if self.rank == root:
+                self.buffer[self.n_workers, :n] = values[start:start + n]
+            self.barrier()
+            result[start:start + n] = self.buffer[self.n_workers, :n]
+            self.barrier()
+        return result
+
+    def abort(self):
+        """
+        Releases all workers waiting at a barrier (they get a threading.BrokenBarrierError), e.g. if a worker died
+        """
+        self._barrier.abort()
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('buffer', None)
+        return state
+
+
+class Worker(object):
+    """
+    One of n_workers training processes, see the description at the top.
+    average is 'gradients' or 'parameters', with 'parameters' the parameters are averaged every sync_every steps
+    """
+    def __init__(self, rank, exchange, average='gradients', sync_every=1):
+        self.rank = rank
+        self.n_workers = exchange.n_workers
+        self.exchange = exchange
+        self.average = average
+        self.sync_every = sync_every
+        exchange.attach(rank)
+
+    @property
+    def shard(self):
+        """
+        The batches of this worker, i.e. batch i of the shuffled sequence if i % n_workers == rank
+        """
+        return self.rank, self.n_workers
+
+    def barrier(self):
+        self.exchange.barrier()
+
+    def average_arrays(self, arrays):
+        return self.split(self.exchange.average(self.concatenate(arrays)), arrays)
+
+    def broadcast_arrays(self, arrays):
+        return self.split(self.exchange.broadcast(self.concatenate(arrays)), arrays)
+
+    @staticmethod
+    def concatenate(arrays):
+        return np.concatenate([np.ravel(np.asarray(a, dtype=np.float32)) for a in arrays])
+
+    @staticmethod
+    def split(values, arrays):
+        result = []
+        offset = 0
+        for a in arrays:
+            size = int(np.size(a))
+            result.append(values[offset:offset + size].reshape(np.shape(a)))
+            offset += size
+        return result
+
+
+class LocalStep(object):
+    """
+    A training step of a single process, run returns the loss of the step
+    """
+    def __init__(self, optimizer, loss):
+        self.minimize = optimizer.minimize(loss)
+        self.loss = loss
+
+    def run(self, session, step, feed_dict=None, **options):
+        _, loss_value = session.run([self.minimize, self.loss], feed_dict=feed_dict, **options)
+        return loss_value
+
+    def broadcast(self, session):
+        pass
+
+
+class SynchronousStep(object):
+    """
+    A training step of one of several workers, the gradients or the parameters of the network which
+    minimizes loss are averaged between the workers (see Worker). run returns the loss of the step,
+    averaged over the workers if the gradients are averaged
+    """
+    def __init__(self, optimizer, loss, worker):
+        import tensorflow as tf
+        self.worker = worker
+        self.loss = loss
+        grads_and_vars = [(g, v) for g, v in optimizer.compute_gradients(loss) if g is not None]
+        self.gradients = [g for g, _ in grads_and_vars]
+        self.variables = [v for _, v in grads_and_vars]
+        self.values = [tf.placeholder(v.dtype.base_dtype, v.shape) for v in self.variables]
+        self.assign = tf.group(*[v.assign(value) for v, value in zip(self.variables, self.values)])
+        if worker.average == 'gradients':
+            self.averaged = [tf.placeholder(v.dtype.base_dtype, v.shape) for v in self.variables]
+            self.apply = optimizer.apply_gradients(zip(self.averaged, self.variables))
+        else:
+            self.apply = optimizer.apply_gradients(grads_and_vars)
+
+    def run(self, session, step, feed_dict=None, **options):
+        if self.worker.average == 'gradients':
+            values = session.run(self.gradients + [self.loss], feed_dict=feed_dict, **options)
+            # The loss is averaged together with the gradients
+            values = self.worker.average_arrays(values)
+            session.run(self.apply, feed_dict=dict(zip(self.averaged, values[:-1])))
+            return float(values[-1])
+        _, loss_value = session.run([self.apply, self.loss], feed_dict=feed_dict, **options)
+        if (step + 1) % self.worker.sync_every == 0:
+            self.assign_values(session, self.worker.average_arrays(session.run(self.variables)))
+        return loss_value
+
+    def broadcast(self, session):
+        """
+        Sets the parameters of all workers to the ones of the first worker
+        """
+        self.assign_values(session, self.worker.broadcast_arrays(session.run(self.variables)))
+
+    def assign_values(self, session, values):
+        session.run(self.assign, feed_dict=dict(zip(self.values, values)))
+
+
+def minimize(optimizer, loss, worker=None):
+    """
+    Returns the training step which minimizes loss, synchronised between the workers if a worker is given
+    """
+    if worker is None:
+        return LocalStep(optimizer, loss)
+    return SynchronousStep(optimizer, loss, worker)
+
+
+def session_config(intra_threads=0, inter_threads=0):
+    """
+    Returns the tensorflow session configuration with the given thread pools, 0 uses the tensorflow default
+    """
+    import tensorflow as tf
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = intra_threads
+    config.inter_op_parallelism_threads = inter_threads
+    return config
+
+
+def default_threads(n_workers):
+    """
+    Returns the intra-op and inter-op threads of each of n_workers workers, the cores are split between them
+    """
+    return max(1, multiprocessing.cpu_count() // n_workers), 2
+
+
+def run_worker(function, args, rank, exchange, results):
+    worker = Worker(rank, exchange, args.average, args.sync_every)
+    try:
+        results.put((rank, function(args, worker)))
+    finally:
+        exchange.close()
+
+
+def launch(function, args):
+    """
+    Runs function(args, worker) in args.workers worker processes and returns the list of their return values.
+    args needs the attributes workers, average, sync_every, intra_threads and inter_threads,
+    threads which are 0 are replaced by default_threads. If a worker fails, all workers are stopped.
+    """
+    intra_threads, inter_threads = default_threads(args.workers)
+    args = argparse.Namespace(**vars(args))
+    args.intra_threads = args.intra_threads or intra_threads
+    args.inter_threads = args.inter_threads or inter_threads
+    context = multiprocessing.get_context('spawn')
+    exchange = Exchange(args.workers, context=context)
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, args=(function, args, rank, exchange, results))
+                 for rank in range(args.workers)]
+    # The environment is inherited by the workers, so they only use the cpu
+    # and the BLAS thread pools are limited before numpy and tensorflow are imported there
+    environment = {name: os.environ.get(name) for name in thread_variables + ['CUDA_VISIBLE_DEVICES']}
+    os.environ.update({name: str(args.intra_threads) for name in thread_variables})
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    try:
+        for process in processes:
+            process.start()
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        values = {}
+        while len(values) < len(processes):
+            try:
+                rank, value = results.get(timeout=1.0)
+                values[rank] = value
+            except queue.Empty:
+                failed = [p for p in processes if p.exitcode not in [None, 0]]
+                if failed:
+                    exchange.abort()
+                    raise RuntimeError('Worker {} failed with exit code {}'.format(processes.index(failed[0]),
+                                                                                   failed[0].exitcode))
+                if all(p.exitcode == 0 for p in processes) and results.empty():
+                    raise RuntimeError('The workers finished without results')
+        for process in processes:
+            process.join()
+        return [values[rank] for rank in range(len(processes))]
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        exchange.memory.close()
+        exchange.memory.unlink()
+
+
+def add_arguments(parser):
+    """
+    Adds the command line options of the data-parallel training to an argparse parser
+    """
+    parser.add_argument('--workers', type=int, default=1, help='Number of local worker processes which train together')
+    parser.add_argument('--average', choices=['gradients', 'parameters'], default='gradients',
+                        help='Average the gradients every step or the parameters every --sync-every steps')
+    parser.add_argument('--sync-every', type=int, default=1, help='Local steps between averaging the parameters')
+    parser.add_argument('--intra-threads', type=int, default=0,
+                        help='Threads of each operation, by default the cores are split between the workers')
+    parser.add_argument('--inter-threads', type=int, default=0, help='Operations running in parallel in each worker')
+
+
+def measure_steps(args, worker):
+    """
+    Trains the inference network for args.steps steps after args.warmup steps and returns the seconds
+    of the measured steps, this runs in each worker (see launch)
+    """
+    import tensorflow as tf
+    import tf_model
+    tf.set_random_seed(args.seed + worker.rank)
+    x = tf.placeholder(tf.float32, [None, len(tf_model.variables)], name='x')
+    y = tf.placeholder(tf.float32, [None, 1], name='y')
+    activation = tf_model.get_model(x)
+    loss = -tf.reduce_mean(y * tf.log(activation + 1e-5) + (1.0 - y) * tf.log(1 - activation + 1e-5))
+    train_step = minimize(tf.train.AdamOptimizer(learning_rate=0.0001), loss, worker)
+    session = tf.Session(config=session_config(args.intra_threads, args.inter_threads))
+    session.run(tf.global_variables_initializer())
+    train_step.broadcast(session)
+    batch = tf_model.batch_generator(args.input, args.target, args.batch_size, seed=args.seed, shard=worker.shard)
+    for step in range(args.warmup + args.steps):
+        if step == args.warmup:
+            worker.barrier()
+            start_time = time.perf_counter()
+        batch_xs, batch_ys = next(batch)
+        train_step.run(session, step, {x: batch_xs, y: batch_ys})
+    worker.barrier()
+    seconds = time.perf_counter() - start_time
+    session.close()
+    return seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the scaling of the data-parallel training')
+    parser.add_argument('--input', type=str, default='inference_training_sample.store')
+    parser.add_argument('--target', type=str, default='is_quark')
+    parser.add_argument('--scaling', type=int, nargs='+', default=[1, 2, 4], help='Numbers of workers to measure')
+    parser.add_argument('--average', choices=['gradients', 'parameters'], default='gradients')
+    parser.add_argument('--sync-every', type=int, default=1)
+    parser.add_argument('--intra-threads', type=int, default=0)
+    parser.add_argument('--inter-threads', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=200, help='Batch size of each worker')
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this json file')
+    args = parser.parse_args()
+
+    results = []
+    for n_workers in args.scaling:
+        args.workers = n_workers
+        seconds = max(launch(measure_steps, args))
+        examples_per_second = n_workers * args.batch_size * args.steps / seconds
+        baseline = results[0]['examples_per_second'] / results[0]['workers'] if results else examples_per_second / n_workers
+        results.append({'workers': n_workers, 'seconds': seconds, 'steps_per_second': args.steps / seconds,
+                        'examples_per_second': examples_per_second,
+                        'efficiency': examples_per_second / (n_workers * baseline)})
+        print('{workers} workers: {examples_per_second:.0f} examples/second, {steps_per_second:.1f} steps/second, '
+              'scaling efficiency {efficiency:.2f}'.format(**results[-1]))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
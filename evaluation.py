@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# ROC curves and (weighted) ROC AUC scores for large numbers of predictions, used by kpi.py
+# - the exact AUC needs a single sort of the predictions
+# - the histogram AUC needs a single pass and is exact up to the bin resolution
+# - bootstrap confidence intervals are calculated for all replicas at once, on the histograms or on the sorted
+#   predictions for the exact AUC
+# - with histograms the ROC curve is read from their cumulative sums as well
+# - ROC curves are decimated to a bounded number of points for plotting
+
+import numpy as np
+
+default_bins = 10000
+
+
+def roc_curve(y, p, w=None):
+    """
+    Returns false positive rate, true positive rate and thresholds
+    at every distinct value of the prediction p, w are optional weights
+    """
+    y = np.asarray(y).astype(bool)
+    p = np.asarray(p)
+    order = np.argsort(-p, kind='mergesort')
+    p_sorted = p[order]
+    y_sorted = y[order]
+    w_sorted = np.ones(len(p)) if w is None else np.asarray(w, dtype=np.float64)[order]
+    tp = np.cumsum(np.where(y_sorted, w_sorted, 0.0))
+    fp = np.cumsum(np.where(y_sorted, 0.0, w_sorted))
+    # Only the last entry of a group of equal predictions is a point of the curve
+    distinct = np.r_[np.flatnonzero(np.diff(p_sorted)), len(p) - 1]
+    tpr = np.r_[0.0, tp[distinct]] / tp[-1]
+    fpr = np.r_[0.0, fp[distinct]] / fp[-1]
+    thresholds = np.r_[np.inf, p_sorted[distinct]]
+    return fpr, tpr, thresholds
+
+
+def curve_auc(fpr, tpr):
+    """
+    Area under the given ROC curve
+    """
+    return np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2
+
+
+def auc(y, p, w=None):
+    """
+    Exact ROC AUC score (ties are counted half), w are optional weights
+    """
+    fpr, tpr, _ = roc_curve(y, p, w)
+    return curve_auc(fpr, tpr)
+
+
+def bin_index(p, bins=default_bins):
+    """
+    Returns the bin of each prediction, using bins equal-sized bins between the smallest and largest prediction
+    """
+    p = np.asarray(p, dtype=np.float64)
+    low, high = p.min(), p.max()
+    return np.clip(((p - low) / max(high - low, 1e-300) * bins).astype(np.int64), 0, bins - 1)
+
+
+def fill(y, index, w=None, bins=default_bins):
+    """
+    Returns the histograms of signal and background for the given bin indices
+    """
+    y = np.asarray(y).astype(bool)
+    w = np.ones(len(index)) if w is None else np.asarray(w, dtype=np.float64)
+    signal = np.bincount(index[y], weights=w[y], minlength=bins)
+    background = np.bincount(index[~y], weights=w[~y], minlength=bins)
+    return signal, background
+
+
+def histograms(y, p, w=None, bins=default_bins):
+    """
+    Returns the histograms of signal and background of the prediction p in bins equal-sized bins
+    """
+    return fill(y, bin_index(p, bins), w, bins)
+
+
+def histogram_curve(signal, background):
+    """
+    Returns false positive rate and true positive rate at the lower edge of every bin,
+    the ROC curve of the histograms without sorting the predictions
+    """
+    tp = np.r_[0.0, np.cumsum(signal[::-1])]
+    fp = np.r_[0.0, np.cumsum(background[::-1])]
+    return fp / fp[-1], tp / tp[-1]
+
+
+def histogram_auc(signal, background):
+    """
+    ROC AUC score from signal and background histograms, entries in the same bin are counted as ties.
+    The histograms can have a leading axis, e.g. for bootstrap replicas.
+    """
+    below = np.cumsum(background, axis=-1) - background
+    return np.sum(signal * (below + 0.5 * background), axis=-1) / (signal.sum(axis=-1) * background.sum(axis=-1))
+
+
+def bootstrap_auc(y, p, w=None, n_bootstrap=200, confidence=0.68, bins=default_bins, seed=None, chunk_entries=2**24):
+    """
+    Returns the histogram AUC and the lower and upper bound of its confidence interval,
+    or the exact AUC and its interval if bins is None.
+    Without weights the jets of the histograms are resampled per class, which is the same as drawing the
+    bin contents of all replicas from one multinomial distribution per class.
+    With weights (and for the exact AUC) every jet gets a Poisson distributed multiplicity in every replica,
+    the replicas are calculated together in chunks of about chunk_entries multiplicities.
+    """
+    random = np.random.RandomState(seed)
+    if bins is None:
+        return bootstrap_exact_auc(y, p, w, n_bootstrap, confidence, random, chunk_entries)
+    index = bin_index(p, bins)
+    signal, background = fill(y, index, w, bins)
+    if w is None:
+        n_signal, n_background = int(signal.sum()), int(background.sum())
+        signal_replicas = random.multinomial(n_signal, signal / n_signal, size=n_bootstrap)
+        background_replicas = random.multinomial(n_background, background / n_background, size=n_bootstrap)
+    else:
+        is_signal = np.asarray(y).astype(bool)
+        w = np.asarray(w, dtype=np.float64)
+        signal_replicas = np.empty((n_bootstrap, bins))
+        background_replicas = np.empty((n_bootstrap, bins))
+        chunk = max(1, chunk_entries // len(index))
+        for start in range(0, n_bootstrap, chunk):
+            n = min(chunk, n_bootstrap - start)
+            # Each replica fills its own range of bins of one histogram
+            weights = random.poisson(1.0, (n, len(index))) * w
+            replica_index = index + (np.arange(n) * bins)[:, np.newaxis]
+            for replicas, selection in [(signal_replicas, is_signal), (background_replicas, ~is_signal)]:
+                replicas[start:start + n] = np.bincount(replica_index[:, selection].ravel(),
+                                                        weights[:, selection].ravel(), n * bins).reshape(n, bins)
+    replicas = histogram_auc(signal_replicas, background_replicas)
+    lower, upper = np.percentile(replicas, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return histogram_auc(signal, background), lower, upper
+
+
+def bootstrap_exact_auc(y, p, w, n_bootstrap, confidence, random, chunk_entries):
+    """
+    Exact AUC and its bootstrap confidence interval, see bootstrap_auc.
+    The predictions are sorted once, every replica only needs the cumulative sums of its weights in this order
+    """
+    y = np.asarray(y).astype(bool)
+    p = np.asarray(p)
+    w = np.ones(len(p)) if w is None else np.asarray(w, dtype=np.float64)
+    order = np.argsort(-p, kind='mergesort')
+    p_sorted = p[order]
+    # Only the last entry of a group of equal predictions is a point of the curve (see roc_curve)
+    distinct = np.r_[np.flatnonzero(np.diff(p_sorted)), len(p) - 1]
+    replicas = np.empty(n_bootstrap)
+    chunk = max(1, chunk_entries // len(p))
+    for start in range(0, n_bootstrap, chunk):
+        n = min(chunk, n_bootstrap - start)
+        weights = (random.poisson(1.0, (n, len(p))) * w)[:, order]
+        tp = np.cumsum(np.where(y[order], weights, 0.0), axis=1)[:, distinct]
+        fp = np.cumsum(np.where(y[order], 0.0, weights), axis=1)[:, distinct]
+        tpr = np.hstack([np.zeros((n, 1)), tp]) / tp[:, -1:]
+        fpr = np.hstack([np.zeros((n, 1)), fp]) / fp[:, -1:]
+        replicas[start:start + n] = np.sum(np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]), axis=1) / 2
+    lower, upper = np.percentile(replicas, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return auc(y, p, w), lower, upper
+
+
+def decimate(fpr, tpr, max_points=1000):
+    """
+    Reduces a ROC curve to at most max_points points, equally spaced along the curve
+    """
+    if len(fpr) <= max_points:
+        return fpr, tpr
+    length = np.r_[0.0, np.cumsum(np.hypot(np.diff(fpr), np.diff(tpr)))]
+    index = np.unique(np.searchsorted(length, np.linspace(0, length[-1], max_points)))
+    index[-1] = len(fpr) - 1
+    return fpr[index], tpr[index]
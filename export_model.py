@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Exports the inference network of a checkpoint as frozen graph for the scoring (see scoring.Scorer).
+# The network is rebuilt in inference mode, i.e. without dropout, the weights and biases are read from the checkpoint
+# and folded into the graph as constants, and the graph is pruned to the path from the input x to the prediction p.
+# Loading the exported graph needs neither the import of the meta graph nor the restore of the checkpoint,
+# and the predictions are deterministic.
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import numpy_model
+
+
+def freeze(checkpoint, filename, layers=numpy_model.inference_layers):
+    """
+    Writes the network with the given layers of the checkpoint as frozen graph (a binary GraphDef) into filename,
+    the input is the placeholder x and the prediction is the tensor p
+    """
+    import tensorflow as tf
+    from tf_model import variables
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.float32, [None, len(variables)], name='x')
+        pred = x
+        for layer in layers:
+            with tf.name_scope(layer):
+                weights = tf.constant(reader.get_tensor(layer + '/weights').astype(np.float32), name='weights')
+                biases = tf.constant(reader.get_tensor(layer + '/biases').astype(np.float32), name='biases')
+                pred = tf.sigmoid(tf.matmul(pred, weights) + biases)
+        tf.identity(pred, name='p')
+    graph_def = tf.graph_util.extract_sub_graph(graph.as_graph_def(), ['p'])
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    os.replace(filename + '.tmp', filename)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the inference network of a checkpoint as frozen graph')
+    parser.add_argument('--checkpoint', type=str, default='inference_model_final-999999')
+    parser.add_argument('--output', type=str, default='inference_model_final.pb')
+    parser.add_argument('--check', type=str, default=None, metavar='STORE',
+                        help='Compare the frozen graph with the checkpoint on this store (load time, speed, predictions)')
+    args = parser.parse_args()
+
+    freeze(args.checkpoint, args.output)
+    print("Exported", args.checkpoint, "to", args.output, "({:.1f} MB)".format(os.path.getsize(args.output) / 1e6))
+
+    if args.check is not None:
+        import tensorflow as tf
+        import scoring
+        from tf_model import variables
+        tf.logging.set_verbosity(tf.logging.ERROR)
+        predictions = {}
+        for name, model, layers in [('checkpoint', args.checkpoint, numpy_model.inference_layers),
+                                    ('frozen graph', args.output, None)]:
+            start_time = time.time()
+            with scoring.Scorer(model, layers) as scorer:
+                load_time = time.time() - start_time
+                _, p = scorer.score_store(args.check, variables)
+                _, p_again = scorer.score_store(args.check, variables)
+            predictions[name] = p
+            print("{}: loaded in {:.2f}s, {:.0f} rows/second, deterministic: {}".format(
+                  name, load_time, scorer.rows_per_second, bool(np.array_equal(p, p_again))))
+        print("Maximal difference", np.max(np.abs(predictions['checkpoint'] - predictions['frozen graph'])))
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# A simple columnar feature store, which replaces the pickle files between the different stages.
+# A store is a directory containing
+#  - variables.bin: the float32 training variables as one contiguous matrix (row-major)
+#  - variables.<dtype>.bin: the variables with a compact dtype (see schema.py), one matrix for each dtype,
+#    e.g. variables.int8.bin contains the track charges. Readers always get float32 matrices.
+#  - <column>.bin: one file for each additional column (labels, weights, ...)
+#  - <name>.values.bin and <name>.offsets.bin: optional ragged columns (e.g. the tracks of each jet),
+#    the entries of row i are values[offsets[i]:offsets[i+1]]
+#    Ragged columns with the same offsets can be declared as padded group with a length n, then the store has
+#    the additional variables <name>_0 ... <name>_(n-1) for each column of the group, which contain the entries
+#    of each row in the stored order, zero-padded to n.
+#    These variables are densified only for the requested rows (e.g. a training batch), so a store of sorted
+#    tracks and towers needs only space for the real constituents instead of all zero-padded columns.
+#  - meta.json: the number of rows, the names and dtypes of the variables and the dtypes of the columns
+# All files are raw binary dumps, so they can be opened memory-mapped and sliced without copying.
+#
+# A virtual store is a directory containing a manifest.json, which lists row ranges of other stores
+# (which may be stored inside the directory, see converter.py) and constant columns (e.g. the truth) which are
+# added to them. It is read like the concatenation
+# of these row ranges, without copying the data on disk. Use open_store to open both kinds of stores.
+
+import json
+import os
+
+import numpy as np
+import pandas
+
+import schema
+
+default_chunk_size = 100000
+
+
+def variables_file(dtype):
+    """
+    Returns the name of the file containing the variables of the given dtype
+    """
+    dtype = np.dtype(dtype)
+    return 'variables.bin' if dtype == schema.float_dtype else 'variables.' + dtype.name + '.bin'
+
+
+def families(variables, variable_dtypes):
+    """
+    Groups the variables by their dtype, returns a list of (dtype, indices of the variables of this dtype),
+    the float32 variables come first
+    """
+    dtypes = sorted(set(variable_dtypes[v] for v in variables) | {schema.float_dtype},
+                    key=lambda dtype: (dtype != schema.float_dtype, dtype.str))
+    return [(dtype, [i for i, v in enumerate(variables) if variable_dtypes[v] == dtype]) for dtype in dtypes]
+
+
+class StoreWriter(object):
+    """
+    Writes a feature store incrementally, every call of append adds rows at the end of the store.
+    The meta data is written on close, so an incomplete store cannot be opened by accident.
+    The variables are stored with the dtypes of schema.py unless variable_dtypes is given.
+    padded is a list of (ragged columns, length) pairs, see the description at the top,
+    the columns of a group must have the same offsets and at most length entries in each row.
+    """
+    def __init__(self, path, variables, columns=None, ragged=None, variable_dtypes=None, padded=None):
+        self.path = path
+        self.variables = list(variables)
+        self.padded = [] if padded is None else [[list(names), int(length)] for names, length in padded]
+        dtypes = schema.dtypes(self.variables) if variable_dtypes is None else variable_dtypes
+        self.variable_dtypes = {v: np.dtype(dtypes[v]) for v in self.variables}
+        self.families = families(self.variables, self.variable_dtypes)
+        self.columns = {} if columns is None else {name: np.dtype(dtype).str for name, dtype in columns.items()}
+        self.ragged = {} if ragged is None else {name: np.dtype(dtype).str for name, dtype in ragged.items()}
+        self.length = 0
+        self.ragged_length = {name: 0 for name in self.ragged}
+        if any(name not in self.ragged for names, _ in self.padded for name in names):
+            raise ValueError('Padded columns {} have to be ragged columns'.format([names for names, _ in self.padded]))
+        os.makedirs(path, exist_ok=True)
+        for name in ['meta.json', 'manifest.json']:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        for name in os.listdir(path):
+            if name.startswith('variables.') and name.endswith('.bin'):
+                os.remove(os.path.join(path, name))
+        self.files = {variables_file(dtype): open(os.path.join(path, variables_file(dtype)), 'wb')
+                      for dtype, _ in self.families}
+        for name in self.columns:
+            self.files[name] = open(os.path.join(path, name + '.bin'), 'wb')
+        for name in self.ragged:
+            self.files[name + '.values'] = open(os.path.join(path, name + '.values.bin'), 'wb')
+            self.files[name + '.offsets'] = open(os.path.join(path, name + '.offsets.bin'), 'wb')
+            np.zeros(1, dtype=np.int64).tofile(self.files[name + '.offsets'])
+
+    def append(self, features, columns=None, ragged=None):
+        """
+        Append a block of rows, features has to be of shape (n_rows, len(variables)),
+        columns is a dictionary containing an array of length n_rows for each declared column,
+        ragged is a dictionary containing (values, offsets) for each declared ragged column,
+        where offsets has length n_rows + 1 and starts at 0
+        """
+        columns = {} if columns is None else columns
+        ragged = {} if ragged is None else ragged
+        features = np.asarray(features)
+        if features.ndim != 2 or features.shape[1] != len(self.variables):
+            raise ValueError('Expected features of shape (n, {}), got {}'.format(len(self.variables), features.shape))
+        if set(columns) != set(self.columns):
+            raise ValueError('Expected columns {}, got {}'.format(sorted(self.columns), sorted(columns)))
+        for name, dtype in self.columns.items():
+            if len(columns[name]) != len(features):
+                raise ValueError('Column {} has {} rows, expected {}'.format(name, len(columns[name]), len(features)))
+            np.ascontiguousarray(columns[name], dtype=dtype).tofile(self.files[name])
+        if set(ragged) != set(self.ragged):
+            raise ValueError('Expected ragged columns {}, got {}'.format(sorted(self.ragged), sorted(ragged)))
+        for names, length in self.padded:
+            counts = [np.diff(ragged[name][1]) for name in names]
+            if any(not np.array_equal(counts[0], c) for c in counts[1:]):
+                raise ValueError('The padded columns {} do not have the same offsets'.format(names))
+            if len(counts[0]) > 0 and np.max(counts[0]) > length:
+                raise ValueError('The padded columns {} have more than {} entries in a row'.format(names, length))
+        for name, dtype in self.ragged.items():
+            values, offsets = ragged[name]
+            if len(offsets) != len(features) + 1 or offsets[-1] - offsets[0] != len(values):
+                raise ValueError('Ragged column {} does not match {} rows'.format(name, len(features)))
+            schema.cast(values, dtype).tofile(self.files[name + '.values'])
+            (np.asarray(offsets[1:], dtype=np.int64) - offsets[0] + self.ragged_length[name]).tofile(self.files[name + '.offsets'])
+            self.ragged_length[name] += len(values)
+        for dtype, indices in self.families:
+            if len(indices) == len(self.variables):
+                block = features
+            elif len(indices) > 0 and indices[-1] - indices[0] + 1 == len(indices):
+                block = features[:, indices[0]:indices[-1] + 1]
+            else:
+                block = np.take(features, indices, axis=1)
+            schema.cast(block, dtype).tofile(self.files[variables_file(dtype)])
+        self.length += len(features)
+
+    def append_frame(self, df):
+        """
+        Append the rows of a pandas.DataFrame containing all variables and declared columns
+        """
+        for start in range(0, len(df), default_chunk_size):
+            chunk = df.iloc[start:start + default_chunk_size]
+            self.append(chunk[self.variables].to_numpy(dtype=np.float32),
+                        {name: chunk[name].values for name in self.columns})
+
+    def close(self, complete=True):
+        """
+        Closes the files and writes the meta data, an incomplete store (complete=False) gets no meta data
+        """
+        for f in self.files.values():
+            f.close()
+        if not complete:
+            return
+        meta = {'length': self.length, 'variables': self.variables, 'columns': self.columns, 'ragged': self.ragged,
+                'variable_dtypes': {v: dtype.str for v, dtype in self.variable_dtypes.items()}, 'padded': self.padded}
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(complete=exc[0] is None)
+
+
+def write_store(path, df, variables, columns=None):
+    """
+    Write the given pandas.DataFrame as feature store,
+    variables are stored in the float32 matrix, columns are stored with their own dtype
+    """
+    columns = [] if columns is None else columns
+    with StoreWriter(path, variables, {name: df[name].dtype for name in columns}) as writer:
+        writer.append_frame(df)
+
+
+def runs(source, target):
+    """
+    Splits the mapping of the columns source[i] -> target[i] into contiguous ranges,
+    returns a list of (source slice, target slice)
+    """
+    result = []
+    first = 0
+    for i in range(1, len(source) + 1):
+        if i == len(source) or source[i] != source[i - 1] + 1 or target[i] != target[i - 1] + 1:
+            result.append((slice(source[first], source[i - 1] + 1), slice(target[first], target[i - 1] + 1)))
+            first = i
+    return result
+
+
+class PaddedColumns(object):
+    """
+    A group of padded ragged columns (see the description at the top), which is used like a float32 matrix
+    of shape (n_rows, len(values) * length) with the zero-padded entries of the first column, then of the second, ...
+    values contains the entries of each column, offsets are the common offsets of the rows into them.
+    """
+    def __init__(self, values, offsets, length):
+        # The memory-mapped files are used as plain arrays, the indexing of numpy.memmap is slower
+        self.values = [np.asarray(v) for v in values]
+        self.offsets = np.asarray(offsets)
+        self.length = length
+        self.shape = (len(offsets) - 1, len(values) * length)
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        """
+        Returns the rows of the given slice, without copying
+        """
+        start, stop, step = rows.indices(self.shape[0])
+        if step != 1:
+            raise IndexError('Only contiguous rows of padded columns can be selected')
+        return PaddedColumns(self.values, self.offsets[start:max(stop, start) + 1], self.length)
+
+    def take(self, index, axis=0):
+        """
+        Returns the zero-padded rows with the given indices as float32 matrix
+        """
+        if axis != 0:
+            raise ValueError('Padded columns can only be gathered along the rows')
+        index = np.asarray(index)
+        starts = self.offsets[index]
+        counts = self.offsets[index + 1] - starts
+        slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + slots
+        # Position of the entries of the first column in the flattened output, the other columns follow after length
+        flat = np.repeat(np.arange(len(index)) * self.shape[1], counts) + slots
+        out = np.zeros((len(index), self.shape[1]), dtype=np.float32)
+        entries = out.reshape(-1)
+        for i, values in enumerate(self.values):
+            entries[flat] = values[positions]
+            flat += self.length
+        return out
+
+    def __array__(self, dtype=None):
+        out = self.take(np.arange(self.shape[0]))
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+class Block(object):
+    """
+    Rows of several stored matrices or padded columns (see FeatureStore.parts), which are used like one
+    float32 matrix. Only the requested rows are read, converted to float32 and densified,
+    e.g. by BatchEngine for every batch.
+    """
+    def __init__(self, parts, n_variables, length):
+        self.parts = [(matrix if isinstance(matrix, PaddedColumns) else np.asarray(matrix), columns)
+                      for matrix, columns in parts]
+        self.shape = (length, n_variables)
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def take(self, index, out=None):
+        """
+        Gathers the rows with the given indices into out (a float32 array of shape (len(index), n_variables))
+        """
+        out = np.empty((len(index), self.shape[1]), dtype=np.float32) if out is None else out
+        for matrix, columns in self.parts:
+            rows = matrix.take(index, axis=0)
+            for source, target in columns:
+                out[:, target] = rows[:, source]
+        return out
+
+    def __array__(self, dtype=None):
+        out = np.empty(self.shape, dtype=np.float32)
+        for matrix, columns in self.parts:
+            if isinstance(matrix, PaddedColumns):
+                matrix = np.asarray(matrix)
+            for source, target in columns:
+                out[:, target] = matrix[:, source]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+class FeatureStore(object):
+    """
+    Read access to a feature store. By default all files are opened memory-mapped and read-only,
+    so opening a store is instantaneous and slicing rows does not copy any data.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.length = meta['length']
+        self.stored_variables = meta['variables']
+        self.padded = meta.get('padded', [])
+        self.variables = self.stored_variables + [name + '_' + str(i) for names, length in self.padded
+                                                  for name in names for i in range(length)]
+        self.columns = {name: np.dtype(dtype) for name, dtype in meta['columns'].items()}
+        self.index = {v: i for i, v in enumerate(self.variables)}
+        self._columns = {name: self._open(name, dtype, (self.length,), mmap) for name, dtype in self.columns.items()}
+        self.ragged_columns = {name: np.dtype(dtype) for name, dtype in meta.get('ragged', {}).items()}
+        self._offsets = {name: self._open(name + '.offsets', np.int64, (self.length + 1,), mmap)
+                         for name in self.ragged_columns}
+        self._values = {name: self._open(name + '.values', dtype, (int(self._offsets[name][-1]),), mmap)
+                        for name, dtype in self.ragged_columns.items()}
+        # Stores written before the compact dtypes contain only float32 variables
+        dtypes = meta.get('variable_dtypes', {})
+        self.variable_dtypes = {v: np.dtype(dtypes.get(v, schema.float_dtype)) for v in self.stored_variables}
+        # Position of each variable as (matrix or padded column, column in it)
+        self.matrices = []
+        self.location = {}
+        for dtype, indices in families(self.stored_variables, self.variable_dtypes):
+            name = variables_file(dtype)[:-len('.bin')]
+            self.matrices.append(self._open(name, dtype, (self.length, len(indices)), mmap))
+            self.location.update({self.stored_variables[i]: (len(self.matrices) - 1, j) for j, i in enumerate(indices)})
+        for names, length in self.padded:
+            self.matrices.append(PaddedColumns([self._values[name] for name in names], self._offsets[names[0]], length))
+            for k, name in enumerate(names):
+                self.location.update({name + '_' + str(i): (len(self.matrices) - 1, k * length + i) for i in range(length)})
+                self.variable_dtypes.update({name + '_' + str(i): self.ragged_columns[name] for i in range(length)})
+
+    def _open(self, name, dtype, shape, mmap):
+        filename = os.path.join(self.path, name + '.bin')
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        if mmap:
+            return np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+        return np.fromfile(filename, dtype=dtype).reshape(shape)
+
+    def __len__(self):
+        return self.length
+
+    def modification_time(self):
+        return os.path.getmtime(os.path.join(self.path, 'meta.json'))
+
+    def blocks(self, variables):
+        """
+        Returns the given variables of all rows as list of matrices, for a stored store this is a single matrix
+        """
+        return [self.block(variables)]
+
+    def column(self, name, start=0, stop=None):
+        """
+        Returns the rows [start, stop) of the given column, without copying
+        """
+        return self._columns[name][start:stop]
+
+    def ragged(self, name, start=0, stop=None):
+        """
+        Returns the values and offsets of the given ragged column for the rows [start, stop).
+        The values are a view, the offsets are shifted so that they start at 0
+        """
+        offsets = self._offsets[name][start:(None if stop is None else stop + 1)]
+        values = self._values[name][offsets[0]:offsets[-1]]
+        return values, np.asarray(offsets) - offsets[0]
+
+    def rows(self, start=0, stop=None):
+        """
+        Returns the rows [start, stop) of all variables as float32 matrix,
+        without copying if all variables are stored as float32
+        """
+        return self.project(self.variables, start, stop)
+
+    def parts(self, variables, start=0, stop=None):
+        """
+        Returns where the given variables are stored for the rows [start, stop), as list of
+        (stored matrix, columns), one entry for each dtype and group of padded columns. The columns are a list of
+        (columns in the stored matrix, columns in the requested variables) slices, see runs
+        """
+        result = []
+        for m, matrix in enumerate(self.matrices):
+            pairs = [(self.location[v][1], j) for j, v in enumerate(variables) if self.location[v][0] == m]
+            if len(pairs) > 0:
+                source, target = zip(*pairs)
+                result.append((matrix[start:stop], runs(source, target)))
+        return result
+
+    def block(self, variables, start=0, stop=None):
+        """
+        Returns the given variables for the rows [start, stop) without reading them, either as view of the
+        float32 matrix or as Block which gathers them from the matrices of the different dtypes
+        """
+        parts = self.parts(variables, start, stop)
+        if (len(parts) == 1 and isinstance(parts[0][0], np.ndarray) and parts[0][0].dtype == np.float32
+                and len(parts[0][1]) == 1):
+            return parts[0][0][:, parts[0][1][0][0]]
+        return Block(parts, len(variables), len(self.matrices[0][start:stop]))
+
+    def project(self, variables, start=0, stop=None):
+        """
+        Returns the given variables for the rows [start, stop) as float32 matrix.
+        If the variables are a contiguous range of the stored float32 variables this is a view,
+        otherwise only the requested columns are copied.
+        """
+        return np.asarray(self.block(variables, start, stop))
+
+    def chunks(self, chunk_size=default_chunk_size):
+        """
+        Iterates over (start, stop) ranges covering the whole store
+        """
+        for start in range(0, self.length, chunk_size):
+            yield start, min(start + chunk_size, self.length)
+
+    def to_frame(self, variables=None, columns=None, start=0, stop=None):
+        """
+        Returns the requested variables and columns as pandas.DataFrame,
+        by default everything in the store is returned
+        """
+        return to_frame(self, variables, columns, start, stop)
+
+
+def to_frame(store, variables=None, columns=None, start=0, stop=None):
+    variables = store.variables if variables is None else variables
+    columns = list(store.columns) if columns is None else columns
+    df = pandas.DataFrame(np.array(store.project(variables, start, stop)), columns=variables)
+    for name in columns:
+        df[name] = np.array(store.column(name, start, stop))
+    return df
+
+
+def write_manifest(path, sources, columns=None):
+    """
+    Writes a virtual store, sources is a list of dictionaries with
+     - store: the path of a stored store
+     - start, stop: optional row range of this store, by default all rows are used
+     - columns: optional dictionary with the constant value of each declared column for these rows
+    columns is a dictionary with the dtype of each constant column.
+    """
+    columns = {} if columns is None else {name: np.dtype(dtype).str for name, dtype in columns.items()}
+    directory = os.path.dirname(os.path.abspath(path))
+    entries = []
+    length = 0
+    variables = None
+    for source in sources:
+        store = FeatureStore(source['store'])
+        start = source.get('start', 0)
+        stop = source.get('stop', len(store))
+        values = source.get('columns', {})
+        if set(values) != set(columns):
+            raise ValueError('Expected columns {}, got {}'.format(sorted(columns), sorted(values)))
+        variables = store.variables if variables is None else [v for v in variables if v in store.index]
+        entries.append({'store': os.path.relpath(os.path.abspath(source['store']), directory),
+                        'start': start, 'stop': stop,
+                        'columns': {name: np.array(value, dtype=columns[name]).item() for name, value in values.items()}})
+        length += stop - start
+
+    os.makedirs(path, exist_ok=True)
+    for name in ['meta.json', 'manifest.json']:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    manifest = {'length': length, 'variables': [] if variables is None else variables,
+                'columns': columns, 'sources': entries}
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+
+class VirtualStore(object):
+    """
+    Read access to a virtual store, it has the same interface as FeatureStore.
+    Row ranges inside one source are returned as views,
+    ranges spanning several sources are concatenated in memory.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.length = manifest['length']
+        self.variables = manifest['variables']
+        self.index = {v: i for i, v in enumerate(self.variables)}
+        self.sources = manifest['sources']
+        self.stores = [FeatureStore(os.path.join(os.path.dirname(os.path.abspath(path)), source['store']), mmap)
+                       for source in self.sources]
+        self.offsets = np.cumsum([0] + [source['stop'] - source['start'] for source in self.sources])
+        self.variable_dtypes = {v: self.stores[0].variable_dtypes[v] for v in self.variables} if self.stores else {}
+        self.constant_columns = {name: np.dtype(dtype) for name, dtype in manifest['columns'].items()}
+        # Columns of the underlying stores are available if every source has them
+        self.columns = dict(self.constant_columns)
+        if len(self.stores) > 0:
+            self.columns.update({name: dtype for name, dtype in self.stores[0].columns.items()
+                                 if all(name in store.columns for store in self.stores)})
+        self.ragged_columns = {}
+        if len(self.stores) > 0:
+            self.ragged_columns = {name: dtype for name, dtype in self.stores[0].ragged_columns.items()
+                                   if all(name in store.ragged_columns for store in self.stores)}
+
+    def __len__(self):
+        return self.length
+
+    def modification_time(self):
+        return max([os.path.getmtime(os.path.join(self.path, 'manifest.json'))] +
+                   [store.modification_time() for store in self.stores])
+
+    def pieces(self, start=0, stop=None):
+        """
+        Yields (source, first row, last row + 1) in the underlying stores for the rows [start, stop)
+        """
+        stop = self.length if stop is None else min(stop, self.length)
+        for i, source in enumerate(self.sources):
+            first = max(start, self.offsets[i])
+            last = min(stop, self.offsets[i + 1])
+            if first < last:
+                shift = source['start'] - self.offsets[i]
+                yield i, int(first + shift), int(last + shift)
+
+    def _concatenate(self, arrays, empty):
+        if len(arrays) == 1:
+            return arrays[0]
+        if len(arrays) == 0:
+            return empty
+        return np.concatenate(arrays)
+
+    def column(self, name, start=0, stop=None):
+        arrays = []
+        for i, first, last in self.pieces(start, stop):
+            if name in self.constant_columns:
+                arrays.append(np.full(last - first, self.sources[i]['columns'][name], dtype=self.columns[name]))
+            else:
+                arrays.append(self.stores[i].column(name, first, last))
+        return self._concatenate(arrays, np.zeros(0, dtype=self.columns[name]))
+
+    def ragged(self, name, start=0, stop=None):
+        """
+        Returns the values and offsets of the given ragged column for the rows [start, stop),
+        see FeatureStore.ragged. Ranges spanning several sources are concatenated in memory
+        """
+        pieces = [self.stores[i].ragged(name, first, last) for i, first, last in self.pieces(start, stop)]
+        if len(pieces) == 1:
+            return pieces[0]
+        if len(pieces) == 0:
+            return np.zeros(0, dtype=self.ragged_columns[name]), np.zeros(1, dtype=np.int64)
+        shifts = np.cumsum([0] + [len(values) for values, _ in pieces])
+        offsets = np.concatenate([offsets[:-1] + shift for (_, offsets), shift in zip(pieces, shifts)] + [shifts[-1:]])
+        return np.concatenate([values for values, _ in pieces]), offsets
+
+    def project(self, variables, start=0, stop=None):
+        arrays = [self.stores[i].project(variables, first, last) for i, first, last in self.pieces(start, stop)]
+        return self._concatenate(arrays, np.zeros((0, len(variables)), dtype=np.float32))
+
+    def rows(self, start=0, stop=None):
+        return self.project(self.variables, start, stop)
+
+    def blocks(self, variables):
+        """
+        Returns the given variables of all rows as list of matrices, one for each source
+        """
+        return [self.stores[i].block(variables, first, last) for i, first, last in self.pieces()]
+
+    def chunks(self, chunk_size=default_chunk_size):
+        """
+        Iterates over (start, stop) ranges covering the whole store,
+        the ranges do not cross the boundaries of the sources, so they can be read without copying
+        """
+        for i in range(len(self.sources)):
+            for start in range(self.offsets[i], self.offsets[i + 1], chunk_size):
+                yield int(start), int(min(start + chunk_size, self.offsets[i + 1]))
+
+    def to_frame(self, variables=None, columns=None, start=0, stop=None):
+        return to_frame(self, variables, columns, start, stop)
+
+
+def open_store(path, mmap=True):
+    """
+    Opens a stored or a virtual store
+    """
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        return VirtualStore(path, mmap)
+    return FeatureStore(path, mmap)
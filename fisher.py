@@ -3,14 +3,26 @@
 
 # Thomas Keck and Jochen Gemmler 2017
 
-import pandas
+# Fisher discriminant (linear discriminant analysis) for two classes.
+# The per-class counts, means and scatter matrices are accumulated chunk by chunk in parallel and merged,
+# so the memory usage does not depend on the number of jets.
+# The variables are standardised with the pooled standard deviations and their correlation matrix is shrunk
+# towards the identity, this keeps it invertible even though many of the zero-padded track and tower columns
+# are (almost) always zero. Unlike a shrinkage of the covariance towards a multiple of the identity,
+# the discriminant does not depend on the scales of the variables, which differ by orders of magnitude.
+
+import argparse
+import multiprocessing
+
 import numpy as np
-import sklearn
-import sklearn.discriminant_analysis
+import pandas
+
+import feature_store
+
+chunk_size = 25000
 
-# We do not use all variables in fisher,
-# because this would lead to a singular covariance matrix
-# and the method fails.
+# We use all available variables,
+# thanks to the shrinkage the covariance matrix is not singular
 variables = ['jetPt', 'jetEta', 'jetPhi', 'jetMass', 'ntracks', 'ntowers']
 for v in ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']:
     for i in range(52):
@@ -19,22 +31,133 @@ for v in ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']:
     for i in range(67):
         variables += [v + '_' + str(i)]
 
-train_data = pandas.read_pickle('inference_training_sample.pickle')
-x_train = train_data[variables].values
-y_train = train_data['is_quark'].values
-
-fisher = sklearn.discriminant_analysis.LinearDiscriminantAnalysis()
-fisher.fit(x_train, y_train)
-
-x_train = np.require(x_train, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-probability = fisher.predict_proba(x_train)[:, 1]
-df_result_train = pandas.DataFrame({'y': y_train, 'p': probability})
-df_result_train.to_pickle('result_train_fisher.pickle')
-
-test_data = pandas.read_pickle('inference_test_sample.pickle')
-x_test = test_data[variables].values
-y_test = test_data['is_quark'].values
-x_test = np.require(x_test, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-probability = fisher.predict_proba(x_test)[:, 1]
-df_result_test = pandas.DataFrame({'y': y_test, 'p': probability})
-df_result_test.to_pickle('result_test_fisher.pickle')
+
+class ClassStatistics(object):
+    """
+    Number of entries, mean and scatter matrix (sum of the outer products of the deviations from the mean)
+    """
+    def __init__(self, n_variables):
+        self.n = 0
+        self.mean = np.zeros(n_variables)
+        self.scatter = np.zeros((n_variables, n_variables))
+
+    def add(self, X):
+        """
+        Adds the rows of X
+        """
+        other = ClassStatistics(X.shape[1])
+        other.n = len(X)
+        if other.n > 0:
+            X = np.asarray(X, dtype=np.float64)
+            other.mean = X.mean(axis=0)
+            deviation = X - other.mean
+            other.scatter = deviation.T @ deviation
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Merges the statistics of another set of entries (Chan et al.)
+        """
+        n = self.n + other.n
+        if other.n == 0:
+            return
+        delta = other.mean - self.mean
+        self.scatter += other.scatter + np.outer(delta, delta) * (self.n * other.n / n)
+        self.mean += delta * (other.n / n)
+        self.n = n
+
+
+def chunk_statistics(task):
+    """
+    Calculates the statistics of both classes for the rows [start, stop) of a store,
+    this is executed in the worker processes
+    """
+    filename, variables, target, start, stop = task
+    store = feature_store.open_store(filename)
+    X = store.project(variables, start, stop)
+    y = np.asarray(store.column(target, start, stop)).astype(bool)
+    statistics = [ClassStatistics(len(variables)), ClassStatistics(len(variables))]
+    statistics[0].add(X[~y])
+    statistics[1].add(X[y])
+    return statistics
+
+
+class StreamingFisher(object):
+    """
+    Fisher discriminant which is trained on a store without loading it into memory.
+    predict_proba returns the same probability as the linear discriminant analysis of sklearn,
+    up to the shrinkage of the correlation matrix.
+    """
+    def __init__(self, variables, shrinkage=1e-3):
+        self.variables = variables
+        self.shrinkage = shrinkage
+        self.statistics = [ClassStatistics(len(variables)), ClassStatistics(len(variables))]
+        self.coefficients = None
+        self.intercept = None
+
+    def fit_store(self, filename, target='is_quark', workers=None):
+        """
+        Accumulates the statistics of all chunks of the store in parallel and calculates the discriminant
+        """
+        store = feature_store.open_store(filename)
+        tasks = [(filename, self.variables, target, start, stop) for start, stop in store.chunks(chunk_size)]
+        with multiprocessing.Pool(workers) as pool:
+            for statistics in pool.imap_unordered(chunk_statistics, tasks):
+                for mine, other in zip(self.statistics, statistics):
+                    mine.merge(other)
+        return self.finalize()
+
+    def finalize(self):
+        """
+        Calculates the discriminant from the accumulated statistics
+        """
+        background, signal = self.statistics
+        n = background.n + signal.n
+        covariance = (background.scatter + signal.scatter) / (n - 2)
+        # Constant columns keep their scale, their correlations are zero
+        scale = np.sqrt(np.diag(covariance))
+        scale[scale == 0] = 1.0
+        correlation = covariance / np.outer(scale, scale)
+        correlation = (1 - self.shrinkage) * correlation + self.shrinkage * np.eye(len(correlation))
+        self.coefficients = np.linalg.solve(correlation, (signal.mean - background.mean) / scale) / scale
+        self.intercept = (-0.5 * np.dot(self.coefficients, signal.mean + background.mean)
+                          + np.log(signal.n / background.n))
+        return self
+
+    def decision_function(self, X):
+        return np.asarray(X, dtype=np.float32) @ self.coefficients.astype(np.float32) + np.float32(self.intercept)
+
+    def predict_proba(self, X):
+        """
+        Probability to be signal
+        """
+        return 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+
+    def score_store(self, filename, target='is_quark'):
+        """
+        Returns the truth and the signal probability for every jet in the given store
+        """
+        store = feature_store.open_store(filename)
+        p = np.empty(len(store), dtype=np.float32)
+        for start, stop in store.chunks():
+            p[start:stop] = self.predict_proba(store.project(self.variables, start, stop))
+        return np.array(store.column(target)), p
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and apply a Fisher discriminant')
+    parser.add_argument('--shrinkage', type=float, default=1e-3,
+                        help='Weight of the identity in the regularised correlation matrix of the standardised variables')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes, by default all cores')
+    args = parser.parse_args()
+
+    fisher = StreamingFisher(variables, args.shrinkage)
+    fisher.fit_store('inference_training_sample.store', workers=args.workers)
+
+    y_train, probability = fisher.score_store('inference_training_sample.store')
+    df_result_train = pandas.DataFrame({'y': y_train, 'p': probability})
+    df_result_train.to_pickle('result_train_fisher.pickle')
+
+    y_test, probability = fisher.score_store('inference_test_sample.store')
+    df_result_test = pandas.DataFrame({'y': y_test, 'p': probability})
+    df_result_test.to_pickle('result_test_fisher.pickle')
@@ -8,24 +8,118 @@
 #    adding 67*5 tower columns (for each of the possible 67 towers and 5 variables per tower)
 # The columns are sorted according to decreasing transverse momentum and energy for tracks and towers, respectively.
 # If there are less tracks or towers the remaining columns are set to 0
+# The columns have the dtypes of schema.py (float32, the track charges int8 and the multiplicities uint8)
+#
+# With --sparse the tracks and towers are only sorted and stored as padded ragged columns (see feature_store.py),
+# the store has the same variables, but the zero-padded columns are created only for the rows which are read,
+# e.g. for each training batch. The size of such a store scales with the number of constituents.
+
+import argparse
+import os
 
 import pandas
 import numpy as np
 
-def myargsort(x):
+import feature_store
+import schema
+
+maxtracks = 52 # df.ntracks.max()
+maxtowers = 67 # df.ntowers.max()
+track_columns = ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']
+tower_columns = ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']
+samples = ['gluons_modified', 'gluons_standard', 'quarks_modified', 'quarks_standard']
+
+
+def ragged_offsets(column):
     """
-    Sort the given ndarray, reverse the order and return the indices as integers
-    We use this indices to sort our columns below
+    Concatenate a column of per-jet arrays into one value array.
+    Returns the values and the offsets, so that the constituents of jet i
+    are values[offsets[i]:offsets[i+1]]
     """
-    return np.argsort(x)[::-1].astype(int)
+    arrays = list(column)
+    counts = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.zeros(0, dtype=schema.float_dtype), offsets
+    return np.concatenate(arrays), offsets
 
-for name in ['gluons_modified', 'gluons_standard', 'quarks_modified', 'quarks_standard']:
-    print("Process file", name)
-    df = pandas.read_pickle(name + '.pickle')
 
-    # Flatten and zero-pad tracks
-    maxtracks = 52 # df.ntracks.max()
-    trackorder = df.trackPt.apply(myargsort).values
+def descending_order(keys, offsets, maxlength):
+    """
+    Calculates the descending order of the keys inside each jet for all jets at once.
+    Returns a (n_jets, maxlength) array with the positions of the sorted constituents
+    in the concatenated value array and a mask which is False for the zero-padded slots.
+    Only the leading maxlength constituents are kept, so if a jet has more constituents
+    we only do a partial sort.
+    """
+    n_jets = len(offsets) - 1
+    counts = np.diff(offsets)
+    width = max(int(counts.max()) if n_jets > 0 else 0, 1)
+
+    # Scatter the keys into a padded matrix, the padding is sorted behind every real constituent
+    rows = np.repeat(np.arange(n_jets), counts)
+    slots = np.arange(len(keys)) - np.repeat(offsets[:-1], counts)
+    padded_keys = np.full((n_jets, width), -np.inf)
+    padded_keys[rows, slots] = keys
+
+    if width > maxlength:
+        candidates = np.argpartition(-padded_keys, maxlength - 1, axis=1)[:, :maxlength]
+    else:
+        candidates = np.broadcast_to(np.arange(width), (n_jets, width))
+    candidate_keys = np.take_along_axis(padded_keys, candidates, axis=1)
+    order = np.take_along_axis(candidates, np.argsort(-candidate_keys, axis=1, kind='stable'), axis=1)
+
+    mask = order < counts[:, np.newaxis]
+    positions = np.where(mask, offsets[:-1, np.newaxis] + order, 0)
+    if positions.shape[1] < maxlength:
+        pad = maxlength - positions.shape[1]
+        positions = np.pad(positions, ((0, 0), (0, pad)))
+        mask = np.pad(mask, ((0, 0), (0, pad)))
+    return positions, mask
+
+
+def flatten_ragged(ragged, columns, sort_column, maxlength, out=None):
+    """
+    Flatten and zero-pad the given array columns, sorted by decreasing sort_column.
+    ragged is a function returning the concatenated values and the offsets of a column.
+    All columns are scattered into one block of shape (n_jets, len(columns) * maxlength),
+    which is allocated here unless a zero-initialised block is given with out.
+    Returns the block and the corresponding column names
+    """
+    keys, offsets = ragged(sort_column)
+    positions, mask = descending_order(keys, offsets, maxlength)
+
+    block = np.zeros((len(offsets) - 1, len(columns) * maxlength), dtype=schema.float_dtype) if out is None else out
+    names = []
+    for j, column in enumerate(columns):
+        values = keys if column == sort_column else ragged(column)[0]
+        if len(values) > 0:
+            np.copyto(block[:, j * maxlength:(j + 1) * maxlength], values[positions], where=mask)
+        names += [column + '_' + str(i) for i in range(maxlength)]
+    return block, names
+
+
+def flat_names():
+    """
+    Returns the names of the zero-padded track and tower columns
+    """
+    names = []
+    for column in track_columns:
+        names += [column + '_' + str(i) for i in range(maxtracks)]
+    for column in tower_columns:
+        names += [column + '_' + str(i) for i in range(maxtowers)]
+    return names
+
+
+def flatten_block(ragged, out):
+    """
+    Flatten tracks and towers of all jets into the given zero-initialised block
+    of shape (n_jets, len(flat_names()))
+    """
+    n_track_columns = len(track_columns) * maxtracks
+    flatten_ragged(ragged, track_columns, 'trackPt', maxtracks, out=out[:, :n_track_columns])
+    flatten_ragged(ragged, tower_columns, 'towerE', maxtowers, out=out[:, n_track_columns:])
 
     # TODO
     # Center tracks and towers to mean value of each jet
@@ -33,31 +127,100 @@ for name in ['gluons_modified', 'gluons_standard', 'quarks_modified', 'quarks_st
     # - Rotate to second largest pt axis
     # - Flip image
 
-    for column in ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']:
-        print("Process column", column)
-        zero_padded_array = np.zeros((len(trackorder), maxtracks))
-        for i in range(len(trackorder)):
-            zero_padded_array[i, :len(trackorder[i])] = df[column][i][trackorder[i]]
-        for i in range(maxtracks):
-            df[column + '_' + str(i)] = zero_padded_array[:, i]
-    
-    # Flatten and zero-pad towers
-    maxtowers = 67 # df.ntowers.max()
-    towerorder = df.towerE.apply(myargsort).values
-    for column in ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']:
-        print("Process", column)
-        zero_padded_array = np.zeros((len(towerorder), maxtowers))
-        for i in range(len(towerorder)):
-            zero_padded_array[i, :len(towerorder[i])] = df[column][i][towerorder[i]]
-        for i in range(maxtowers):
-            df[column + '_' + str(i)] = zero_padded_array[:, i]
-            
-    # Save some memory, by removing the original columns containing the arrays converted from root
-    for column in ['trackPt', 'trackEta', 'trackPhi', 'trackCharge']:
-        del df[column]
-    for column in ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']:
-        del df[column]
-   
-    # Save the file with the postfix _flat, for flattened
-    df.to_pickle(name + '_flat.pickle')
+    return out
+
+
+def flatten(df):
+    """
+    Returns the flattened dataframe, the original columns containing the arrays converted from root
+    are replaced by the zero-padded columns
+    """
+    names = flat_names()
+    block = flatten_block(lambda column: ragged_offsets(df[column]),
+                          np.zeros((len(df), len(names)), dtype=schema.float_dtype))
+    # schema.cast raises if a value does not fit into the dtype of its column (e.g. ntracks > 255 for uint8)
+    flat = pandas.DataFrame({name: schema.cast(block[:, i], schema.dtype(name)) for i, name in enumerate(names)},
+                            columns=names, index=df.index)
+    jets = df.drop(columns=track_columns + tower_columns)
+    for name in jets.columns:
+        if jets[name].dtype.kind in 'fiu':
+            jets[name] = schema.cast(jets[name].values, schema.dtype(name))
+    return pandas.concat([jets, flat], axis=1)
+
+
+def flatten_store(store, filename, chunk_size=feature_store.default_chunk_size):
+    """
+    Flatten a converted store containing the ragged track and tower columns (see converter.py)
+    chunk by chunk and write the result as flat store
+    """
+    variables = store.variables + flat_names()
+    n_jet_columns = len(store.variables)
+    with feature_store.StoreWriter(filename, variables) as writer:
+        for start, stop in store.chunks(chunk_size):
+            print("Process rows", start, stop)
+            block = np.zeros((stop - start, len(variables)), dtype=schema.float_dtype)
+            block[:, :n_jet_columns] = store.rows(start, stop)
+            flatten_block(lambda column: store.ragged(column, start, stop), block[:, n_jet_columns:])
+            writer.append(block)
+
+
+def sort_ragged(ragged, columns, sort_column, maxlength):
+    """
+    Sorts the given ragged columns inside each jet by decreasing sort_column and keeps the leading maxlength entries.
+    Returns a dictionary with the sorted (values, offsets) of each column
+    """
+    keys, offsets = ragged(sort_column)
+    positions, mask = descending_order(keys, offsets, maxlength)
+    # The selected positions in row-major order are the entries of the sorted jets one after another
+    selected = positions[mask]
+    sorted_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(mask.sum(axis=1), out=sorted_offsets[1:])
+    return {column: ((keys if column == sort_column else ragged(column)[0])[selected], sorted_offsets)
+            for column in columns}
+
+
+def sort_store(store, filename, chunk_size=feature_store.default_chunk_size):
+    """
+    Sort the tracks and towers of a converted store chunk by chunk and write them as padded ragged columns,
+    the result has the same variables as the store written by flatten_store
+    """
+    padded = [(track_columns, maxtracks), (tower_columns, maxtowers)]
+    ragged = schema.dtypes(track_columns + tower_columns)
+    with feature_store.StoreWriter(filename, store.variables, ragged=ragged, padded=padded) as writer:
+        for start, stop in store.chunks(chunk_size):
+            print("Process rows", start, stop)
+            constituents = sort_ragged(lambda column: store.ragged(column, start, stop), track_columns, 'trackPt', maxtracks)
+            constituents.update(sort_ragged(lambda column: store.ragged(column, start, stop), tower_columns, 'towerE',
+                                            maxtowers))
+            writer.append(store.rows(start, stop), ragged=constituents)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flatten the converted samples')
+    parser.add_argument('--jet-frame', action='store_true',
+                        help='Write the flat samples transformed into the jet frame as well (see jet_frame.py)')
+    parser.add_argument('--samples', type=str, nargs='+', default=samples, help='Names of the samples to flatten')
+    parser.add_argument('--sparse', action='store_true',
+                        help='Store the sorted tracks and towers without zero-padding, they are padded when they are read')
+    args = parser.parse_args()
+    if args.sparse:
+        pickled = [name for name in args.samples if not os.path.isdir(name + '.store')]
+        if pickled:
+            parser.error('--sparse needs the converted stores (converter.py --mode store), {} only exist as pickle'
+                         .format(', '.join(pickled)))
+
+    for name in args.samples:
+        print("Process file", name)
+        # Save the file with the postfix _flat, for flattened
+        if os.path.isdir(name + '.store') and args.sparse:
+            sort_store(feature_store.open_store(name + '.store'), name + '_flat.store')
+        elif os.path.isdir(name + '.store'):
+            flatten_store(feature_store.open_store(name + '.store'), name + '_flat.store')
+        else:
+            df = pandas.read_pickle(name + '.pickle')
+            df = flatten(df)
+            feature_store.write_store(name + '_flat.store', df, list(df.columns))
 
+        if args.jet_frame:
+            import jet_frame
+            jet_frame.transform_store(name + '_flat.store')
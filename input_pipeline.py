@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Training batches with tf.data instead of feed_dict (see tf_model.py --input-pipeline dataset).
+# The rows are read directly from the raw files of the stores (see feature_store.py),
+# so the batches are prepared by the tensorflow runtime in parallel to the training steps
+# and go into the network without copying them through python.
+# Whether this is faster than feed_dict has to be measured on the machine of the training:
+# benchmark.py trains with both pipelines and reports the examples per second of each.
+# - every store is split into blocks of consecutive rows, the order of the blocks is drawn for every epoch
+# - rows of cycle_length blocks are interleaved and shuffled in a buffer, so a batch contains jets of all samples
+# - the rows of a block are read with a single FixedLengthRecordDataset, whose header and footer skip the other rows
+# - the records are decoded per batch, the truth and the (boost) weights are joined in the same way
+# - variables with a compact dtype (see schema.py) are read from their own files and converted to float32 in the graph
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import feature_store
+
+
+def npy_header_size(filename):
+    """
+    Returns the number of bytes in front of the data of a npy file (e.g. the cached boost weights)
+    """
+    with open(filename, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+
+def record_dtype(dtype):
+    """
+    Returns the tensorflow type used to decode a raw column, bools are stored as one byte
+    """
+    dtype = np.dtype(dtype)
+    return tf.uint8 if dtype == np.bool_ else tf.as_dtype(dtype)
+
+
+def blocks(filename, target, block_size):
+    """
+    Returns the blocks of the given store as list of dictionaries with the path of the stored store,
+    the row range in this store, the row range in the given store and the truth if it is constant
+    """
+    store = feature_store.open_store(filename)
+    if isinstance(store, feature_store.VirtualStore):
+        pieces = [(store.stores[i], first, last, store.sources[i]['columns'].get(target))
+                  for i, first, last in store.pieces()]
+    else:
+        pieces = [(store, 0, len(store), None)]
+    result = []
+    offset = 0
+    for source, first, last, truth in pieces:
+        for start in range(first, last, block_size):
+            stop = min(start + block_size, last)
+            result.append({'store': source, 'start': start, 'stop': stop,
+                           'global_start': offset + start - first, 'global_stop': offset + stop - first, 'truth': truth})
+        offset += last - first
+    return store, result
+
+
+def training_dataset(filename, target, batch_size, variables, weights_file=None, class_weights=(1.0, 1.0),
+                     block_size=10000, cycle_length=16, shuffle_buffer=10000, prefetch=4, threads=4, seed=None, skip=0,
+                     shard=None):
+    """
+    Returns an endless tf.data.Dataset of shuffled batches (x, y, w) of the given store,
+    x contains the given variables, y the target column and w the weights with shape (batch_size, 1).
+    The weights are read from weights_file (a npy file with one float32 per row) if given and multiplied with
+    class_weights[0] for signal (y = 1) and class_weights[1] for background.
+    With a seed the batches are reproducible. skip continues after the first skip batches (e.g. to continue a
+    training): the rows of these batches are not read again, the dataset starts with the first block of the epoch
+    they did not reach completely. Because of the interleaving and the shuffle buffer the following batches are
+    similar, but not identical to the batches of an uninterrupted sequence, i.e. a resumed training is not
+    bit-identical to an uninterrupted one.
+    With shard = (rank, n_shards) only every n_shards-th batch is returned, starting with batch rank,
+    and skip counts the batches of this shard (see batches.BatchEngine).
+    """
+    store, block_list = blocks(filename, target, block_size)
+    sources = [block['store'] for block in block_list]
+    if any(source.padded for source in sources):
+        raise ValueError('The padded columns of {} cannot be read with tf.data, use feed_dict'.format(filename))
+    layouts = set((tuple(source.variables), tuple(sorted(source.variable_dtypes.items()))) for source in sources)
+    if len(layouts) != 1:
+        raise ValueError('The stores of {} do not have the same variables'.format(filename))
+    # The stored matrices (one for each dtype) are decoded, converted to float32 and concatenated,
+    # afterwards the requested variables are gathered from the concatenation
+    matrices = feature_store.families(sources[0].stored_variables, sources[0].variable_dtypes)
+    order = [sources[0].stored_variables[i] for _, indices in matrices for i in indices]
+    position = {v: i for i, v in enumerate(order)}
+    indices = [position[v] for v in variables]
+    project = indices != list(range(len(order)))
+    constant_truth = all(block['truth'] is not None for block in block_list)
+    truth_dtype = np.dtype(store.columns[target])
+    weights_header = None if weights_file is None else npy_header_size(weights_file)
+
+    def byte_range(block, record_bytes):
+        # Header and footer which skip the records of the other rows in a file of the store of this block
+        return block['start'] * record_bytes, (len(block['store']) - block['stop']) * record_bytes
+
+    record_bytes = [len(columns) * dtype.itemsize for dtype, columns in matrices]
+    names = ['truth', 'truth_value', 'truth_header', 'truth_footer', 'weights_header', 'weights_footer', 'rows']
+    for m in range(len(matrices)):
+        names += ['features_' + str(m), 'features_header_' + str(m), 'features_footer_' + str(m)]
+    slices = {name: [] for name in names}
+    for block in block_list:
+        for m, (dtype, _) in enumerate(matrices):
+            header, footer = byte_range(block, record_bytes[m])
+            slices['features_' + str(m)].append(os.path.join(block['store'].path, feature_store.variables_file(dtype)))
+            slices['features_header_' + str(m)].append(header)
+            slices['features_footer_' + str(m)].append(footer)
+        header, footer = (0, 0) if constant_truth else byte_range(block, truth_dtype.itemsize)
+        slices['truth'].append('' if constant_truth else os.path.join(block['store'].path, target + '.bin'))
+        slices['truth_value'].append(float(block['truth']) if constant_truth else 0.0)
+        slices['truth_header'].append(header)
+        slices['truth_footer'].append(footer)
+        if weights_header is not None:
+            slices['weights_header'].append(weights_header + block['global_start'] * 4)
+            slices['weights_footer'].append((len(store) - block['global_stop']) * 4)
+        else:
+            slices['weights_header'].append(0)
+            slices['weights_footer'].append(0)
+        slices['rows'].append(block['stop'] - block['start'])
+    types = {'truth': object, 'truth_value': np.float32}
+    types.update({'features_' + str(m): object for m in range(len(matrices))})
+    slices = {name: np.array(values, dtype=types.get(name, np.int64)) for name, values in slices.items()}
+
+    def read_block(block):
+        # Matrices without variables have no records, they are left out
+        features = tuple(tf.data.FixedLengthRecordDataset(block['features_' + str(m)], record_bytes[m],
+                                                          block['features_header_' + str(m)],
+                                                          block['features_footer_' + str(m)])
+                         for m in range(len(matrices)) if record_bytes[m] > 0)
+        if constant_truth:
+            truth = tf.data.Dataset.from_tensors(block['truth_value']).repeat(block['rows'])
+        else:
+            truth = tf.data.FixedLengthRecordDataset(block['truth'], truth_dtype.itemsize,
+                                                     block['truth_header'], block['truth_footer'])
+        if weights_header is not None:
+            weights = tf.data.FixedLengthRecordDataset(weights_file, 4, block['weights_header'], block['weights_footer'])
+        else:
+            weights = tf.data.Dataset.from_tensors(tf.constant(1.0)).repeat(block['rows'])
+        return tf.data.Dataset.zip((tf.data.Dataset.zip(features), truth, weights))
+
+    def decode(features, truth, weights):
+        stored = [(dtype, columns) for dtype, columns in matrices if len(columns) > 0]
+        x = tf.concat([tf.cast(tf.reshape(tf.decode_raw(f, record_dtype(dtype)), [-1, len(columns)]), tf.float32)
+                       for f, (dtype, columns) in zip(features, stored)], axis=1)
+        if project:
+            x = tf.gather(x, indices, axis=1)
+        if not constant_truth:
+            truth = tf.reshape(tf.decode_raw(truth, record_dtype(truth_dtype)), [-1])
+        y = tf.reshape(tf.cast(truth, tf.float32), [-1, 1])
+        if weights_header is not None:
+            weights = tf.reshape(tf.decode_raw(weights, tf.float32), [-1])
+        w = tf.reshape(weights, [-1, 1]) * tf.where(y > 0.5, tf.fill(tf.shape(y), float(class_weights[0])),
+                                                    tf.fill(tf.shape(y), float(class_weights[1])))
+        return x, y, w
+
+    # The block order of every epoch is drawn from seed and the epoch, so a resumed training starts at the epoch
+    # and the block which the skipped batches (of all shards) reach, instead of reading these batches again
+    rank, n_shards = (0, 1) if shard is None else shard
+    first_epoch, position = divmod(skip * n_shards * batch_size, int(np.sum(slices['rows'])))
+
+    def block_order(epoch):
+        random = np.random.RandomState(None if seed is None else [seed, int(epoch)])
+        order = random.permutation(len(block_list))
+        if epoch == first_epoch:
+            order = order[np.searchsorted(np.cumsum(slices['rows'][order]), position, side='right'):]
+        return order.astype(np.int64)
+
+    def read_epoch(epoch):
+        order = tf.py_func(block_order, [epoch], tf.int64)
+        order.set_shape([None])
+        return tf.data.Dataset.from_tensor_slices(order)
+
+    tensors = {name: tf.constant(values) for name, values in slices.items()}
+    dataset = tf.data.Dataset.range(first_epoch, np.iinfo(np.int64).max).flat_map(read_epoch)
+    dataset = dataset.map(lambda i: {name: tf.gather(values, i) for name, values in tensors.items()})
+    dataset = dataset.interleave(read_block, cycle_length=cycle_length, block_length=1)
+    # The op seed of the shuffle is combined with the graph seed, which differs between the data-parallel
+    # workers (see tf_model.py), so the shuffle is created under a graph seed which only depends on seed.
+    # Then every shard selects its batches from the same sequence
+    graph = tf.get_default_graph()
+    graph_seed = graph.seed
+    graph.seed = seed
+    try:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+    finally:
+        graph.seed = graph_seed
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    # The batches of the other shards are read, but not decoded
+    if n_shards > 1:
+        dataset = dataset.shard(n_shards, rank)
+    dataset = dataset.map(decode, num_parallel_calls=threads)
+    return dataset.prefetch(prefetch)
+
+
+def training_inputs(n_variables):
+    """
+    Returns a reinitializable iterator for the datasets of training_dataset and its next batch (x, y, w)
+    """
+    iterator = tf.data.Iterator.from_structure((tf.float32, tf.float32, tf.float32),
+                                               ([None, n_variables], [None, 1], [None, 1]))
+    return iterator, iterator.get_next()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Instrumentation of the training loops in tf_model.py and tf_model2.py.
+# Every step is split into phases (e.g. batch preparation, boost weights, optimizer step) by calling lap
+# after each phase. Every interval steps the summed wall time of each phase, the examples per second
+# and the memory of the process are written as one row into a csv file (or a json lines file if the name
+# ends with .json). For a window of steps a tensorflow execution trace can be written (chrome://tracing format).
+# If neither a log file nor a trace window is given, all methods return immediately.
+
+import csv
+import json
+import os
+import resource
+import time
+
+default_phases = ['batch', 'boost_weights', 'optimizer']
+
+
+def process_memory():
+    """
+    Returns the current and the peak resident memory of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.0 ** 2
+    except (IOError, OSError, ValueError):
+        current = peak
+    return current, max(current, peak)
+
+
+class TrainingMonitor(object):
+    """
+    Records the time spent in each phase of the training steps, see the description at the top.
+    trace_steps is an optional (first, last) range of steps, for which tensorflow traces are written
+    to trace_prefix-<network>-<step>.json
+    """
+    def __init__(self, filename=None, interval=500, trace_steps=None, trace_prefix='trace', phases=default_phases):
+        self.filename = filename
+        self.interval = interval
+        self.trace_steps = trace_steps
+        self.trace_prefix = trace_prefix
+        self.phases = list(phases)
+        self.enabled = filename is not None
+        self.network = None
+        self.writer = None
+        self.file = None
+        self.metadata = None
+        if self.enabled:
+            self.fields = (['network', 'step', 'steps', 'examples', 'seconds', 'examples_per_second', 'loss'] +
+                           [phase + '_seconds' for phase in self.phases] + ['other_seconds', 'rss_mb', 'peak_rss_mb'])
+            self.json = filename.endswith('.json')
+            self.file = open(filename, 'w')
+            if not self.json:
+                self.writer = csv.DictWriter(self.file, self.fields)
+                self.writer.writeheader()
+
+    def start(self, network):
+        """
+        Starts the instrumentation of the training of the given network
+        """
+        self.network = network
+        self.reset()
+
+    def reset(self):
+        if not self.enabled:
+            return
+        self.seconds = {phase: 0.0 for phase in self.phases}
+        self.steps = 0
+        self.examples = 0
+        self.interval_start = time.perf_counter()
+        self.last = self.interval_start
+
+    def begin_step(self):
+        if not self.enabled:
+            return
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """
+        Adds the time since the last lap (or the beginning of the step) to the given phase
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.seconds[phase] += now - self.last
+        self.last = now
+
+    def run_options(self, step):
+        """
+        Returns the additional keyword arguments of session.run for the given step,
+        inside the trace window these request a full trace of the step
+        """
+        if self.trace_steps is None or not self.trace_steps[0] <= step <= self.trace_steps[1]:
+            return {}
+        import tensorflow as tf
+        self.metadata = tf.RunMetadata()
+        return {'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), 'run_metadata': self.metadata}
+
+    def end_step(self, step, examples, loss=None):
+        """
+        Finishes a step with the given number of examples, writes the trace of the step (inside the trace window)
+        and every interval steps a row of the log
+        """
+        if self.metadata is not None:
+            self.write_trace(step)
+        if not self.enabled:
+            return
+        self.steps += 1
+        self.examples += examples
+        if self.steps >= self.interval:
+            self.write(step, loss)
+            self.reset()
+
+    def write_trace(self, step):
+        from tensorflow.python.client import timeline
+        filename = '{}-{}-{}.json'.format(self.trace_prefix, self.network, step)
+        with open(filename, 'w') as f:
+            f.write(timeline.Timeline(self.metadata.step_stats).generate_chrome_trace_format())
+        self.metadata = None
+        print('Trace of step', step, 'written to', filename)
+
+    def write(self, step, loss=None):
+        seconds = time.perf_counter() - self.interval_start
+        rss, peak = process_memory()
+        row = {'network': self.network, 'step': step, 'steps': self.steps, 'examples': self.examples,
+               'seconds': seconds, 'examples_per_second': self.examples / max(seconds, 1e-9),
+               'loss': None if loss is None else float(loss),
+               'other_seconds': seconds - sum(self.seconds.values()), 'rss_mb': rss, 'peak_rss_mb': peak}
+        row.update({phase + '_seconds': value for phase, value in self.seconds.items()})
+        if self.json:
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_arguments(parser):
+    """
+    Adds the command line options of the instrumentation to an argparse parser
+    """
+    parser.add_argument('--log', type=str, default=None,
+                        help='Write the time per phase, examples/second and memory to this csv (or .json) file')
+    parser.add_argument('--log-interval', type=int, default=500, help='Number of steps per row of the log')
+    parser.add_argument('--trace-steps', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='Write tensorflow traces of the steps FIRST to LAST')
+    parser.add_argument('--trace-prefix', type=str, default='trace', help='Prefix of the trace files')
+
+
+def from_arguments(args):
+    return TrainingMonitor(args.log, args.log_interval, args.trace_steps, args.trace_prefix)
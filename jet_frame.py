@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Transforms the tracks and towers into the frame of the jet (used by tf_model2.py and apply2.py)
+# - eta and phi are taken relative to the jet axis
+# - transverse momenta and energies are taken relative to the jet pt
+# Every quantity is a contiguous block of columns in the flat variables,
+# so each one is transformed with a single broadcast operation.
+# The transformed stores are cached next to the original store. Of a virtual store (e.g. the training samples)
+# only the sources are transformed, the cache is a manifest over the transformed sources.
+
+import os
+
+import feature_store
+import flatten
+
+# (quantity, jet variable, operation) of every transformed block
+transformations = [('trackEta', 'jetEta', 'subtract'),
+                   ('trackPhi', 'jetPhi', 'subtract'),
+                   ('trackPt', 'jetPt', 'divide'),
+                   ('towerEta', 'jetEta', 'subtract'),
+                   ('towerE', 'jetPt', 'divide'),
+                   ('towerEem', 'jetPt', 'divide'),
+                   ('towerEhad', 'jetPt', 'divide')]
+
+
+def transform_block(X, variables):
+    """
+    Transforms the float32 matrix X with the given variables in-place into the jet frame
+    """
+    index = {v: i for i, v in enumerate(variables)}
+    for quantity, jet_variable, operation in transformations:
+        length = flatten.maxtracks if quantity.startswith('track') else flatten.maxtowers
+        start = index[quantity + '_0']
+        if variables[start:start + length] != [quantity + '_' + str(i) for i in range(length)]:
+            raise ValueError('The columns of {} are not contiguous'.format(quantity))
+        block = X[:, start:start + length]
+        jet = X[:, index[jet_variable], None]
+        if operation == 'subtract':
+            block -= jet
+        else:
+            block /= jet
+    return X
+
+
+def transformed_path(filename):
+    """
+    Returns the path of the transformed store (e.g. quarks_standard_flat_transformed.store, like flatten.py --jet-frame).
+    The cache of a virtual store is called <name>_jet_frame.store, the name <name>_transformed.store is used by the
+    virtual samples of create_training_samples.py --jet-frame
+    """
+    if os.path.exists(os.path.join(filename, 'manifest.json')):
+        return os.path.splitext(filename)[0] + '_jet_frame.store'
+    return os.path.splitext(filename)[0] + '_transformed.store'
+
+
+def transform_store(filename, output=None):
+    """
+    Writes the jet frame transformation of the given store chunk by chunk,
+    all additional columns are copied
+    """
+    output = transformed_path(filename) if output is None else output
+    if os.path.exists(os.path.join(output, 'manifest.json')):
+        raise ValueError('{} is a virtual store, it is not overwritten with the transformation'.format(output))
+    store = feature_store.open_store(filename)
+    with feature_store.StoreWriter(output, store.variables, store.columns, variable_dtypes=store.variable_dtypes) as writer:
+        for start, stop in store.chunks():
+            X = transform_block(store.rows(start, stop).copy(), store.variables)
+            writer.append(X, {name: store.column(name, start, stop) for name in store.columns})
+    return output
+
+
+def transformed_store(filename):
+    """
+    Returns the transformed store of the given store, it is only calculated
+    if it does not exist yet or if the original store was rewritten since
+    """
+    output = transformed_path(filename)
+    store = feature_store.open_store(filename)
+    if isinstance(store, feature_store.VirtualStore):
+        sources = [transformed_store(source.path).path for source in store.stores]
+        if not exists(output) or os.path.getmtime(os.path.join(output, 'manifest.json')) < store.modification_time():
+            feature_store.write_manifest(output, [{'store': path, 'start': source['start'], 'stop': source['stop'],
+                                                   'columns': source['columns']}
+                                                  for path, source in zip(sources, store.sources)],
+                                         store.constant_columns)
+    elif not exists(output) or modification_time(output) < store.modification_time():
+        print("Transform", filename, "into the jet frame")
+        transform_store(filename, output)
+    return feature_store.open_store(output)
+
+
+def exists(filename):
+    return any(os.path.exists(os.path.join(filename, name)) for name in ['meta.json', 'manifest.json'])
+
+
+def modification_time(filename):
+    return feature_store.open_store(filename).modification_time()
@@ -5,30 +5,59 @@
 
 # Create some final evaluation plots
 
-import numpy as np
+import argparse
+import os
+
 import pandas
 import matplotlib.pyplot as plt
-import sklearn
-import sklearn.metrics
-import sklearn.ensemble
 
-def auc(df, label):
+import evaluation
+
+default_results = [('result_train_with_boost.pickle', 'Train with Boost'),
+                   ('result_test_with_boost.pickle', 'Test with Boost'),
+                   ('result_train_fisher.pickle', 'Fisher Train'),
+                   ('result_test_fisher.pickle', 'Fisher Test')]
+
+
+def auc(df, label, max_points=1000, bins=None, n_bootstrap=0):
     """
-    Calculate ROC AUC score and plot ROC curve
+    Calculate ROC AUC score and plot ROC curve.
+    If the result contains a column w the jets are weighted.
+    With bins the ROC curve and the AUC are calculated from histograms instead of sorting the predictions,
+    with n_bootstrap the confidence interval of the same estimator is returned as well.
     """
-    fpr, tpr, thresholds = sklearn.metrics.roc_curve(df['y'], df['p'])
-    plt.plot(fpr, tpr, lw=4, label=label)
-    return sklearn.metrics.roc_auc_score(df['y'], df['p']-df['p'].min()/(df['p'].max()-df['p'].min()))
+    y = df['y'].values
+    p = df['p'].values
+    w = df['w'].values if 'w' in df.columns else None
+    if bins is not None:
+        signal, background = evaluation.histograms(y, p, w, bins)
+        fpr, tpr = evaluation.histogram_curve(signal, background)
+    else:
+        fpr, tpr, thresholds = evaluation.roc_curve(y, p, w)
+    plt.plot(*evaluation.decimate(fpr, tpr, max_points), lw=4, label=label)
+    if n_bootstrap > 0:
+        return evaluation.bootstrap_auc(y, p, w, n_bootstrap, bins=bins)
+    if bins is not None:
+        return evaluation.histogram_auc(signal, background)
+    return evaluation.curve_auc(fpr, tpr)
+
 
 if __name__ == '__main__':
-    df_train_boost = pandas.read_pickle('result_train_with_boost.pickle')
-    df_test_boost = pandas.read_pickle('result_test_with_boost.pickle')
-    df_train_fisher = pandas.read_pickle('result_train_fisher.pickle')
-    df_test_fisher = pandas.read_pickle('result_test_fisher.pickle')
-
-    print('Train with Boost', 'auc', auc(df_train_boost, 'Train with Boost'))
-    print('Test with Boost', 'auc', auc(df_test_boost, 'Test with Boost'))
-    print('Fisher Train', 'auc', auc(df_train_fisher, 'Fisher Train'))
-    print('Fisher Test', 'auc', auc(df_test_fisher, 'Fisher Test'))
+    parser = argparse.ArgumentParser(description='Compare the ROC curves and AUC scores of result files')
+    parser.add_argument('results', type=str, nargs='*',
+                        help='Result pickles with the columns y and p (and optionally w), by default our four results')
+    parser.add_argument('--max-points', type=int, default=1000, help='Maximal number of points of a plotted ROC curve')
+    parser.add_argument('--bins', type=int, default=None, help='Calculate the AUC from histograms with this many bins')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Number of bootstrap replicas for the confidence interval of the AUC (exact, or from the histograms with --bins)')
+    parser.add_argument('--save', type=str, default=None, help='Save the ROC curves to this file instead of showing them')
+    args = parser.parse_args()
+
+    results = [(r, os.path.splitext(os.path.basename(r))[0]) for r in args.results] if args.results else default_results
+    for filename, label in results:
+        df = pandas.read_pickle(filename)
+        print(label, 'auc', auc(df, label, args.max_points, args.bins, args.bootstrap))
     plt.legend()
-    plt.show()
+    if args.save is not None:
+        plt.savefig(args.save)
+    else:
+        plt.show()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Applies our network (see get_model in tf_model.py) with numpy only.
+# The weights and biases of the 5 layers are exported once from a checkpoint into a small npz file,
+# afterwards scoring needs neither the tensorflow import nor the graph import and session setup.
+# Dropout is not applied, which is the same as running the tensorflow graph with keep_prob = 1.
+
+import argparse
+import time
+
+import numpy as np
+
+import feature_store
+
+# Name scopes of the inference network in the checkpoints saved by tf_model.py,
+# the boost network uses the same names without the postfix _1
+inference_layers = ['hidden1_1', 'hidden2_1', 'hidden3_1', 'hidden4_1', 'sigmoid_1']
+
+
+def export_weights(checkpoint, filename, layers=inference_layers):
+    """
+    Reads the weights and biases of the given layers from the checkpoint
+    and saves them together with the names of the input variables into filename
+    """
+    import tensorflow as tf
+    from tf_model import variables
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    arrays = {'variables': np.array(variables)}
+    for i, layer in enumerate(layers):
+        arrays['weights_' + str(i)] = reader.get_tensor(layer + '/weights').astype(np.float32)
+        arrays['biases_' + str(i)] = reader.get_tensor(layer + '/biases').astype(np.float32)
+    np.savez(filename, **arrays)
+
+
+class NumpyModel(object):
+    """
+    Forward pass of the exported network with numpy,
+    this has the same interface as scoring.Scorer
+    """
+    def __init__(self, filename, batch_size=10000):
+        self.batch_size = batch_size
+        self.rows_per_second = 0.0
+        with np.load(filename) as f:
+            self.variables = [str(v) for v in f['variables']]
+            n_layers = len([k for k in f.files if k.startswith('weights_')])
+            self.weights = [np.ascontiguousarray(f['weights_' + str(i)], dtype=np.float32) for i in range(n_layers)]
+            self.biases = [np.ascontiguousarray(f['biases_' + str(i)], dtype=np.float32) for i in range(n_layers)]
+
+    def forward(self, X, buffers):
+        """
+        Sigmoid layers, each computed in-place in the preallocated buffers
+        """
+        activation = X
+        for weights, biases, buffer in zip(self.weights, self.biases, buffers):
+            buffer = buffer[:len(X)]
+            np.matmul(activation, weights, out=buffer)
+            buffer += biases
+            np.negative(buffer, out=buffer)
+            np.exp(buffer, out=buffer)
+            buffer += 1.0
+            np.reciprocal(buffer, out=buffer)
+            activation = buffer
+        return activation
+
+    def score(self, X, out=None):
+        """
+        Returns the prediction for each row of X as float32 array,
+        the prediction is written into out if given
+        """
+        p = np.empty(len(X), dtype=np.float32) if out is None else out
+        buffers = [np.empty((min(self.batch_size, len(X)), w.shape[1]), dtype=np.float32) for w in self.weights]
+        start_time = time.time()
+        with np.errstate(over='ignore'):
+            for i in range(0, len(X), self.batch_size):
+                e = min(len(X), i + self.batch_size)
+                batch = np.require(X[i:e], dtype=np.float32, requirements=['C'])
+                p[i:e] = self.forward(batch, buffers)[:, 0]
+        self.rows_per_second = len(X) / max(time.time() - start_time, 1e-9)
+        return p
+
+    def score_store(self, filename, variables=None, target='is_quark'):
+        """
+        Returns the truth and the prediction for every jet in the given store,
+        by default the variables saved with the model are used
+        """
+        store = feature_store.open_store(filename)
+        p = np.empty(len(store), dtype=np.float32)
+        start_time = time.time()
+        for start, stop in store.chunks():
+            self.score(store.project(self.variables if variables is None else variables, start, stop), out=p[start:stop])
+        self.rows_per_second = len(store) / max(time.time() - start_time, 1e-9)
+        print("Scored {} with {:.0f} rows/second (batch size {})".format(filename, self.rows_per_second, self.batch_size))
+        return np.array(store.column(target)), p
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a checkpoint and score a feature store with numpy')
+    parser.add_argument('--export', type=str, default=None, help='Checkpoint which is exported to --model first')
+    parser.add_argument('--model', type=str, default='inference_model_final.npz')
+    parser.add_argument('--input', type=str, default='inference_test_sample.store')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--check', action='store_true',
+                        help='Compare the predictions with the tensorflow graph of the exported checkpoint')
+    args = parser.parse_args()
+    if args.check and args.export is None:
+        parser.error('--check needs the checkpoint given with --export')
+
+    if args.export is not None:
+        export_weights(args.export, args.model)
+    with NumpyModel(args.model, args.batch_size) as model:
+        y, p = model.score_store(args.input)
+
+    if args.check:
+        import scoring
+        with scoring.Scorer(args.export, layers=inference_layers) as scorer:
+            _, p_tf = scorer.score_store(args.input, model.variables)
+        print("Maximal difference to tensorflow", np.max(np.abs(p - p_tf)))
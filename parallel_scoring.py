@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Scores a feature store with several worker processes.
+# The store is split into shards of rows, every worker loads the model once (tensorflow, see scoring.py,
+# or numpy, see numpy_model.py) and writes the predictions of its shards into a shared output array,
+# so the predictions are in the original row order.
+
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import feature_store
+
+thread_variables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+# The model of the current worker process, loaded once by init_worker
+worker_model = None
+
+
+def load_model(backend, model, batch_size, threads=None):
+    if backend == 'numpy':
+        import numpy_model
+        return numpy_model.NumpyModel(model, batch_size)
+    import scoring
+    return scoring.Scorer(model, batch_size=batch_size, threads=threads)
+
+
+def init_worker(backend, model, batch_size, threads):
+    global worker_model
+    worker_model = load_model(backend, model, batch_size, threads)
+
+
+def score_shard(task):
+    """
+    Scores the rows [start, stop) of the store into the shared output array,
+    returns the process id, the number of rows and the needed time
+    """
+    filename, variables, start, stop, name, length = task
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray((length,), dtype=np.float32, buffer=memory.buf)
+        store = feature_store.open_store(filename)
+        start_time = time.time()
+        worker_model.score(store.project(variables, start, stop), out=out[start:stop])
+        del out
+    finally:
+        memory.close()
+    return os.getpid(), stop - start, time.time() - start_time
+
+
+def score_store(filename, model, variables=None, backend='tensorflow', workers=None, shard_size=100000,
+                batch_size=10000, threads=1, target='is_quark'):
+    """
+    Returns the truth and the prediction for every jet in the given store,
+    the shards are scored in parallel by workers processes (by default one per core),
+    each using threads threads. By default the variables saved with the model (numpy)
+    or the variables of the store (tensorflow) are used.
+    """
+    store = feature_store.open_store(filename)
+    if variables is None:
+        variables = load_model(backend, model, batch_size).variables if backend == 'numpy' else store.variables
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    tasks = [(filename, variables, start, stop) for start, stop in store.chunks(shard_size)]
+
+    # The environment is inherited by the workers, so the BLAS thread pools are limited before numpy is imported there
+    environment = {name: os.environ.get(name) for name in thread_variables}
+    os.environ.update({name: str(threads) for name in thread_variables})
+    memory = shared_memory.SharedMemory(create=True, size=max(len(store), 1) * 4)
+    try:
+        start_time = time.time()
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(workers, initializer=init_worker, initargs=(backend, model, batch_size, threads)) as pool:
+            statistics = pool.map(score_shard, [task + (memory.name, len(store)) for task in tasks], chunksize=1)
+        wall_time = time.time() - start_time
+        p = np.array(np.ndarray((len(store),), dtype=np.float32, buffer=memory.buf))
+    finally:
+        memory.close()
+        memory.unlink()
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    rows = collections.defaultdict(int)
+    seconds = collections.defaultdict(float)
+    for pid, n, t in statistics:
+        rows[pid] += n
+        seconds[pid] += t
+    for i, pid in enumerate(sorted(rows)):
+        print("Worker {} scored {} rows with {:.0f} rows/second".format(i, rows[pid], rows[pid] / max(seconds[pid], 1e-9)))
+    print("Scored {} with {} workers in {:.1f}s ({:.0f} rows/second, including startup)".format(
+          filename, workers, wall_time, len(store) / max(wall_time, 1e-9)))
+    return np.array(store.column(target)), p
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a feature store with several worker processes')
+    parser.add_argument('--model', type=str, default='inference_model_final-999999',
+                        help='Checkpoint (tensorflow) or exported npz file (numpy)')
+    parser.add_argument('--backend', choices=['tensorflow', 'numpy'], default='tensorflow')
+    parser.add_argument('--input', type=str, default='inference_test_sample.store')
+    parser.add_argument('--workers', type=int, nargs='+', default=[None],
+                        help='Number of worker processes, several values measure the scaling')
+    parser.add_argument('--shard-size', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=1, help='Threads per worker')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        score_store(args.input, args.model, backend=args.backend, workers=workers, shard_size=args.shard_size,
+                    batch_size=args.batch_size, threads=args.threads)
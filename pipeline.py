@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Runs our whole workflow
+#   converter.py -> flatten.py -> create_training_samples.py -> tf_model.py -> export_model.py -> apply.py / fisher.py
+#   -> kpi.py
+# Every stage declares the files it reads and writes and its parameters. A stage is skipped if it ran before
+# with the same command, the same code and unchanged inputs and if all its outputs exist.
+# Stages which do not depend on each other (e.g. the four flatten jobs, or the Fisher discriminant next to the
+# training of the network) run concurrently. The time of every stage is reported at the end.
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import flatten
+
+state_file = '.pipeline_state.json'
+
+# resume are additional arguments, which are used if the stage runs again with the same command and inputs as its
+# last attempt, e.g. a training only continues from its checkpoints if it runs again on the same inputs
+Stage = collections.namedtuple('Stage', ['name', 'command', 'inputs', 'outputs', 'resume'])
+Stage.__new__.__defaults__ = ([],)
+
+
+def stages(iterations=int(1e6), workers=None, sparse=False):
+    """
+    Returns the stages of our workflow, the outputs of a stage are the inputs of the following ones
+    """
+    def script(name):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+    def python(name):
+        return [sys.executable, script(name)]
+
+    # The scripts and the modules they share are inputs as well, so changed code reruns the stages
+    code = [script('feature_store.py'), script('schema.py')]
+    worker_options = [] if workers is None else ['--workers', str(workers)]
+    flatten_options = ['--sparse'] if sparse else []
+    model = 'inference_model_final-' + str(iterations - 1)
+    frozen = 'inference_model_final.pb'
+    flat = [name + '_flat.store' for name in flatten.samples]
+    samples = ['boost_training_sample.store', 'inference_training_sample.store', 'inference_test_sample.store']
+    results = ['result_train_with_boost.pickle', 'result_test_with_boost.pickle',
+               'result_train_fisher.pickle', 'result_test_fisher.pickle']
+
+    result = []
+    for name in flatten.samples:
+        result.append(Stage('convert_' + name, python('converter.py') + ['--samples', name] + worker_options,
+                            code + [script('converter.py'), script('flatten.py'), name], [name + '.store']))
+        result.append(Stage('flatten_' + name, python('flatten.py') + ['--samples', name] + flatten_options,
+                            code + [script('flatten.py'), name + '.store'], [name + '_flat.store']))
+    result.append(Stage('samples', python('create_training_samples.py'),
+                        code + [script('create_training_samples.py')] + flat, samples))
+    result.append(Stage('train', python('tf_model.py') + ['--iterations', str(iterations)],
+                        code + [script('tf_model.py'), script('batches.py'), script('data_parallel.py')] + samples[:2],
+                        [model + '.index', model + '.meta'], ['--resume']))
+    result.append(Stage('export', python('export_model.py') + ['--checkpoint', model, '--output', frozen],
+                        code + [script('export_model.py'), script('numpy_model.py'), script('tf_model.py'),
+                                model + '.index'], [frozen]))
+    result.append(Stage('apply', python('apply.py') + ['--model', frozen],
+                        code + [script('apply.py'), script('scoring.py'), frozen] + samples[1:], results[:2]))
+    result.append(Stage('fisher', python('fisher.py') + worker_options, code + [script('fisher.py')] + samples[1:],
+                        results[2:]))
+    result.append(Stage('kpi', python('kpi.py') + ['--save', 'roc.png'] + results,
+                        [script('kpi.py'), script('evaluation.py')] + results, ['roc.png']))
+    return result
+
+
+def fingerprint(path):
+    """
+    Identifies the content of an input. Files and stores are identified by size and modification time,
+    a store by its meta.json or manifest.json, which are rewritten whenever the store is written
+    (so e.g. cached boost weights inside a store do not count as changes), other directories by all their files
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        for name in ['meta.json', 'manifest.json']:
+            if os.path.exists(os.path.join(path, name)):
+                return fingerprint(os.path.join(path, name))
+        return [[os.path.relpath(os.path.join(directory, name), path), fingerprint(os.path.join(directory, name))]
+                for directory, _, names in sorted(os.walk(path)) for name in sorted(names)]
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def signature(stage):
+    """
+    Hash of the command and the state of all inputs of a stage
+    """
+    description = {'command': stage.command[1:], 'inputs': {path: fingerprint(path) for path in stage.inputs}}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def load_state():
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def up_to_date(stage, state):
+    return (stage.name in state and state[stage.name]['signature'] == signature(stage)
+            and state[stage.name].get('status', 'done') == 'done' and all(os.path.exists(path) for path in stage.outputs))
+
+
+def dependencies(all_stages):
+    """
+    Returns the names of the stages each stage depends on, i.e. which produce one of its inputs
+    """
+    producers = {path: stage.name for stage in all_stages for path in stage.outputs}
+    return {stage.name: sorted(set(producers[path] for path in stage.inputs if path in producers))
+            for stage in all_stages}
+
+
+def select(all_stages, targets):
+    """
+    Returns the given stages and all stages they depend on, by default all stages
+    """
+    if not targets:
+        return all_stages
+    depends = dependencies(all_stages)
+    unknown = set(targets) - set(depends)
+    if unknown:
+        raise ValueError('Unknown stages {}'.format(sorted(unknown)))
+    selected = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo += depends[name]
+    return [stage for stage in all_stages if stage.name in selected]
+
+
+def run(all_stages, jobs=1, force=False, dry_run=False, log_directory='logs'):
+    """
+    Runs the stages in dependency order with up to jobs stages at once and returns the report of each stage.
+    The output of every stage is written to log_directory/<stage>.log
+    """
+    depends = dependencies(all_stages)
+    by_name = {stage.name: stage for stage in all_stages}
+    state = load_state()
+    lock = threading.Lock()
+    report = collections.OrderedDict((stage.name, {'status': 'pending', 'seconds': 0.0}) for stage in all_stages)
+    os.makedirs(log_directory, exist_ok=True)
+
+    def execute(stage):
+        # Decides if the stage is up to date only when its dependencies are finished, so it sees their outputs
+        if dry_run and any(report[d]['status'] == 'would run' for d in depends[stage.name] if d in report):
+            return 'would run', 0.0
+        if not force and up_to_date(stage, state):
+            return 'up to date', 0.0
+        if dry_run:
+            return 'would run', 0.0
+        current = signature(stage)
+        command = list(stage.command)
+        # Only an unfinished attempt is continued, a finished stage which is forced to run starts from scratch
+        if (stage.name in state and state[stage.name]['signature'] == current
+                and state[stage.name].get('status', 'done') != 'done'):
+            command += stage.resume
+        print('Run', stage.name + ':', ' '.join(command[1:]))
+        start_time = time.time()
+        with open(os.path.join(log_directory, stage.name + '.log'), 'w') as log:
+            returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+        seconds = time.time() - start_time
+        status = 'done' if returncode == 0 else 'failed ({})'.format(returncode)
+        # A failed attempt is remembered as well, so the next attempt on the same inputs can continue it
+        with lock:
+            state[stage.name] = {'signature': current if returncode != 0 else signature(stage), 'status': status,
+                                 'seconds': seconds, 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            save_state(state)
+        return status, seconds
+
+    finished = set()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(finished) < len(all_stages):
+            for stage in all_stages:
+                name = stage.name
+                if name in finished or name in running.values():
+                    continue
+                if any(report[d]['status'] == 'skipped' or report[d]['status'].startswith('failed')
+                       for d in depends[name] if d in report):
+                    report[name]['status'] = 'skipped'
+                    finished.add(name)
+                elif all(d in finished or d not in report for d in depends[name]):
+                    running[executor.submit(execute, by_name[name])] = name
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                status, seconds = future.result()
+                report[name] = {'status': status, 'seconds': seconds}
+                finished.add(name)
+                if status not in ['up to date', 'would run']:
+                    print('Stage {} {} after {:.1f}s'.format(name, status, seconds))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the stages of our workflow which are not up to date')
+    parser.add_argument('targets', type=str, nargs='*', help='Run only these stages (and the ones they depend on)')
+    parser.add_argument('--jobs', type=int, default=4, help='Maximal number of stages running at the same time')
+    parser.add_argument('--force', action='store_true', help='Run the stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='Only show which stages would run')
+    parser.add_argument('--list', action='store_true', help='List the stages with their inputs and outputs')
+    parser.add_argument('--iterations', type=int, default=int(1e6), help='Training steps of the inference network')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes of converter.py and fisher.py')
+    parser.add_argument('--sparse', action='store_true', help='Write sparse flat samples (see flatten.py --sparse)')
+    parser.add_argument('--report', type=str, default=None, help='Write the status and time of each stage to this json file')
+    args = parser.parse_args()
+
+    all_stages = select(stages(args.iterations, args.workers, args.sparse), args.targets)
+    if args.list:
+        depends = dependencies(all_stages)
+        for stage in all_stages:
+            print(stage.name, 'after', depends[stage.name] or '-')
+            print('   ', ' '.join(stage.command[1:]))
+            print('    inputs: ', ' '.join(stage.inputs))
+            print('    outputs:', ' '.join(stage.outputs))
+        sys.exit(0)
+
+    start_time = time.time()
+    report = run(all_stages, args.jobs, args.force, args.dry_run)
+    print()
+    print('{:<28} {:<14} {:>10}'.format('stage', 'status', 'seconds'))
+    for name, entry in report.items():
+        print('{:<28} {:<14} {:>10.1f}'.format(name, entry['status'], entry['seconds']))
+    print('Total {:.1f}s'.format(time.time() - start_time))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if any(entry['status'].startswith('failed') or entry['status'] == 'skipped'
+                      for entry in report.values()) else 0)
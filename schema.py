@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# The dtypes in which our variables are stored, used by every stage which writes or reads a feature store.
+# - kinematics (pt, eta, phi, mass, energies) are float32
+# - the track charge is int8
+# - the number of tracks and towers of a jet are uint8 (flatten.py keeps at most 52 tracks and 67 towers,
+#   the largest multiplicities in the samples are of the same order)
+# - truth columns are bool, weights and predictions are float32
+# The training and the scoring always see float32 matrices, the compact dtypes only exist in the stores,
+# see feature_store.py for how the variables of the different dtypes are stored.
+
+import numpy as np
+
+float_dtype = np.dtype(np.float32)
+truth_dtype = np.dtype(np.bool_)
+weight_dtype = np.dtype(np.float32)
+prediction_dtype = np.dtype(np.float32)
+
+# dtype of each family of variables, the zero-padded columns of a family (e.g. trackCharge_12) have the same dtype
+families = {'ntracks': np.dtype(np.uint8),
+            'ntowers': np.dtype(np.uint8),
+            'trackCharge': np.dtype(np.int8)}
+
+
+def family(variable):
+    """
+    Returns the family of a variable, e.g. trackCharge for trackCharge_12
+    """
+    name, _, index = variable.rpartition('_')
+    return name if name and index.isdigit() else variable
+
+
+def dtype(variable):
+    """
+    Returns the dtype in which the given variable is stored
+    """
+    return families.get(family(variable), float_dtype)
+
+
+def dtypes(variables):
+    """
+    Returns a dictionary with the dtype of each of the given variables
+    """
+    return {variable: dtype(variable) for variable in variables}
+
+
+def cast(values, dtype):
+    """
+    Converts values to the given dtype, raises a ValueError if an integer dtype cannot represent them exactly
+    """
+    dtype = np.dtype(dtype)
+    converted = np.asarray(values).astype(dtype, copy=False)
+    if dtype.kind in 'iu' and not np.array_equal(converted, values):
+        raise ValueError('The values cannot be stored as {} without loss'.format(dtype))
+    return converted
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# Applies a trained tensorflow model in batches, this is shared by apply.py, apply2.py and apply_boosting.py
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import feature_store
+import numpy_model
+from tf_model import variables
+
+# Name scopes of the layers created by get_model in tf_model.py
+# In the saved graphs the boost network owns these names, the inference network has the postfix _1
+model_layers = ['hidden1', 'hidden2', 'hidden3', 'hidden4', 'sigmoid']
+
+
+def rebuild_model(graph, layers):
+    """
+    Rebuilds the network from the weights and biases of the given layers (without dropout),
+    this is used for models which are not stored in the x and p collections (e.g. the boost network)
+    """
+    x = graph.get_operation_by_name("x").outputs[0]
+    pred = x
+    for layer in layers:
+        weights = graph.get_operation_by_name(layer + "/weights").outputs[0]
+        biases = graph.get_operation_by_name(layer + "/biases").outputs[0]
+        pred = tf.sigmoid(tf.matmul(pred, weights) + biases)
+    return x, pred
+
+
+class Scorer(object):
+    """
+    Loads a checkpoint and predicts the output of the network for the given inputs.
+    By default the input x and the prediction p are taken from the collections saved by tf_model.py
+    (with dropout switched off), if layers are given the network is rebuilt from the weights of these layers instead.
+    The network is always applied without dropout, like the frozen graph and the numpy model (see numpy_model.py).
+    A frozen graph written by export_model.py (a .pb file) is loaded directly, without restoring a checkpoint.
+    threads limits the tensorflow thread pools, e.g. if several scorers run in parallel.
+    """
+    def __init__(self, checkpoint, layers=None, batch_size=100000, threads=None):
+        self.batch_size = batch_size
+        self.rows_per_second = 0.0
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            config = tf.ConfigProto()
+            config.gpu_options.allow_growth = True
+            if threads is not None:
+                config.intra_op_parallelism_threads = threads
+                config.inter_op_parallelism_threads = threads
+            self.session = tf.Session(config=config, graph=self.graph)
+            self.feed_dict = {}
+            if checkpoint.endswith('.pb'):
+                graph_def = tf.GraphDef()
+                with open(checkpoint, 'rb') as f:
+                    graph_def.ParseFromString(f.read())
+                tf.import_graph_def(graph_def, name='')
+                self.x = self.graph.get_tensor_by_name('x:0')
+                self.p = self.graph.get_tensor_by_name('p:0')
+            else:
+                saver = tf.train.import_meta_graph(checkpoint + '.meta')
+                saver.restore(self.session, checkpoint)
+                if layers is None and 'keep_prob' in [op.name for op in self.graph.get_operations()]:
+                    # Checkpoints of tf_model.py apply dropout unless keep_prob is fed
+                    self.x = tf.get_collection('x')[0]
+                    self.p = tf.get_collection('p')[0]
+                    self.feed_dict = {self.graph.get_tensor_by_name('keep_prob:0'): 1.0}
+                elif layers is None:
+                    # Older checkpoints (e.g. inference_model_final-999999, tf_model2.py) have dropout with a constant
+                    # keep probability in the graph, the inference network is rebuilt without it
+                    self.x, self.p = rebuild_model(self.graph, numpy_model.inference_layers)
+                else:
+                    self.x, self.p = rebuild_model(self.graph, layers)
+
+    def score(self, X, out=None):
+        """
+        Returns the prediction for each row of X as float32 array,
+        the prediction is written into out if given
+        """
+        p = np.empty(len(X), dtype=np.float32) if out is None else out
+        start_time = time.time()
+        for i in range(0, len(X), self.batch_size):
+            e = min(len(X), i + self.batch_size)
+            batch = np.require(X[i:e], dtype=np.float32, requirements=['C'])
+            feed_dict = dict(self.feed_dict)
+            feed_dict[self.x] = batch
+            p[i:e] = self.session.run(self.p, feed_dict=feed_dict)[:, 0]
+        self.rows_per_second = len(X) / max(time.time() - start_time, 1e-9)
+        return p
+
+    def score_store(self, filename, variables, target='is_quark'):
+        """
+        Returns the truth and the prediction for every jet in the given store
+        """
+        store = feature_store.open_store(filename)
+        p = np.empty(len(store), dtype=np.float32)
+        start_time = time.time()
+        for start, stop in store.chunks():
+            self.score(store.project(variables, start, stop), out=p[start:stop])
+        self.rows_per_second = len(store) / max(time.time() - start_time, 1e-9)
+        print("Scored {} with {:.0f} rows/second (batch size {})".format(filename, self.rows_per_second, self.batch_size))
+        return np.array(store.column(target)), p
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the scoring throughput for different batch sizes')
+    parser.add_argument('--checkpoint', type=str, default='inference_model_final-999999',
+                        help='Checkpoint or frozen graph (see export_model.py)')
+    parser.add_argument('--input', type=str, default='inference_test_sample.store')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--layers', action='store_true', help='Rebuild the network from the layer names')
+    args = parser.parse_args()
+
+    tf.logging.set_verbosity(tf.logging.ERROR)
+    for batch_size in args.batch_size:
+        with Scorer(args.checkpoint, model_layers if args.layers else None, batch_size) as scorer:
+            scorer.score_store(args.input, variables)
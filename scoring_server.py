@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Thomas Keck and Jochen Gemmler 2017
+
+# A long-running scoring service, which keeps the models loaded (checkpoints or frozen graphs, see scoring.py,
+# or exported numpy models, see numpy_model.py) and scores the jets sent over a local TCP socket.
+# - requests of all connections for the same model are merged into one batch: the first request waits at most
+#   max_delay for further requests, or until max_batch rows are collected, so concurrent small requests are scored
+#   together without adding more than max_delay to their latency
+# - the latency of every request (from its arrival until its predictions are ready), the number of requests, rows
+#   and batches are recorded and reported as percentiles and throughput (command stats, or scoring_server.py stats)
+# - every message is a 4 byte big-endian length, a json header and a binary payload of header['bytes'] bytes,
+#   the jets are sent as float32 matrix with the variables of the model and the predictions are returned as float32
+# Everything runs on localhost, e.g.
+#   scoring_server.py serve --model inference_model_final.pb &
+#   scoring_server.py load --input inference_test_sample.store --clients 8
+
+import argparse
+import collections
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+default_port = 7070
+
+
+def load_model(filename, batch_size, threads=None):
+    """
+    Loads a numpy model (.npz) or a tensorflow checkpoint or frozen graph
+    """
+    if filename.endswith('.npz'):
+        import numpy_model
+        return numpy_model.NumpyModel(filename, batch_size)
+    import scoring
+    return scoring.Scorer(filename, batch_size=batch_size, threads=threads)
+
+
+def model_variables(model):
+    """
+    Returns the input variables of a loaded model, the numpy models contain them,
+    the tensorflow models are trained with the variables of tf_model.py
+    """
+    if hasattr(model, 'variables'):
+        return list(model.variables)
+    from tf_model import variables
+    return list(variables)
+
+
+class Request(object):
+    def __init__(self, X):
+        self.X = X
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.p = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """
+    Scores the requests for one model on a background thread, the requests arriving within max_delay seconds
+    after the first one are scored together (up to max_batch rows). The latencies of the last history requests
+    are kept for the percentiles.
+    """
+    def __init__(self, model, max_batch=10000, max_delay=0.005, history=100000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=history)
+        self.counters = {'requests': 0, 'rows': 0, 'batches': 0, 'errors': 0, 'scoring_seconds': 0.0}
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def score(self, X):
+        """
+        Returns the predictions for the rows of X, blocks until the batch containing them is scored
+        """
+        request = Request(X)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.p
+
+    def collect(self, first):
+        """
+        Returns the first request and the requests arriving until its deadline or until max_batch rows are collected
+        """
+        batch = [first]
+        rows = len(first.X)
+        deadline = first.arrival + self.max_delay
+        while rows < self.max_batch:
+            try:
+                request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0.0))
+            except queue.Empty:
+                break
+            if request is None:
+                self.requests.put(None)
+                break
+            batch.append(request)
+            rows += len(request.X)
+        return batch
+
+    def loop(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch = self.collect(first)
+            start_time = time.perf_counter()
+            try:
+                X = batch[0].X if len(batch) == 1 else np.concatenate([request.X for request in batch])
+                p = self.model.score(X)
+                error = None
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+            finished = time.perf_counter()
+            offset = 0
+            for request in batch:
+                if error is None:
+                    request.p = p[offset:offset + len(request.X)]
+                    offset += len(request.X)
+                request.error = error
+                request.done.set()
+            with self.lock:
+                self.counters['requests'] += len(batch)
+                self.counters['rows'] += sum(len(request.X) for request in batch)
+                self.counters['batches'] += 1
+                self.counters['errors'] += 0 if error is None else len(batch)
+                self.counters['scoring_seconds'] += finished - start_time
+                self.latencies.extend(finished - request.arrival for request in batch)
+
+    def statistics(self):
+        """
+        Returns the counters, the throughput and the latency percentiles in milliseconds
+        """
+        with self.lock:
+            result = dict(self.counters)
+            latencies = np.array(self.latencies) * 1000.0
+        seconds = time.time() - self.start_time
+        result.update({'uptime_seconds': seconds, 'rows_per_second': result['rows'] / max(seconds, 1e-9),
+                       'requests_per_second': result['requests'] / max(seconds, 1e-9),
+                       'rows_per_batch': result['rows'] / max(result['batches'], 1),
+                       'requests_per_batch': result['requests'] / max(result['batches'], 1)})
+        result.update(percentiles(latencies, 'latency_ms'))
+        return result
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+def percentiles(values, name):
+    """
+    Returns the 50%, 90%, 99% percentiles and the maximum of the values, or None if there are no values
+    """
+    if len(values) == 0:
+        return {name + '_' + key: None for key in ['p50', 'p90', 'p99', 'max']}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {name + '_p50': float(p50), name + '_p90': float(p90), name + '_p99': float(p99),
+            name + '_max': float(np.max(values))}
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError('Connection closed')
+    return data
+
+
+def read_message(f):
+    """
+    Returns the header and the payload of the next message, see the description at the top
+    """
+    length, = struct.unpack('>I', read_exactly(f, 4))
+    header = json.loads(read_exactly(f, length).decode())
+    return header, read_exactly(f, header.get('bytes', 0))
+
+
+def write_message(f, header, payload=b''):
+    header = dict(header, bytes=len(payload))
+    encoded = json.dumps(header).encode()
+    f.write(struct.pack('>I', len(encoded)) + encoded + payload)
+    f.flush()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Answers the requests of one connection until it is closed
+    """
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        socketserver.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = read_message(self.rfile)
+            except EOFError:
+                return
+            try:
+                response, data = self.server.answer(header, payload)
+            except (KeyError, ValueError, RuntimeError) as e:
+                response, data = {'error': '{}: {}'.format(type(e).__name__, e)}, b''
+            write_message(self.wfile, response, data)
+
+
+class ScoringServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serves the given models (a dictionary name -> loaded model) on address, the first model is the default one
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, models, address=('127.0.0.1', default_port), max_batch=10000, max_delay=0.005):
+        self.models = collections.OrderedDict(models)
+        self.variables = {name: model_variables(model) for name, model in self.models.items()}
+        self.batchers = collections.OrderedDict((name, MicroBatcher(model, max_batch, max_delay))
+                                                for name, model in self.models.items())
+        socketserver.TCPServer.__init__(self, address, Handler)
+
+    def answer(self, header, payload):
+        """
+        Returns the response header and payload to a request
+        """
+        command = header.get('command', 'score')
+        if command == 'stats':
+            return {'stats': {name: batcher.statistics() for name, batcher in self.batchers.items()}}, b''
+        if command == 'models':
+            return {'models': self.variables}, b''
+        if command != 'score':
+            raise ValueError('Unknown command {}'.format(command))
+        name = header.get('model') or next(iter(self.models))
+        if name not in self.models:
+            raise KeyError('Unknown model {}'.format(name))
+        columns = len(self.variables[name])
+        X = np.frombuffer(payload, dtype=np.float32)
+        if header.get('columns') != columns or len(X) != header.get('rows', -1) * columns:
+            raise ValueError('Expected {} rows with {} columns'.format(header.get('rows'), columns))
+        p = self.batchers[name].score(X.reshape(-1, columns))
+        return {'rows': len(p)}, np.ascontiguousarray(p, dtype=np.float32).tobytes()
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        for batcher in self.batchers.values():
+            batcher.close()
+        for model in self.models.values():
+            model.close()
+
+
+class ScoringClient(object):
+    """
+    Connection to a scoring server, the requests of one client are sent one after another
+    """
+    def __init__(self, address=('127.0.0.1', default_port)):
+        self.socket = socket.create_connection(address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, header, payload=b''):
+        write_message(self.file, header, payload)
+        response, data = read_message(self.file)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response, data
+
+    def score(self, X, model=None):
+        """
+        Returns the prediction of the given model (by default the first model of the server) for each row of X
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        response, data = self.request({'command': 'score', 'model': model, 'rows': X.shape[0], 'columns': X.shape[1]},
+                                      X.tobytes())
+        return np.frombuffer(data, dtype=np.float32)
+
+    def statistics(self):
+        return self.request({'command': 'stats'})[0]['stats']
+
+    def models(self):
+        """
+        Returns the input variables of each model of the server
+        """
+        return self.request({'command': 'models'})[0]['models']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_test(address, X, clients=8, requests=200, rows=10, model=None, seed=None):
+    """
+    Sends requests of rows random rows of X from several clients at the same time,
+    returns the throughput and the latency percentiles measured by the clients
+    """
+    latencies = [[] for _ in range(clients)]
+
+    def run(i):
+        random = np.random.RandomState(None if seed is None else seed + i)
+        with ScoringClient(address) as client:
+            for _ in range(requests):
+                batch = X[random.randint(0, len(X) - rows + 1, 1)[0]:][:rows]
+                start_time = time.perf_counter()
+                client.score(batch, model)
+                latencies[i].append(time.perf_counter() - start_time)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start_time
+    n_requests = sum(len(l) for l in latencies)
+    result = {'clients': clients, 'requests': n_requests, 'rows': n_requests * rows, 'seconds': seconds,
+              'requests_per_second': n_requests / seconds, 'rows_per_second': n_requests * rows / seconds}
+    result.update(percentiles(np.concatenate(latencies) * 1000.0, 'latency_ms'))
+    return result
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local scoring service with dynamic micro-batching')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='Load the models and answer requests until interrupted')
+    serve.add_argument('--model', type=str, nargs='+', default=['inference_model_final.pb'],
+                       help='Models as [name=]filename (checkpoint, frozen graph or .npz), the first is the default')
+    serve.add_argument('--address', type=parse_address, default=('127.0.0.1', default_port), help='host:port')
+    serve.add_argument('--max-batch', type=int, default=10000, help='Maximal number of rows scored together')
+    serve.add_argument('--max-delay-ms', type=float, default=5.0,
+                       help='Maximal time a request waits for other requests to be scored with')
+    serve.add_argument('--threads', type=int, default=None, help='Threads of each tensorflow model')
+    load = commands.add_parser('load', help='Measure latency and throughput with concurrent clients')
+    load.add_argument('--address', type=parse_address, default=('127.0.0.1', default_port), help='host:port')
+    load.add_argument('--input', type=str, default='inference_test_sample.store', help='Store with the jets to send')
+    load.add_argument('--model', type=str, default=None)
+    load.add_argument('--clients', type=int, nargs='+', default=[1, 8])
+    load.add_argument('--requests', type=int, default=200, help='Requests of each client')
+    load.add_argument('--rows', type=int, default=10, help='Jets in each request')
+    stats = commands.add_parser('stats', help='Print the counters and latency percentiles of the server')
+    stats.add_argument('--address', type=parse_address, default=('127.0.0.1', default_port), help='host:port')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        models = collections.OrderedDict()
+        for entry in args.model:
+            name, _, filename = entry.rpartition('=')
+            start_time = time.time()
+            models[name or filename] = load_model(filename, args.max_batch, args.threads)
+            print("Loaded", filename, "as", name or filename, "in {:.1f}s".format(time.time() - start_time))
+        server = ScoringServer(models, args.address, args.max_batch, args.max_delay_ms / 1000.0)
+        print("Listening on {}:{}".format(*server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == 'load':
+        import feature_store
+        with ScoringClient(args.address) as client:
+            models = client.models()
+        model = args.model or next(iter(models))
+        store = feature_store.open_store(args.input)
+        X = store.project(models[model], 0, min(len(store), 100000))
+        for clients in args.clients:
+            result = load_test(args.address, X, clients, args.requests, args.rows, model)
+            print(("{clients} clients: {requests_per_second:.0f} requests/second, {rows_per_second:.0f} rows/second, "
+                   "latency p50 {latency_ms_p50:.2f} ms, p99 {latency_ms_p99:.2f} ms").format(**result))
+        with ScoringClient(args.address) as client:
+            print(json.dumps(client.statistics(), indent=2))
+    elif args.command == 'stats':
+        with ScoringClient(args.address) as client:
+            print(json.dumps(client.statistics(), indent=2))
+    else:
+        parser.print_help()
@@ -0,0 +1,8 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+# The tests import the scripts of the repository as modules
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import os
+
+import numpy as np
+import pandas
+import pytest
+
+import converter
+import feature_store
+import flatten
+
+
+def write_pickle(filename, n, seed):
+    # Stand-in for a root file, with the branches read by converter.py
+    random = np.random.RandomState(seed)
+    ntracks = random.randint(0, 10, n)
+    ntowers = random.randint(0, 12, n)
+    df = pandas.DataFrame({'jetPt': random.uniform(100, 200, n), 'jetEta': random.normal(size=n),
+                           'jetPhi': random.uniform(-3, 3, n), 'jetMass': random.uniform(5, 30, n),
+                           'ntracks': ntracks, 'ntowers': ntowers})
+    for name in flatten.track_columns:
+        df[name] = [random.randint(-1, 2, k).astype(np.float32) if name == 'trackCharge' else random.rand(k)
+                    for k in ntracks]
+    for name in flatten.tower_columns:
+        df[name] = [random.rand(k) for k in ntowers]
+    df.to_pickle(filename)
+
+
+def convert_serial(files, output, chunk_size):
+    with converter.create_writer(output) as writer:
+        for filename in files:
+            for chunk in converter.read_chunks(filename, chunk_size):
+                writer.append(chunk[converter.jet_branches].to_numpy(dtype=np.float32),
+                              ragged={name: flatten.ragged_offsets(chunk[name])
+                                      for name in converter.constituent_branches})
+
+
+def test_parallel_conversion_equals_serial_conversion(tmp_path):
+    files = []
+    for i, n in enumerate([23, 0, 17, 40]):
+        files.append(str(tmp_path / '{}.pickle'.format(i)))
+        write_pickle(files[-1], n, i)
+    convert_serial(files, str(tmp_path / 'serial.store'), chunk_size=7)
+    converter.convert(files, str(tmp_path / 'parallel.store'), chunk_size=7, workers=2)
+    serial = feature_store.open_store(str(tmp_path / 'serial.store'))
+    parallel = feature_store.open_store(str(tmp_path / 'parallel.store'))
+    assert isinstance(parallel, feature_store.VirtualStore)
+    assert len(parallel) == len(serial) == 80
+    assert parallel.variables == serial.variables
+    assert sorted(parallel.ragged_columns) == sorted(serial.ragged_columns)
+    # The whole store and ranges across the boundaries of the converted files
+    for start, stop in [(0, None), (10, 50), (23, 23), (30, 45)]:
+        assert np.array_equal(parallel.rows(start, stop), serial.rows(start, stop))
+        for name in converter.constituent_branches:
+            for a, b in zip(parallel.ragged(name, start, stop), serial.ragged(name, start, stop)):
+                assert a.dtype == b.dtype
+                assert np.array_equal(a, b)
+    flatten.flatten_store(parallel, str(tmp_path / 'parallel_flat.store'), chunk_size=9)
+    flatten.flatten_store(serial, str(tmp_path / 'serial_flat.store'), chunk_size=9)
+    assert np.array_equal(feature_store.open_store(str(tmp_path / 'parallel_flat.store')).rows(),
+                          feature_store.open_store(str(tmp_path / 'serial_flat.store')).rows())
+
+
+def test_failed_conversion_removes_output(tmp_path):
+    write_pickle(str(tmp_path / 'good.pickle'), 5, 0)
+    with pytest.raises(IOError):
+        converter.convert([str(tmp_path / 'good.pickle'), str(tmp_path / 'missing.pickle')],
+                          str(tmp_path / 'out.store'), workers=2)
+    assert not os.path.exists(str(tmp_path / 'out.store'))
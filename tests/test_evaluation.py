@@ -0,0 +1,26 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import numpy as np
+
+import evaluation
+
+
+def test_exact_bootstrap_resamples_the_exact_auc():
+    random = np.random.RandomState(0)
+    y = random.randint(0, 2, 200).astype(bool)
+    # Rounded predictions, so there are ties
+    p = np.round(random.normal(size=200) + y, 1)
+    w = random.uniform(0.5, 1.5, size=200)
+    auc, lower, upper = evaluation.bootstrap_auc(y, p, w, n_bootstrap=50, bins=None, seed=1)
+    assert auc == evaluation.auc(y, p, w)
+    multiplicities = np.random.RandomState(1).poisson(1.0, (50, 200))
+    replicas = [evaluation.auc(y, p, w * m) for m in multiplicities]
+    assert np.allclose([lower, upper], np.percentile(replicas, [16, 84]))
+
+
+def test_exact_bootstrap_chunks():
+    random = np.random.RandomState(0)
+    y = random.randint(0, 2, 100).astype(bool)
+    p = random.normal(size=100) + y
+    assert (evaluation.bootstrap_auc(y, p, n_bootstrap=30, bins=None, seed=2) ==
+            evaluation.bootstrap_auc(y, p, n_bootstrap=30, bins=None, seed=2, chunk_entries=1000))
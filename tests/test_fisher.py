@@ -0,0 +1,37 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import numpy as np
+
+import evaluation
+import fisher
+
+
+def fit(X, y, shrinkage=1e-3):
+    model = fisher.StreamingFisher(list(range(X.shape[1])), shrinkage)
+    model.statistics[0].add(X[~y])
+    model.statistics[1].add(X[y])
+    return model.finalize()
+
+
+def toy_sample(n=20000, seed=0):
+    # Variables with very different scales and an always zero column like the padded tracks
+    random = np.random.RandomState(seed)
+    y = random.rand(n) < 0.5
+    X = random.normal(size=(n, 4)) + 0.3 * y[:, np.newaxis]
+    X *= np.array([1000.0, 1.0, 0.001, 0.0])
+    return X, y
+
+
+def test_rescaled_column_keeps_scores():
+    X, y = toy_sample()
+    p = fit(X, y).decision_function(X)
+    scaled = X.copy()
+    scaled[:, 2] *= 1e6
+    assert np.allclose(fit(scaled, y).decision_function(scaled), p, rtol=1e-3, atol=1e-3)
+
+
+def test_shrinkage_keeps_small_variables():
+    X, y = toy_sample()
+    unregularised = fit(X[:, :3], y, shrinkage=0.0)
+    assert abs(evaluation.auc(y, fit(X, y).decision_function(X)) -
+               evaluation.auc(y, unregularised.decision_function(X[:, :3]))) < 1e-3
@@ -0,0 +1,53 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import os
+
+import numpy as np
+import pytest
+
+import converter
+import create_training_samples
+import feature_store
+import flatten
+import jet_frame
+
+variables = converter.jet_branches + flatten.flat_names()
+
+
+def write_flat(filename, n, seed):
+    random = np.random.RandomState(seed)
+    X = random.rand(n, len(variables)).astype(np.float32) + 0.5
+    X[:, variables.index('ntracks')] = random.randint(0, 50, n)
+    X[:, variables.index('ntowers')] = random.randint(0, 60, n)
+    X[:, [i for i, v in enumerate(variables) if v.startswith('trackCharge')]] = random.randint(-1, 2, (n, 52))
+    with feature_store.StoreWriter(filename, variables) as writer:
+        writer.append(X)
+    return X
+
+
+def test_virtual_store_is_transformed_per_source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    quarks = write_flat('quarks_flat.store', 50, 0)
+    gluons = write_flat('gluons_flat.store', 30, 1)
+    create_training_samples.write_sample('sample.store', [('quarks_flat.store', True), ('gluons_flat.store', False)],
+                                         'is_quark')
+    store = jet_frame.transformed_store('sample.store')
+    assert isinstance(store, feature_store.VirtualStore)
+    assert os.path.abspath(store.path) == os.path.abspath('sample_jet_frame.store')
+    assert os.path.exists('quarks_flat_transformed.store') and os.path.exists('gluons_flat_transformed.store')
+    expected = jet_frame.transform_block(np.concatenate([quarks, gluons]), variables)
+    assert np.allclose(store.project(variables), expected)
+    assert np.array_equal(np.array(store.column('is_quark')), np.arange(80) < 50)
+    # The cache is reused as long as the sample does not change
+    modified = os.path.getmtime('sample_jet_frame.store/manifest.json')
+    jet_frame.transformed_store('sample.store')
+    assert os.path.getmtime('sample_jet_frame.store/manifest.json') == modified
+
+
+def test_virtual_store_is_not_overwritten(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_flat('quarks_flat.store', 10, 0)
+    create_training_samples.write_sample('sample.store', [('quarks_flat.store', True)], 'is_quark')
+    with pytest.raises(ValueError):
+        jet_frame.transform_store('quarks_flat.store', 'sample.store')
+    assert isinstance(feature_store.open_store('sample.store'), feature_store.VirtualStore)
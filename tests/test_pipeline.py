@@ -0,0 +1,37 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import json
+import os
+import sys
+
+import pipeline
+
+# Writes its arguments into out.json, fails while the file fail exists
+script = '''
+import json, os, sys
+with open('out.json', 'w') as f:
+    json.dump(sys.argv[1:], f)
+sys.exit(1 if os.path.exists('fail') else 0)
+'''
+
+
+def run_stage(force=False):
+    stage = pipeline.Stage('train', [sys.executable, 'script.py'], ['script.py'], ['out.json'], ['--resume'])
+    report = pipeline.run([stage], force=force)
+    with open('out.json') as f:
+        return report['train']['status'], json.load(f)
+
+
+def test_resume_only_unfinished_attempts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('script.py', 'w') as f:
+        f.write(script)
+    assert run_stage() == ('done', [])
+    # A forced rerun of a finished stage starts from scratch
+    assert run_stage(force=True) == ('done', [])
+    open('fail', 'w').close()
+    assert run_stage(force=True) == ('failed (1)', [])
+    os.remove('fail')
+    # The next attempt on the same inputs continues the failed one
+    assert run_stage() == ('done', ['--resume'])
+    assert run_stage(force=True) == ('done', [])
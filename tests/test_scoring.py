@@ -0,0 +1,41 @@
+# Thomas Keck and Jochen Gemmler 2017
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import export_model
+import numpy_model
+import scoring
+import tf_model
+
+
+@pytest.mark.parametrize('keep_prob_placeholder', [True, False])
+def test_checkpoint_frozen_graph_and_numpy_model_agree(tmp_path, keep_prob_placeholder):
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.float32, [None, len(tf_model.variables)], name='x')
+        # Checkpoints of tf_model.py have a keep_prob placeholder, older ones a constant keep probability
+        keep_prob = tf.placeholder_with_default(0.75, [], name='keep_prob') if keep_prob_placeholder else 0.75
+        tf_model.get_model(x, keep_prob)
+        p = tf_model.get_model(x, keep_prob)
+        tf.add_to_collection('x', x)
+        tf.add_to_collection('p', p)
+        with tf.Session() as session:
+            session.run(tf.global_variables_initializer())
+            checkpoint = tf.train.Saver().save(session, str(tmp_path / 'model'), global_step=0)
+    export_model.freeze(checkpoint, str(tmp_path / 'model.pb'))
+    numpy_model.export_weights(checkpoint, str(tmp_path / 'model.npz'))
+
+    X = np.random.RandomState(0).rand(1000, len(tf_model.variables)).astype(np.float32)
+    with scoring.Scorer(checkpoint) as scorer:
+        p_checkpoint = scorer.score(X)
+        # Without dropout the predictions are deterministic
+        assert np.array_equal(scorer.score(X), p_checkpoint)
+    with scoring.Scorer(str(tmp_path / 'model.pb')) as scorer:
+        p_frozen = scorer.score(X)
+    with numpy_model.NumpyModel(str(tmp_path / 'model.npz')) as model:
+        p_numpy = model.score(X)
+    assert np.allclose(p_frozen, p_checkpoint, atol=1e-5)
+    assert np.allclose(p_numpy, p_checkpoint, atol=1e-5)
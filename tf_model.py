@@ -3,12 +3,21 @@
 
 # Thomas Keck and Jochen Gemmler 2017
 
+import argparse
+import glob
 import numpy as np
 import tensorflow as tf
-import pandas
+import hashlib
 import os
+import time
 
-os.environ['CUDA_VISIBLE_DEVICES']='2'
+import batches
+import data_parallel
+import feature_store
+import instrumentation
+
+# The data-parallel workers hide the gpus (see data_parallel.py)
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '2')
 
 # We use all available variables
 # - Global variables of the jet
@@ -25,25 +34,81 @@ for v in ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']:
         variables += [v + '_' + str(i)]
 
 
-def batch_generator(filename, target, batch_size):
+def batch_generator(filename, target, batch_size, prefetch=2, weights=None, seed=None, start=0, shard=None):
     """
     Returns random batch from the datafile, and ensures
     that the numpy ndarrays have the correct format, to avoid
-    any weird memory problems
+    any weird memory problems.
+    The batches are gathered from the memory-mapped store on a background thread (see batches.py),
+    the tracks and towers of sparse stores (see flatten.py --sparse) are zero-padded only for each batch.
+    If per-jet weights are given, the batches are (x, y, w) instead of (x, y).
+    With a seed the batches are reproducible and start skips the batches of the steps before a resumed training,
+    shard selects the batches of a data-parallel worker
+    """
+    store = feature_store.open_store(filename)
+    columns = [store.column(target)] + ([] if weights is None else [weights])
+    return iter(batches.BatchEngine(store.blocks(variables), columns, batch_size, prefetch=prefetch, seed=seed, start=start,
+                                    shard=shard))
+
+
+def latest_checkpoint(prefix):
+    """
+    Returns the latest complete checkpoint saved with the given prefix (e.g. boost_model-99999 for boost_model)
+    and its step, or (None, -1) if there is none. Checkpoints without their data files (e.g. the shipped
+    inference_model_final-999999, which only contains the graph) are ignored
+    """
+    steps = [index[len(prefix) + 1:-len('.index')] for index in glob.glob(prefix + '-*.index')]
+    steps = [int(step) for step in steps if step.isdigit() and glob.glob(prefix + '-' + step + '.data-*')]
+    if len(steps) == 0:
+        return None, -1
+    return prefix + '-' + str(max(steps)), max(steps)
+
+
+def checkpoint_key(checkpoint):
+    """
+    Identifies the weights saved in a checkpoint,
+    the index file of a checkpoint contains a checksum of every saved tensor
+    """
+    with open(checkpoint + '.index', 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def boost_weights_file(filename, checkpoint):
     """
-    df = pandas.read_pickle(filename)
-    while True:
-        df = df.sample(frac=1).reset_index(drop=True)
-        for pos in range(0, len(df)-batch_size-1, batch_size):
-            x = df.loc[pos:pos + batch_size-1, variables].values
-            y = df.loc[pos:pos + batch_size-1, target].values
-            y = np.reshape(y, (len(y), 1))
-            x = np.require(x, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-            y = np.require(y, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-            yield x, y
-
-
-def get_model(x):
+    Returns the file in which the boost weights of the given store and boost checkpoint are cached
+    """
+    # A rewritten sample has to invalidate the cache as well, so the modification time of the sample is part of the key
+    key = checkpoint_key(checkpoint) + '-' + str(int(feature_store.open_store(filename).modification_time() * 1e6))
+    return os.path.join(filename, 'boost_weights-' + key + '.npy')
+
+
+def boost_weights(filename, checkpoint, session, x, boost_activation, feed_dict=None, batch_size=100000, epsilon=1e-5):
+    """
+    Returns the boost weights w = p / (1-p) for all jets in the given store.
+    The frozen boost network is applied once in large batches, the weights are cached
+    next to the sample and reused as long as the boost checkpoint does not change
+    """
+    store = feature_store.open_store(filename)
+    cache = boost_weights_file(filename, checkpoint)
+    if os.path.exists(cache):
+        print('Load boost weights from', cache)
+        return np.load(cache, mmap_mode='r')
+
+    print('Calculate boost weights for', filename)
+    weights = np.empty(len(store), dtype=np.float32)
+    for start, stop in store.chunks(batch_size):
+        feed = {x: store.project(variables, start, stop)}
+        feed.update({} if feed_dict is None else feed_dict)
+        p = session.run(boost_activation, feed_dict=feed)[:, 0]
+        weights[start:stop] = (p + epsilon) / (1 - p + epsilon)
+
+    with open(cache + '.tmp', 'wb') as f:
+        np.save(f, weights)
+    os.replace(cache + '.tmp', cache)
+    return weights
+
+
+def get_model(x, keep_prob=.75):
     """
     Returns our neural network model.
     4 Hidden Layers with sigmoid activation and dropout.
@@ -56,7 +121,7 @@ def get_model(x):
             layer = unit(tf.matmul(x, weights) + biases)
         return layer
 
-    dropout_const = .75
+    dropout_const = keep_prob
     hidden1 = layer(x, [len(variables), 400], 'hidden1')
     hidden1 = tf.nn.dropout(hidden1, dropout_const)
     hidden2 = layer(hidden1, [400, 400], 'hidden2')
@@ -69,15 +134,42 @@ def get_model(x):
     return activation
 
 
-if __name__ == '__main__':
+def train(args, worker=None):
+    """
+    Trains the boost and the inference network, in one of several worker processes if a worker is given
+    (see data_parallel.py). Only the first worker prints, saves the checkpoints and writes the log
+    """
+    first_worker = worker is None or worker.rank == 0
+    n_workers = 1 if worker is None else worker.n_workers
+    shard = None if worker is None else worker.shard
+    # The workers draw different dropout masks, their parameters are synchronised after the initialisation.
+    # The shuffles of the tf.data pipeline do not depend on this seed (see input_pipeline.py)
+    tf.set_random_seed(args.seed if worker is None else args.seed + worker.rank)
+    use_dataset = args.input_pipeline == 'dataset'
+    monitor = instrumentation.from_arguments(args) if first_worker else instrumentation.TrainingMonitor()
 
-    n_iterations = int(1e6)
+    n_iterations = args.iterations
     use_boost = True
     epsilon = 1e-5
-    
-    x = tf.placeholder(tf.float32, [None, len(variables)], name='x')
-    y = tf.placeholder(tf.float32, [None, 1], name='y')
-    w = tf.placeholder(tf.float32, [None, 1], name='w')
+    batch_size = 200
+    # Weights of signal and background, which correct the signal to background fraction (see below)
+    boost_class_weights = (0.5 * (0.71 / 0.29 + 1), 0.5 * (0.29 / 0.71 + 1))
+    inference_class_weights = (0.5 * (0.29 / 0.71 + 1), 0.5 * (0.71 / 0.29 + 1))
+
+    if use_dataset:
+        # The inputs are connected to the batches of the tf.data pipeline,
+        # they can still be fed (e.g. to apply the boost network or in apply.py)
+        import input_pipeline
+        iterator, (batch_x, batch_y, batch_w) = input_pipeline.training_inputs(len(variables))
+        x = tf.placeholder_with_default(batch_x, [None, len(variables)], name='x')
+        y = tf.placeholder_with_default(batch_y, [None, 1], name='y')
+        w = tf.placeholder_with_default(batch_w, [None, 1], name='w')
+    else:
+        x = tf.placeholder(tf.float32, [None, len(variables)], name='x')
+        y = tf.placeholder(tf.float32, [None, 1], name='y')
+        w = tf.placeholder(tf.float32, [None, 1], name='w')
+    # Dropout is used during the training, it is switched off (keep_prob = 1) to apply the frozen boost network
+    keep_prob = tf.placeholder_with_default(0.75, [], name='keep_prob')
     
     optimizer = tf.train.AdamOptimizer(learning_rate=0.0001)
 
@@ -86,91 +178,186 @@ if __name__ == '__main__':
     # The model learns the differences and outputs a probability to be "modified" (=data),
     # this probability is used to weight the inference training input,
     # this technique is known in literature to remove differences between data and MC
-    boost_activation = get_model(x)
+    boost_activation = get_model(x, keep_prob)
     loss_boost = -tf.reduce_sum(y * w * tf.log(boost_activation + epsilon) +
                                 (1.0 - y) * w * tf.log(1 - boost_activation + epsilon)) / tf.reduce_sum(w)
-    minimize_boost = optimizer.minimize(loss_boost)
+    minimize_boost = data_parallel.minimize(optimizer, loss_boost, worker)
     
     # Inference model
     # Trained to distinguish quarks from gluon jets
-    inference_activation = get_model(x)
+    inference_activation = get_model(x, keep_prob)
     loss = -tf.reduce_sum(y * w * tf.log(inference_activation + epsilon) +
                                 (1.0 - y) * w * tf.log(1 - inference_activation + epsilon)) / tf.reduce_sum(w)
-    minimize = optimizer.minimize(loss)
+    minimize = data_parallel.minimize(optimizer, loss, worker)
     
     # Initialise tensorflow
     init = tf.global_variables_initializer()
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    session = tf.Session(config=config)
+    session = tf.Session(config=data_parallel.session_config(args.intra_threads, args.inter_threads))
     session.run(init)
+    saver = tf.train.Saver()
+
+    # Continue from the latest checkpoints, they contain all variables including the state of the optimizer.
+    # The batches are drawn with fixed seeds, the batches of the finished steps are skipped,
+    # so with feed_dict a resumed training sees the same batches as an uninterrupted one.
+    # With --input-pipeline dataset it does not: the pipeline restarts at a block boundary with an empty
+    # interleave and shuffle buffer, so the following batches differ (see input_pipeline.py).
+    # Only resume checkpoints of an interrupted run with the same --iterations and --seed
+    boost_checkpoint, boost_step = latest_checkpoint('boost_model') if args.resume else (None, -1)
+    inference_checkpoint, inference_step = latest_checkpoint('inference_model_final') if args.resume else (None, -1)
+    if inference_step >= n_iterations:
+        raise RuntimeError('{} is beyond --iterations {}, it was written by another run'.format(
+                           inference_checkpoint, n_iterations))
+    if inference_checkpoint is not None:
+        print('Continue the inference training from', inference_checkpoint)
+        saver.restore(session, inference_checkpoint)
+    elif boost_checkpoint is not None:
+        print('Continue from', boost_checkpoint)
+        saver.restore(session, boost_checkpoint)
+    minimize_boost.broadcast(session)
+    minimize.broadcast(session)
+    # The boost network is finished if its last step was saved or the inference training has started
+    # At least one step, so there is a boost checkpoint for the boost weights even with --iterations < 10
+    n_boost_iterations = max(1, n_iterations // 10)
+    first_boost_step = n_boost_iterations if inference_checkpoint is not None else boost_step + 1
     
     # Train Boost Network
-    if use_boost:
-        saver = tf.train.Saver()
-        
-        batch = batch_generator('boost_training_sample.pickle', 'is_data', 200)
+    if use_boost and first_boost_step >= n_boost_iterations:
+        if boost_checkpoint is None:
+            raise RuntimeError('The inference training was started with a boost network, but there is no boost checkpoint')
+        print('Use the trained boost network', boost_checkpoint)
+    elif use_boost:
+        if use_dataset:
+            batch = None
+            session.run(iterator.make_initializer(input_pipeline.training_dataset(
+                'boost_training_sample.store', 'is_data', batch_size, variables, class_weights=boost_class_weights,
+                seed=args.seed, skip=first_boost_step, shard=shard)))
+        else:
+            batch = batch_generator('boost_training_sample.store', 'is_data', batch_size,
+                                    seed=args.seed, start=first_boost_step, shard=shard)
+        monitor.start('boost')
 
-        for step in range(n_iterations // 10):
+        for step in range(first_boost_step, n_boost_iterations):
+            monitor.begin_step()
 
-            batch_xs, batch_ys = next(batch)
-            batch_ws = np.ones(len(batch_ys))
-            # Correct signal to background fraction (see below)
-            # We have 71% background (standard) and 29% signal (modified)
-            batch_ws = np.where(batch_ys[:, 0] == 1, 0.5 * (0.71 / 0.29 + 1), 0.5 * (0.29 / 0.71 + 1)) * batch_ws
-            batch_ws = np.reshape(batch_ws, (len(batch_ys), 1))
-            batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-            feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
-            _, loss_value = session.run([minimize_boost, loss_boost], feed_dict=feed_dict)
+            if use_dataset:
+                feed_dict = None
+            else:
+                batch_xs, batch_ys = next(batch)
+                batch_ws = np.ones(len(batch_ys))
+                # Correct signal to background fraction (see below)
+                # We have 71% background (standard) and 29% signal (modified)
+                batch_ws = np.where(batch_ys[:, 0] == 1, boost_class_weights[0], boost_class_weights[1]) * batch_ws
+                batch_ws = np.reshape(batch_ws, (len(batch_ys), 1))
+                batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
+                feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
+            monitor.lap('batch')
+            loss_value = minimize_boost.run(session, step, feed_dict, **monitor.run_options(step))
+            monitor.lap('optimizer')
+            monitor.end_step(step, n_workers * batch_size, loss_value)
 
-            if step % 500 == 0:
+            if step % 500 == 0 and first_worker:
                 print('Step %d: loss = %.2f' % (step, loss_value))
 
-            if (step + 1) % 10000 == 0 or (step + 1) == n_iterations:
+            if first_worker and ((step + 1) % 10000 == 0 or (step + 1) == n_boost_iterations):
                 print('Save model')
-                saver.save(session, 'boost_model', global_step=step)
+                boost_checkpoint = saver.save(session, 'boost_model', global_step=step)
 
     
         del batch
+
+    if use_boost:
+        # We apply the frozen boost network once to calculate the weights of the inference training sample,
+        # the weight formula is w = p / (1-p).
+        # The network is applied without dropout (keep_prob = 1), so the weights are deterministic and can be cached.
+        # Before, the weights were calculated for every batch with dropout active, i.e. with a random subnetwork,
+        # so the weights (and the trained inference network) differ slightly from those of the old training
+        # see http://www-ekp.physik.uni-karlsruhe.de/~jwagner/www/publications/AdvancedReweighting_MVA_ACAT2011.pdf
+        # The first worker calculates them, the other workers load them from the cache afterwards
+        start_time = time.time()
+        if not first_worker:
+            worker.barrier()
+            boost_checkpoint, _ = latest_checkpoint('boost_model')
+        weights = boost_weights('inference_training_sample.store', boost_checkpoint, session, x, boost_activation,
+                                feed_dict={keep_prob: 1.0}, epsilon=epsilon)
+        if first_worker and worker is not None:
+            worker.barrier()
+        print('Boost weights ready after %.1fs' % (time.time() - start_time))
+    else:
+        weights = None
+
     tf.add_to_collection('x', x)
     tf.add_to_collection('y', y)
     tf.add_to_collection('p', inference_activation)
 
-    saver = tf.train.Saver()
-
     # Train inference network
-    batch = batch_generator('inference_training_sample.pickle', 'is_quark', 200)
-
-    for step in range(n_iterations):
-        batch_xs, batch_ys = next(batch)
-        if use_boost:
-            # We apply the boost network to calculate the weights,
-            # the weight formula is w = p / (1-p)
-            # see http://www-ekp.physik.uni-karlsruhe.de/~jwagner/www/publications/AdvancedReweighting_MVA_ACAT2011.pdf
-            batch_ws = session.run(boost_activation, feed_dict={x: batch_xs})
-            batch_ws = (batch_ws + epsilon) / (1 - batch_ws + epsilon)
-            batch_ws = batch_ws[:, 0]
+    # We normalise the events, so that there is the same amount of signal-weight and background-weight
+    # in the training, using the ratios we know from the standard datasets
+    # 71% signal (quarks), 29% background (gluons)
+    # The formula is:
+    #   w_s = 1/2 * (1 + N_B / N_S)
+    #   w_b = 1/2 * (1 + N_S / N_B)
+    # The numbers are the opposite of the ones in the boosting network, this is by chance!
+    if use_dataset:
+        batch = None
+        # The cached boost weights are read by the pipeline directly from their file
+        session.run(iterator.make_initializer(input_pipeline.training_dataset(
+            'inference_training_sample.store', 'is_quark', batch_size, variables,
+            weights_file=boost_weights_file('inference_training_sample.store', boost_checkpoint) if use_boost else None,
+            class_weights=inference_class_weights, seed=args.seed + 1, skip=inference_step + 1, shard=shard)))
+    else:
+        batch = batch_generator('inference_training_sample.store', 'is_quark', batch_size, weights=weights,
+                                seed=args.seed + 1, start=inference_step + 1, shard=shard)
+    monitor.start('inference')
+
+    for step in range(inference_step + 1, n_iterations):
+        monitor.begin_step()
+        if use_dataset:
+            feed_dict = None
         else:
-            batch_ws = np.ones(len(batch_ys))
-        # We normalise the events, so that there is the same amount of signal-weight and background-weight
-        # in the training, using the ratios we know from the standard datasets
-        # 71% signal (quarks), 29% background (gluons)
-        # The formula is:
-        #   w_s = 1/2 * (1 + N_B / N_S)
-        #   w_b = 1/2 * (1 + N_S / N_B)
-        # The numbers are the opposite of the ones in the boosting network, this is by chance!
-        batch_ws = np.where(batch_ys[:, 0] == 1, 0.5 * (0.29 / 0.71 + 1), 0.5 * (0.71 / 0.29 + 1)) * batch_ws
-        batch_ws = np.reshape(batch_ws, (len(batch_ys), 1))
-        batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-
-        feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
-        _, loss_value = session.run([minimize, loss], feed_dict=feed_dict)
-
-        if step % 500 == 0:
+            if use_boost:
+                # The precomputed boost weights are read together with each batch
+                batch_xs, batch_ys, batch_ws = next(batch)
+                batch_ws = batch_ws[:, 0]
+            else:
+                batch_xs, batch_ys = next(batch)
+                batch_ws = np.ones(len(batch_ys))
+            batch_ws = np.where(batch_ys[:, 0] == 1, inference_class_weights[0], inference_class_weights[1]) * batch_ws
+            batch_ws = np.reshape(batch_ws, (len(batch_ys), 1))
+            batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
+            feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
+        monitor.lap('batch')
+        loss_value = minimize.run(session, step, feed_dict, **monitor.run_options(step))
+        monitor.lap('optimizer')
+        monitor.end_step(step, n_workers * batch_size, loss_value)
+
+        if step % 500 == 0 and first_worker:
             print('Step %d: loss = %.2f' % (step, loss_value))
 
-        if (step + 1) % 10000 == 0 or (step + 1) == n_iterations:
+        if first_worker and ((step + 1) % 10000 == 0 or (step + 1) == n_iterations):
             print('Save model')
             saver.save(session, 'inference_model_final', global_step=step)
   
     del batch
+    monitor.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the boost and the inference network')
+    parser.add_argument('--input-pipeline', choices=['feed_dict', 'dataset'], default='feed_dict',
+                        help='Feed numpy batches or read the batches with tf.data (see input_pipeline.py). '
+                             'A training resumed with tf.data does not see the same batches as an uninterrupted one, '
+                             'the result is not bit-identical')
+    parser.add_argument('--iterations', type=int, default=int(1e6),
+                        help='Training steps of the inference network, the boost network is trained a tenth of them')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the batch order and of the tensorflow graph')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted training from the latest checkpoints instead of starting from scratch, '
+                             'only with feed_dict the result is identical to an uninterrupted training')
+    instrumentation.add_arguments(parser)
+    data_parallel.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        data_parallel.launch(train, args)
+    else:
+        train(args)
@@ -3,11 +3,15 @@
 
 # Thomas Keck and Jochen Gemmler 2017
 
+import argparse
 import numpy as np
 import tensorflow as tf
-import pandas
 import os
 
+import batches
+import instrumentation
+import jet_frame
+
 os.environ['CUDA_VISIBLE_DEVICES']='3'
 
 # We use all available variables
@@ -25,32 +29,15 @@ for v in ['towerE', 'towerEem', 'towerEhad', 'towerEta', 'towerPhi']:
         variables += [v + '_' + str(i)]
 
 
-def batch_generator(filename, target, batch_size):
+def batch_generator(filename, target, batch_size, prefetch=2):
     """
     Returns random batch from the datafile, and ensures
     that the numpy ndarrays have the correct format, to avoid
-    any weird memory problems
+    any weird memory problems.
+    The tracks and towers are used in the frame of the jet, the transformed sample is cached (see jet_frame.py)
     """
-    df = pandas.read_pickle(filename)
-    for i in range(52):
-        df['trackEta_' + str(i)] -= df['jetEta']
-        df['trackPhi_' + str(i)] -= df['jetPhi']
-        df['trackPt_' + str(i)] /= df['jetPt']
-    for i in range(67):
-        df['towerEta_' + str(i)] -= df['jetEta']
-        df['towerE_' + str(i)] /= df['jetPt']
-        df['towerEem_' + str(i)] /= df['jetPt']
-        df['towerEhad_' + str(i)] /= df['jetPt']
-
-    while True:
-        df = df.sample(frac=1).reset_index(drop=True)
-        for pos in range(0, len(df)-batch_size-1, batch_size):
-            x = df.loc[pos:pos + batch_size-1, variables].values
-            y = df.loc[pos:pos + batch_size-1, target].values
-            y = np.reshape(y, (len(y), 1))
-            x = np.require(x, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-            y = np.require(y, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
-            yield x, y
+    store = jet_frame.transformed_store(filename)
+    return iter(batches.BatchEngine(store.blocks(variables), [store.column(target)], batch_size, prefetch=prefetch))
 
 
 def get_model(x):
@@ -80,6 +67,10 @@ def get_model(x):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the boost and the inference network in the jet frame')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    monitor = instrumentation.from_arguments(args)
 
     n_iterations = int(1e6)
     use_boost = True
@@ -119,9 +110,11 @@ if __name__ == '__main__':
     if use_boost:
         saver = tf.train.Saver()
         
-        batch = batch_generator('boost_training_sample.pickle', 'is_data', 200)
+        batch = batch_generator('boost_training_sample.store', 'is_data', 200)
+        monitor.start('boost')
 
         for step in range(n_iterations // 10):
+            monitor.begin_step()
 
             batch_xs, batch_ys = next(batch)
             batch_ws = np.ones(len(batch_ys))
@@ -131,7 +124,10 @@ if __name__ == '__main__':
             batch_ws = np.reshape(batch_ws, (len(batch_ys), 1))
             batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
             feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
-            _, loss_value = session.run([minimize_boost, loss_boost], feed_dict=feed_dict)
+            monitor.lap('batch')
+            _, loss_value = session.run([minimize_boost, loss_boost], feed_dict=feed_dict, **monitor.run_options(step))
+            monitor.lap('optimizer')
+            monitor.end_step(step, len(batch_ys), loss_value)
 
             if step % 500 == 0:
                 print('Step %d: loss = %.2f' % (step, loss_value))
@@ -149,10 +145,13 @@ if __name__ == '__main__':
     saver = tf.train.Saver()
 
     # Train inference network
-    batch = batch_generator('inference_training_sample.pickle', 'is_quark', 200)
+    batch = batch_generator('inference_training_sample.store', 'is_quark', 200)
+    monitor.start('inference')
 
     for step in range(n_iterations):
+        monitor.begin_step()
         batch_xs, batch_ys = next(batch)
+        monitor.lap('batch')
         if use_boost:
             # We apply the boost network to calculate the weights,
             # the weight formula is w = p / (1-p)
@@ -174,7 +173,10 @@ if __name__ == '__main__':
         batch_ws = np.require(batch_ws, dtype=np.float32, requirements=['A', 'W', 'C', 'O'])
 
         feed_dict = {x: batch_xs, y: batch_ys, w: batch_ws}
-        _, loss_value = session.run([minimize, loss], feed_dict=feed_dict)
+        monitor.lap('boost_weights')
+        _, loss_value = session.run([minimize, loss], feed_dict=feed_dict, **monitor.run_options(step))
+        monitor.lap('optimizer')
+        monitor.end_step(step, len(batch_ys), loss_value)
 
         if step % 500 == 0:
             print('Step %d: loss = %.2f' % (step, loss_value))
@@ -184,3 +186,4 @@ if __name__ == '__main__':
             saver.save(session, 'inference_model_final_transformed', global_step=step)
   
     del batch
+    monitor.close()